@@ -1,3 +1,21 @@
 from django.contrib import admin
+from django.urls import reverse
+from django.utils.html import format_html
 
-# Register your models here.
+from .lib.Thumbnailer import thumbnailer
+from .models import GpsObservation
+
+
+@admin.register(GpsObservation)
+class GpsObservationAdmin(admin.ModelAdmin):
+    list_display = ("id", "preview", "lat", "lon", "timestamp", "source", "received_at")
+    list_filter = ("source",)
+    date_hierarchy = "received_at"
+    readonly_fields = ("preview",)
+
+    @admin.display(description="photo")
+    def preview(self, observation):
+        if not thumbnailer.exists(observation.content_hash):
+            return "-"
+        url = reverse("thumbnail", args=[observation.content_hash, 160])
+        return format_html('<img src="{}" alt="" style="max-height: 80px;" />', url)
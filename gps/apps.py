@@ -4,3 +4,19 @@ from django.apps import AppConfig
 class GpsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "gps"
+
+    def ready(self):
+        from django.conf import settings
+
+        from .lib.ObservationWriter import observation_writer
+        from .lib.Tracing import Tracing
+        from .lib.Thumbnailer import thumbnailer
+        from .lib.TrailNetwork import trail_network
+
+        Tracing.configure(settings.OTEL_TRACES_EXPORTER)
+        trail_network.configure(
+            settings.GPS_TRAILS_FILE, settings.GPS_TRAIL_SNAP_METERS
+        )
+        thumbnailer.configure(settings.GPS_THUMBNAIL_WORKERS)
+        if settings.GPS_STORE_OBSERVATIONS:
+            observation_writer.check_migrations_on_first_request()
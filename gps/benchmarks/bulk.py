@@ -0,0 +1,89 @@
+##
+# What batching buys the bulk path (ImageGps.extract_many, and so the
+# extract_gps command and the batch upload view).
+#
+#   python -m gps.benchmarks.bulk [--images 2000] [--workers 4] [--runs 3]
+#
+# Reports, over geotagged synthetic JPEGs:
+#   conversion - DMS to lat/lon for every image's GPS IFD, one
+#                ImageGps.get_lat_lon call each against one
+#                DmsArrays.from_gps_ifds call for them all
+#   throughput - images/s through extract_many with one image per task (the
+#                old behaviour) and with the default batches, which convert
+#                through DmsArrays and pay the pool's per-task overhead once
+#                per batch
+# Medians over --runs, as JSON.
+import argparse
+import json
+import statistics
+import time
+
+from gps.lib.ByteSource import ByteSource
+from gps.lib.DmsArrays import DmsArrays
+from gps.lib.ImageGps import ImageGps
+from .corpus import make_image
+
+IMAGE_BYTES = 8 * 1024
+
+
+def median_time(fn, runs: int) -> float:
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def bench_conversion(gps_ifds, runs: int) -> dict:
+    image = ImageGps()
+
+    def scalar():
+        for gps_ifd in gps_ifds:
+            image.get_lat_lon(gps_ifd)
+
+    def vectorized():
+        DmsArrays.from_gps_ifds(gps_ifds)
+
+    result = {
+        "ifds": len(gps_ifds),
+        "scalar_s": median_time(scalar, runs),
+        "vectorized_s": median_time(vectorized, runs),
+    }
+    result["speedup"] = result["scalar_s"] / result["vectorized_s"]
+    return result
+
+
+def bench_throughput(items, workers: int, runs: int) -> dict:
+    # warm the pool up first so worker start-up isn't measured
+    list(ImageGps.extract_many(items[: workers * 2], max_workers=workers))
+    result = {"images": len(items), "workers": workers}
+    for name, batch_size in (("per_image", 1), ("batched", ImageGps.BATCH_SIZE)):
+        elapsed = median_time(
+            lambda: list(ImageGps.extract_many(items, workers, batch_size)), runs
+        )
+        result[f"{name}_images_per_s"] = len(items) / elapsed
+    result["speedup"] = (
+        result["batched_images_per_s"] / result["per_image_images_per_s"]
+    )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    items = [make_image("JPEG", IMAGE_BYTES)] * args.images
+    gps_ifds = [ImageGps.read_header_gps_ifd(ByteSource(i))[1] for i in items]
+    results = {
+        "conversion": bench_conversion(gps_ifds, args.runs),
+        "throughput": bench_throughput(items, args.workers, args.runs),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
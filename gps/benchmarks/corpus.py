@@ -0,0 +1,134 @@
+##
+# Deterministic synthetic image corpus for the benchmarks (and tests).
+#
+# Every image is noise from a seeded RNG, so the same (format, size, gps)
+# case produces the same bytes on every run and every machine with the same
+# Pillow version; the sha256 of each item is recorded with benchmark results
+# so runs over different corpora aren't compared by accident. Noise hardly
+# compresses, so pixel count controls the file size.
+import hashlib
+import random
+import struct
+import zlib
+from io import BytesIO
+
+from PIL import ExifTags, Image
+from PIL.TiffImagePlugin import IFDRational
+
+FORMATS = ("JPEG", "PNG", "TIFF", "WEBP", "HEIC")
+# 100 KB up to FILE_UPLOAD_MAX_MEMORY_SIZE (10 MB)
+SIZES = (100 * 1024, 1024 * 1024, 4 * 1024 * 1024, 10 * 1024 * 1024)
+SEED = 20250601
+
+PITTSBURGH = {
+    ExifTags.GPS.GPSLatitudeRef: "N",
+    ExifTags.GPS.GPSLatitude: (
+        IFDRational(40),
+        IFDRational(26),
+        IFDRational(4623, 100),
+    ),
+    ExifTags.GPS.GPSLongitudeRef: "W",
+    ExifTags.GPS.GPSLongitude: (IFDRational(79), IFDRational(58), IFDRational(3, 1)),
+    ExifTags.GPS.GPSAltitudeRef: b"\x00",
+    ExifTags.GPS.GPSAltitude: IFDRational(2505, 10),
+    ExifTags.GPS.GPSDateStamp: "2025:06:01",
+    ExifTags.GPS.GPSTimeStamp: (IFDRational(14), IFDRational(5), IFDRational(30)),
+}
+
+# rough encoded bytes per pixel of RGB noise, for the first size guess
+BYTES_PER_PIXEL = {"JPEG": 1.2, "PNG": 3.0, "TIFF": 3.0, "WEBP": 0.9, "HEIC": 3.0}
+
+
+class CorpusItem:
+    __slots__ = ("name", "format", "gps", "data")
+
+    def __init__(self, name: str, format: str, gps: bool, data: bytes):
+        self.name = name
+        self.format = format
+        self.gps = gps
+        self.data = data
+
+    @property
+    def sha256(self) -> str:
+        return hashlib.sha256(self.data).hexdigest()
+
+
+def make_exif(gps: dict = None) -> Image.Exif:
+    exif = Image.Exif()
+    if gps:
+        exif.get_ifd(ExifTags.IFD.GPSInfo).update(gps)
+    return exif
+
+
+def box(box_type: bytes, payload: bytes, version: int = None) -> bytes:
+    if version is not None:
+        payload = struct.pack(">L", version << 24) + payload
+    return struct.pack(">L4s", 8 + len(payload), box_type) + payload
+
+
+##
+# a minimal HEIC-like file: ftyp, meta (hdlr/iinf/iloc) and an mdat holding
+# the Exif item followed by stand-in (undecodable) HEVC data.
+def make_heif(gps: dict = None, image_bytes: bytes = b"\x00" * 4096) -> bytes:
+    exif_item = struct.pack(">L", 6) + make_exif(gps).tobytes()
+
+    ftyp = box(b"ftyp", b"heic" + struct.pack(">L", 0) + b"mif1heic")
+    hdlr = box(b"hdlr", struct.pack(">L4s12sB", 0, b"pict", b"", 0), version=0)
+
+    def infe(item_id, item_type):
+        payload = struct.pack(">HH4s", item_id, 0, item_type) + b"\x00"
+        return box(b"infe", payload, version=2)
+
+    iinf = box(
+        b"iinf",
+        struct.pack(">H", 2) + infe(1, b"hvc1") + infe(2, b"Exif"),
+        version=0,
+    )
+
+    def iloc(mdat_start):
+        entries = struct.pack(">BBH", 0x44, 0x00, 2)
+        entries += struct.pack(
+            ">HHHLL", 1, 0, 1, mdat_start + len(exif_item), len(image_bytes)
+        )
+        entries += struct.pack(">HHHLL", 2, 0, 1, mdat_start, len(exif_item))
+        return box(b"iloc", entries, version=0)
+
+    meta_size = len(box(b"meta", hdlr + iinf + iloc(0), version=0))
+    mdat_start = len(ftyp) + meta_size + 8
+    meta = box(b"meta", hdlr + iinf + iloc(mdat_start), version=0)
+    return ftyp + meta + box(b"mdat", exif_item + image_bytes)
+
+
+def encode(format: str, side: int, gps: dict, rng: random.Random) -> bytes:
+    if format == "HEIC":
+        return make_heif(gps, rng.randbytes(side * side * 3))
+    image = Image.frombytes("RGB", (side, side), rng.randbytes(side * side * 3))
+    out = BytesIO()
+    options = {"quality": 95} if format in ("JPEG", "WEBP") else {}
+    image.save(out, format, exif=make_exif(gps), **options)
+    return out.getvalue()
+
+
+##
+# one image of roughly `size` bytes. the first encode guesses the pixel
+# count from BYTES_PER_PIXEL, the second corrects it from the actual ratio.
+def make_image(format: str, size: int, gps: bool = True, seed: int = SEED) -> bytes:
+    tags = PITTSBURGH if gps else None
+    case_seed = seed ^ zlib.crc32(f"{format}-{size}-{gps}".encode())
+    side = max(8, int((size / BYTES_PER_PIXEL[format]) ** 0.5))
+    data = encode(format, side, tags, random.Random(case_seed))
+    side = max(8, int(side * (size / len(data)) ** 0.5))
+    return encode(format, side, tags, random.Random(case_seed))
+
+
+def case_name(format: str, size: int, gps: bool) -> str:
+    return f"{format.lower()}-{'gps' if gps else 'nogps'}-{size // 1024}KB"
+
+
+def build(formats=FORMATS, sizes=SIZES, seed: int = SEED):
+    return [
+        CorpusItem(case_name(f, size, gps), f, gps, make_image(f, size, gps, seed))
+        for f in formats
+        for size in sizes
+        for gps in (True, False)
+    ]
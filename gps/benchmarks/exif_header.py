@@ -0,0 +1,102 @@
+##
+# Compare the header-only GPS parser against the Pillow path, per upload.
+#
+#   python -m gps.benchmarks.exif_header [--runs 50]
+#
+# For each synthetic geotagged JPEG size it reports median latency and peak
+# Python allocations (tracemalloc) for both engines, plus the peak RSS of a
+# fresh child process that extracts GPS once from the file on disk, and how
+# much of that peak the extraction itself added.
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+
+from PIL import Image
+
+from gps.lib.ImageGps import ImageGps
+from .corpus import make_image
+from .run import peak_rss
+
+SIZES_MB = (1, 4, 8)
+
+
+def header_engine(f):
+    return ImageGps.from_image_header(f)
+
+
+def pillow_engine(f):
+    return ImageGps(Image.open(f))
+
+
+ENGINES = {"header": header_engine, "pillow": pillow_engine}
+
+
+def time_engine(engine, data: bytes, runs: int):
+    samples = []
+    for _ in range(runs):
+        f = BytesIO(data)
+        start = time.perf_counter()
+        engine(f)
+        samples.append(time.perf_counter() - start)
+    tracemalloc.start()
+    engine(BytesIO(data))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(samples), peak
+
+
+def _rss_child(engine_name, path, queue):
+    before = peak_rss()
+    with open(path, "rb") as f:
+        result = ENGINES[engine_name](f)
+    after = peak_rss()
+    queue.put((after, after - before, (result.lat, result.lon)))
+
+
+def rss_growth(engine_name: str, path: str):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_rss_child, args=(engine_name, path, queue))
+    process.start()
+    peak, growth, lat_lon = queue.get()
+    process.join()
+    return peak, growth, lat_lon
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    results = []
+    for size_mb in SIZES_MB:
+        data = make_image("JPEG", size_mb * 1024 * 1024)
+        with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as tmp:
+            tmp.write(data)
+        try:
+            row = {"size_bytes": len(data)}
+            for name, engine in ENGINES.items():
+                latency, peak_alloc = time_engine(engine, data, args.runs)
+                rss_peak, growth, lat_lon = rss_growth(name, tmp.name)
+                row[name] = {
+                    "median_s": latency,
+                    "peak_alloc_bytes": peak_alloc,
+                    "peak_rss_bytes": rss_peak,
+                    "rss_growth_bytes": growth,
+                    "lat_lon": lat_lon,
+                }
+            row["speedup"] = row["pillow"]["median_s"] / row["header"]["median_s"]
+            results.append(row)
+        finally:
+            os.unlink(tmp.name)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
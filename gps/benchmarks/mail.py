@@ -0,0 +1,170 @@
+##
+# Email reply throughput: replies/sec sending every reply over a connection
+# of its own (send_mail, as EmailReply used to) vs through ReplyMailer's
+# persistent connections.
+#
+#   python -m gps.benchmarks.mail [--replies 200] [--concurrency 20] [--handshake-delay 0.1]
+#
+# Replies go to SmtpStandIn, a local SMTP server that waits --handshake-delay
+# seconds before greeting each new connection, standing in for the TCP, TLS
+# and AUTH round trips to smtp.sendgrid.net. --concurrency threads play the
+# webhooks, each sending its share of --replies. Results go to stdout as
+# JSON, including how many connections each way opened.
+import argparse
+import json
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .run import setup_django
+
+
+class SmtpStandIn(socketserver.ThreadingTCPServer):
+    ##
+    # just enough of an SMTP server for smtplib and Django's SMTP backend:
+    # EHLO/HELO, AUTH (anything goes), MAIL, RCPT, DATA, RSET, NOOP, QUIT.
+    # counts connections and keeps every message it accepts. a connection is
+    # dropped after drop_after messages when that is set.
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 256
+
+    def __init__(self, handshake_delay: float = 0.0, drop_after: int = None):
+        self.handshake_delay = handshake_delay
+        self.drop_after = drop_after
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = []
+        super().__init__(("127.0.0.1", 0), SmtpStandInHandler)
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class SmtpStandInHandler(socketserver.StreamRequestHandler):
+    def reply(self, line: str):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        time.sleep(server.handshake_delay)
+        self.reply("220 stand-in ESMTP")
+        received = 0
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b"EHLO":
+                self.reply("250-stand-in")
+                self.reply("250-AUTH PLAIN LOGIN")
+                self.reply("250 8BITMIME")
+            elif command == b"AUTH":
+                self.reply("235 ok")
+            elif command in (b"HELO", b"MAIL", b"RCPT", b"RSET", b"NOOP"):
+                self.reply("250 ok")
+            elif command == b"DATA":
+                self.reply("354 go ahead")
+                data = []
+                for line in self.rfile:
+                    if line == b".\r\n":
+                        break
+                    data.append(line)
+                with server.lock:
+                    server.messages.append(b"".join(data))
+                self.reply("250 queued")
+                received += 1
+                if server.drop_after and received >= server.drop_after:
+                    return
+            elif command == b"QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("502 not implemented")
+
+
+def smtp_settings(server: SmtpStandIn) -> dict:
+    return {
+        "EMAIL_BACKEND": "django.core.mail.backends.smtp.EmailBackend",
+        "EMAIL_HOST": "127.0.0.1",
+        "EMAIL_PORT": server.port,
+        "EMAIL_HOST_USER": "",
+        "EMAIL_HOST_PASSWORD": "",
+        "EMAIL_USE_TLS": False,
+    }
+
+
+def run(way: str, replies: int, concurrency: int, handshake_delay: float) -> dict:
+    from django.core.mail import EmailMessage, send_mail
+    from django.test import override_settings
+
+    from ..lib.ReplyMailer import ReplyMailer
+
+    server = SmtpStandIn(handshake_delay).start()
+    mailer = ReplyMailer(connections=2)
+
+    def per_reply(i):
+        send_mail("s", f"reply {i}", "bot@example.com", ["user@example.com"])
+
+    def pooled(i):
+        mailer.send(
+            EmailMessage("s", f"reply {i}", "bot@example.com", ["user@example.com"])
+        )
+
+    send = per_reply if way == "per-reply" else pooled
+    try:
+        with override_settings(**smtp_settings(server)):
+            start = time.perf_counter()
+            with ThreadPoolExecutor(concurrency) as pool:
+                list(pool.map(send, range(replies)))
+            elapsed = time.perf_counter() - start
+    finally:
+        server.stop()
+    return {
+        "way": way,
+        "replies": len(server.messages),
+        "connections": server.connections,
+        "elapsed_s": elapsed,
+        "replies_per_s": replies / elapsed,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="email reply throughput")
+    parser.add_argument("--replies", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--handshake-delay", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    setup_django()
+    results = []
+    for way in ("per-reply", "pooled"):
+        results.append(run(way, args.replies, args.concurrency, args.handshake_delay))
+        print(
+            f"{way}: {results[-1]['replies_per_s']:.1f} replies/s, "
+            f"{results[-1]['connections']} connections",
+            file=sys.stderr,
+        )
+    print(
+        json.dumps(
+            {"handshake_delay_s": args.handshake_delay, "results": results}, indent=2
+        )
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,316 @@
+##
+# Reproducible GPS benchmark suite.
+#
+#   python -m gps.benchmarks.run [--quick] [--out results.json]
+#   python -m gps.benchmarks.run --compare old.json new.json
+#
+# Over a deterministic synthetic corpus (gps/benchmarks/corpus.py: JPEG, PNG,
+# TIFF, WebP and HEIC-like files, with and without GPS, 100 KB to 10 MB) it
+# measures:
+#   extraction - ImageGps.from_image_bytes latency per file, broken down per
+#                stage from the OpenTelemetry spans, and peak allocations
+#   throughput - images/s through ImageGps.extract_many
+#   views      - full round trips through the Django test client for the
+#                html, MMS (media fetch stubbed) and email (locmem mail) views
+# and writes machine-readable JSON, stamped with the git commit, so results
+# from two commits can be compared with --compare.
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime, timezone
+from io import BytesIO
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from . import corpus
+
+QUICK_SIZES = (100 * 1024, 1024 * 1024)
+# a case is reported as a regression when it gets this much slower
+REGRESSION_RATIO = 1.10
+
+
+def setup_django():
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "shed.settings")
+    # time the views, not writes to whatever database happens to be configured
+    # or thumbnails being made in the background
+    os.environ.setdefault("GPS_STORE_OBSERVATIONS", "False")
+    os.environ.setdefault("GPS_THUMBNAILS", "False")
+    import django
+    from django.test.utils import setup_test_environment
+
+    django.setup()
+    # testserver host, locmem email backend
+    setup_test_environment()
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).resolve().parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+##
+# peak RSS of this process in bytes. VmHWM belongs to the address space, so
+# unlike ru_maxrss it is not inherited from the parent across fork/exec.
+def peak_rss() -> int:
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def progress(message):
+    print(message, file=sys.stderr)
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "median_s": statistics.median(samples),
+        "p95_s": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "min_s": samples[0],
+    }
+
+
+def load_corpus(sizes, formats, corpus_dir=None):
+    items = []
+    for fmt in formats:
+        for size in sizes:
+            for gps in (True, False):
+                name = corpus.case_name(fmt, size, gps)
+                path = Path(corpus_dir, name) if corpus_dir else None
+                if path is not None and path.exists():
+                    data = path.read_bytes()
+                else:
+                    data = corpus.make_image(fmt, size, gps)
+                    if path is not None:
+                        path.parent.mkdir(parents=True, exist_ok=True)
+                        path.write_bytes(data)
+                items.append(corpus.CorpusItem(name, fmt, gps, data))
+    return items
+
+
+def bench_extraction(items, runs, exporter):
+    from gps.lib.ImageGps import ImageGps
+
+    results = []
+    for item in items:
+        samples = []
+        stages = defaultdict(list)
+        for _ in range(runs):
+            exporter.clear()
+            start = time.perf_counter()
+            image = ImageGps.from_image_bytes(BytesIO(item.data))
+            samples.append(time.perf_counter() - start)
+            for span in exporter.get_finished_spans():
+                stages[span.name].append((span.end_time - span.start_time) / 1e9)
+        tracemalloc.start()
+        ImageGps.from_image_bytes(BytesIO(item.data))
+        _, peak_alloc = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results.append(
+            {
+                "case": item.name,
+                "format": item.format,
+                "gps": item.gps,
+                "bytes": len(item.data),
+                "sha256": item.sha256,
+                **summarize(samples),
+                "stages": {n: statistics.median(s) for n, s in stages.items()},
+                "peak_alloc_bytes": peak_alloc,
+                "lat": image.lat if image else None,
+                "lon": image.lon if image else None,
+            }
+        )
+        progress(f"extraction {item.name}: {results[-1]['median_s'] * 1e3:.3f} ms")
+    return results
+
+
+def bench_throughput(items, workers):
+    from gps.lib.ImageGps import ImageGps
+
+    # warm the pool up first so worker start-up isn't measured
+    list(ImageGps.extract_many([items[0].data] * workers, max_workers=workers))
+    start = time.perf_counter()
+    count = sum(1 for _ in ImageGps.extract_many((i.data for i in items), workers))
+    elapsed = time.perf_counter() - start
+    return {
+        "images": count,
+        "bytes": sum(len(i.data) for i in items),
+        "workers": workers,
+        "elapsed_s": elapsed,
+        "images_per_s": count / elapsed,
+    }
+
+
+def bench_views(items, runs):
+    from django.core import mail
+    from django.core.cache import caches
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from django.test import Client
+
+    from gps import views
+    from gps.lib.GpsCache import gps_cache
+    from gps.lib.MediaFetcher import HttpReply, async_media_fetcher, media_fetcher
+
+    client = Client()
+    results = []
+
+    def post_html(item):
+        upload = SimpleUploadedFile(item.name, item.data)
+        return client.post("/gps/rcv_image_html", {"file": upload})
+
+    def post_email(item):
+        upload = SimpleUploadedFile(item.name, item.data)
+        return client.post(
+            "/gps/rcv_image_email",
+            {"from": "bench@example.com", "attachments": "1", "attachment1": upload},
+        )
+
+    def post_mms(item):
+        media = MagicMock(status_code=200, content=item.data)
+        reply = HttpReply(200, {}, item.data)
+        # whichever of the sync/async views is routed (GPS_ASYNC_WEBHOOKS)
+        with patch.object(
+            media_fetcher.session, "get", return_value=media
+        ), patch.object(async_media_fetcher, "get", AsyncMock(return_value=reply)):
+            return client.post(
+                "/gps/rcv_image_mms",
+                {"NumMedia": "1", "MediaUrl0": "https://example.com/m"},
+            )
+
+    endpoints = {"rcv_image_html": post_html, "rcv_image_email": post_email}
+    if views.TWILIO_ACCOUNT_SID and views.TWILIO_AUTH_TOKEN:
+        endpoints["rcv_image_mms"] = post_mms
+
+    for item in items:
+        for endpoint, post in endpoints.items():
+            samples = []
+            for _ in range(runs):
+                # measure the work, not the GPS result cache
+                gps_cache.clear()
+                caches[gps_cache.alias].clear()
+                caches["webhooks"].clear()
+                mail.outbox.clear()
+                start = time.perf_counter()
+                response = post(item)
+                samples.append(time.perf_counter() - start)
+            results.append(
+                {
+                    "case": item.name,
+                    "endpoint": endpoint,
+                    "bytes": len(item.data),
+                    "status": response.status_code,
+                    **summarize(samples),
+                }
+            )
+            progress(
+                f"view {endpoint} {item.name}: {results[-1]['median_s'] * 1e3:.3f} ms"
+            )
+    return results
+
+
+##
+# {(section, key): median_s} for a results document
+def medians(results):
+    out = {}
+    for row in results.get("extraction", []):
+        out[("extraction", row["case"])] = row["median_s"]
+    for row in results.get("views", []):
+        out[("views", f"{row['endpoint']} {row['case']}")] = row["median_s"]
+    return out
+
+
+def compare(old_path, new_path):
+    old = json.loads(Path(old_path).read_text())
+    new = json.loads(Path(new_path).read_text())
+    old_medians, new_medians = medians(old), medians(new)
+    regressions = 0
+    for key in sorted(old_medians.keys() & new_medians.keys()):
+        ratio = new_medians[key] / old_medians[key]
+        flag = ""
+        if ratio > REGRESSION_RATIO:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{key[0]:10} {key[1]:40} {ratio:6.2f}x{flag}")
+    old_tp = old.get("throughput", {}).get("images_per_s")
+    new_tp = new.get("throughput", {}).get("images_per_s")
+    if old_tp and new_tp:
+        print(f"throughput {new_tp / old_tp:6.2f}x images/s")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="GPS extraction benchmarks")
+    parser.add_argument("--quick", action="store_true", help="100 KB and 1 MB only")
+    parser.add_argument("--formats", nargs="*", default=list(corpus.FORMATS))
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--view-runs", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--corpus-dir", help="cache generated images here")
+    parser.add_argument("--out", help="write JSON here instead of stdout")
+    parser.add_argument("--no-views", action="store_true")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return 1 if compare(*args.compare) else 0
+
+    setup_django()
+    # the views log every request at INFO; that would be most of what we time
+    logging.disable(logging.WARNING)
+    from gps.lib.Tracing import Tracing
+
+    exporter = Tracing.configure("memory")
+    sizes = QUICK_SIZES if args.quick else corpus.SIZES
+    items = load_corpus(sizes, args.formats, args.corpus_dir)
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "seed": corpus.SEED,
+            "runs": args.runs,
+        },
+        "extraction": bench_extraction(items, args.runs, exporter),
+        "throughput": bench_throughput(items, args.workers),
+    }
+    if not args.no_views:
+        results["views"] = bench_views(items, args.view_runs)
+    results["peak_rss_bytes"] = peak_rss()
+
+    document = json.dumps(results, indent=2)
+    if args.out:
+        Path(args.out).write_text(document)
+        progress(f"wrote {args.out}")
+    else:
+        print(document)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
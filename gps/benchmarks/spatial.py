@@ -0,0 +1,194 @@
+##
+# Spatial query benchmark: SpatialIndex vs the ORM.
+#
+#   python -m gps.benchmarks.spatial [--points 200000] [--queries 50] [--radius 200]
+#
+# A throwaway test database is filled with --points observations scattered
+# around Pittsburgh, then --queries random "within --radius meters" and
+# 1 km viewport queries are answered three ways:
+#   orm     - a naive lat/lon range filter (no index on lat/lon, so a table
+#             scan), then haversine for the radius
+#   geohash - GpsObservation.objects.in_bbox, index range scans on geohash
+#   index   - the in-memory SpatialIndex
+# and checked to agree. Median milliseconds per query, and the time to load
+# the index, go to stdout as JSON.
+import argparse
+import json
+import math
+import statistics
+import sys
+import time
+
+import numpy as np
+
+from .run import setup_django
+
+CENTER = (40.4406, -79.9959)
+VIEWPORT_M = 1000
+
+
+def fill(points: int, seed: int = 1):
+    from ..lib.Geohash import Geohash
+    from ..models import GpsObservation
+
+    rng = np.random.default_rng(seed)
+    lats = CENTER[0] + rng.normal(0, 0.08, points)
+    lons = CENTER[1] + rng.normal(0, 0.1, points)
+    batch = []
+    for lat, lon in zip(lats.tolist(), lons.tolist()):
+        batch.append(
+            GpsObservation(
+                lat=lat,
+                lon=lon,
+                geohash=Geohash.encode(lat, lon),
+                source="html",
+                content_hash="benchmark",
+            )
+        )
+        if len(batch) == 5000:
+            GpsObservation.objects.bulk_create(batch)
+            batch = []
+    GpsObservation.objects.bulk_create(batch)
+
+
+def box_around(lat, lon, meters):
+    dlat = math.degrees(meters / 6371008.8)
+    dlon = dlat / math.cos(math.radians(lat))
+    return lat - dlat, lon - dlon, lat + dlat, lon + dlon
+
+
+def orm_nearby(lat, lon, radius):
+    from ..lib.SpatialIndex import SpatialIndex
+    from ..models import GpsObservation
+
+    south, west, north, east = box_around(lat, lon, radius)
+    rows = list(
+        GpsObservation.objects.filter(
+            lat__range=(south, north), lon__range=(west, east)
+        ).values_list("id", "lat", "lon")
+    )
+    if not rows:
+        return set()
+    ids, lats, lons = (np.array(column) for column in zip(*rows))
+    return set(ids[SpatialIndex.distances(lat, lon, lats, lons) <= radius].tolist())
+
+
+def geohash_nearby(lat, lon, radius):
+    from ..lib.SpatialIndex import SpatialIndex
+    from ..models import GpsObservation
+
+    rows = list(
+        GpsObservation.objects.in_bbox(*box_around(lat, lon, radius)).values_list(
+            "id", "lat", "lon"
+        )
+    )
+    if not rows:
+        return set()
+    ids, lats, lons = (np.array(column) for column in zip(*rows))
+    return set(ids[SpatialIndex.distances(lat, lon, lats, lons) <= radius].tolist())
+
+
+def index_nearby(index, lat, lon, radius):
+    return set(index.nearby(lat, lon, radius)[0].tolist())
+
+
+def orm_viewport(box):
+    from ..models import GpsObservation
+
+    south, west, north, east = box
+    return set(
+        GpsObservation.objects.filter(
+            lat__range=(south, north), lon__range=(west, east)
+        ).values_list("id", flat=True)
+    )
+
+
+def geohash_viewport(box):
+    from ..models import GpsObservation
+
+    return set(GpsObservation.objects.in_bbox(*box).values_list("id", flat=True))
+
+
+def index_viewport(index, box):
+    return set(index.bbox(*box).tolist())
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def run(points: int, queries: int, radius: float, seed: int = 2):
+    from ..lib.SpatialIndex import SpatialIndex
+
+    start = time.perf_counter()
+    fill(points)
+    fill_s = time.perf_counter() - start
+    index = SpatialIndex()
+    _, load_s = timed(index.refresh)
+
+    rng = np.random.default_rng(seed)
+    samples = {}
+    mismatches = 0
+    for _ in range(queries):
+        lat = CENTER[0] + rng.normal(0, 0.05)
+        lon = CENTER[1] + rng.normal(0, 0.06)
+        box = box_around(lat, lon, VIEWPORT_M / 2)
+        cases = {
+            "nearby": [
+                ("orm", orm_nearby, (lat, lon, radius)),
+                ("geohash", geohash_nearby, (lat, lon, radius)),
+                ("index", index_nearby, (index, lat, lon, radius)),
+            ],
+            "viewport": [
+                ("orm", orm_viewport, (box,)),
+                ("geohash", geohash_viewport, (box,)),
+                ("index", index_viewport, (index, box)),
+            ],
+        }
+        for query, ways in cases.items():
+            results = []
+            for way, function, args in ways:
+                result, elapsed = timed(function, *args)
+                samples.setdefault((query, way), []).append(elapsed)
+                results.append(result)
+            if any(result != results[0] for result in results):
+                mismatches += 1
+    return {
+        "points": points,
+        "queries": queries,
+        "radius_m": radius,
+        "fill_s": fill_s,
+        "index_load_s": load_s,
+        "mismatches": mismatches,
+        "median_ms": {
+            f"{query} {way}": statistics.median(times) * 1e3
+            for (query, way), times in samples.items()
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="spatial query benchmark")
+    parser.add_argument("--points", type=int, default=200_000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--radius", type=float, default=200)
+    args = parser.parse_args(argv)
+
+    setup_django()
+    from django.test.utils import setup_databases, teardown_databases
+
+    databases = setup_databases(verbosity=0, interactive=False)
+    try:
+        result = run(args.points, args.queries, args.radius)
+    finally:
+        teardown_databases(databases, verbosity=0)
+    for name, ms in result["median_ms"].items():
+        print(f"{name}: {ms:.3f} ms", file=sys.stderr)
+    print(json.dumps(result, indent=2))
+    return 1 if result["mismatches"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+##
+# Thumbnail benchmark: Thumbnailer.render vs plain Pillow.
+#
+#   python -m gps.benchmarks.thumbnails [--width 4032 --height 3024] [--runs 10]
+#
+# A synthetic camera-sized JPEG (12 MP by default, with an Exif orientation
+# tag like a phone photo) is made into Thumbnailer.SIZES three ways:
+#   transpose - Image.open, ImageOps.exif_transpose, then thumbnail() for
+#               each size: the usual way to get previews the right way up,
+#               which decodes the photo at full size
+#   naive     - Image.open().thumbnail() once per size: Pillow drafts each
+#               decode itself, but decodes the photo again for every size
+#               (and ignores the orientation)
+#   drafted   - Thumbnailer.render: one draft-mode decode, every size from it
+# Median milliseconds per photo go to stdout as JSON.
+import argparse
+import json
+import statistics
+import sys
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image, ImageOps
+
+
+def make_photo(width: int, height: int, seed: int = 3) -> bytes:
+    rng = np.random.default_rng(seed)
+    # smooth colour fields plus a little noise, so it compresses like a photo
+    small = rng.integers(0, 256, (height // 64, width // 64, 3), dtype=np.uint8)
+    image = Image.fromarray(small).resize((width, height), Image.Resampling.BILINEAR)
+    noise = rng.integers(-8, 9, (height, width, 3))
+    pixels = np.clip(np.asarray(image, dtype=np.int16) + noise, 0, 255)
+    image = Image.fromarray(pixels.astype(np.uint8))
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: rotate 90 CW
+    out = BytesIO()
+    image.save(out, "JPEG", quality=90, exif=exif)
+    return out.getvalue()
+
+
+def transpose(data: bytes, sizes):
+    with Image.open(BytesIO(data)) as image:
+        upright = ImageOps.exif_transpose(image)
+    images = {}
+    for size in sizes:
+        thumb = upright.copy()
+        thumb.thumbnail((size, size))
+        images[size] = thumb
+    return images
+
+
+def naive(data: bytes, sizes):
+    images = {}
+    for size in sizes:
+        image = Image.open(BytesIO(data))
+        image.thumbnail((size, size))
+        images[size] = image
+    return images
+
+
+def drafted(data: bytes, sizes):
+    from ..lib.Thumbnailer import Thumbnailer
+
+    return Thumbnailer.render(data)
+
+
+def run(width: int, height: int, runs: int):
+    from ..lib.Thumbnailer import Thumbnailer
+
+    data = make_photo(width, height)
+    sizes = Thumbnailer.SIZES
+    medians = {}
+    shapes = {}
+    for name, function in (
+        ("transpose", transpose),
+        ("naive", naive),
+        ("drafted", drafted),
+    ):
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            images = function(data, sizes)
+            times.append(time.perf_counter() - start)
+        medians[name] = statistics.median(times) * 1e3
+        shapes[name] = {size: list(images[size].size) for size in sizes}
+    return {
+        "photo": [width, height],
+        "photo_bytes": len(data),
+        "sizes": list(sizes),
+        "runs": runs,
+        "median_ms": medians,
+        "thumbnail_sizes": shapes,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="thumbnail benchmark")
+    parser.add_argument("--width", type=int, default=4032)
+    parser.add_argument("--height", type=int, default=3024)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    from .run import setup_django
+
+    setup_django()
+    result = run(args.width, args.height, args.runs)
+    for name, ms in result["median_ms"].items():
+        print(f"{name}: {ms:.1f} ms", file=sys.stderr)
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
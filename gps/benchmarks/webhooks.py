@@ -0,0 +1,191 @@
+##
+# Webhook capacity load test: how many MMS webhooks one web worker serves at
+# once while each one waits on a slow media download.
+#
+#   python -m gps.benchmarks.webhooks [--requests 200] [--media-delay 2.0]
+#
+# A local stand-in for Twilio's media host answers every download after
+# --media-delay seconds. The app is started with gunicorn and a single
+# worker, once per worker class:
+#   sync - shed.wsgi with the default sync worker and the sync views
+#   asgi - shed.asgi with the uvicorn worker and the async views (Procfile)
+# and --requests webhooks are posted to it all at once. Concurrency is
+# requests * media delay / elapsed time: about 1 for the sync worker, and up
+# to --requests for the ASGI one. Results go to stdout as JSON.
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import aiohttp
+
+from . import corpus
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+WORKER_CLASSES = {
+    "sync": ("shed.wsgi:application", "sync", "False"),
+    "asgi": ("shed.asgi:application", "uvicorn_worker.UvicornWorker", "True"),
+}
+
+
+class SlowMediaServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, delay: float, data: bytes):
+        self.delay = delay
+        self.data = data
+        super().__init__(("127.0.0.1", 0), SlowMediaHandler)
+
+
+class SlowMediaHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(self.server.delay)
+        data = self.server.data
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_app(worker: str, port: int, timeout: int):
+    app, worker_class, async_webhooks = WORKER_CLASSES[worker]
+    env = dict(os.environ)
+    env.update(
+        {
+            "GPS_ASYNC_WEBHOOKS": async_webhooks,
+            # the range fetch would make the stand-in's data size irrelevant
+            "MMS_RANGE_FETCH": "False",
+            "GPS_STORE_OBSERVATIONS": "False",
+            "LOG_LEVEL": "WARNING",
+            "OTEL_TRACES_EXPORTER": "none",
+        }
+    )
+    for name in ("TWILIO_ACCOUNT_SID", "TWILIO_AUTH_TOKEN"):
+        env.setdefault(name, "benchmark")
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            app,
+            "--worker-class",
+            worker_class,
+            "--workers",
+            "1",
+            "--bind",
+            f"127.0.0.1:{port}",
+            "--timeout",
+            str(timeout),
+            "--backlog",
+            "2048",
+            "--log-level",
+            "warning",
+        ],
+        cwd=BASE_DIR,
+        env=env,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"{worker} app did not start")
+
+
+async def post_webhooks(url: str, media_url: str, count: int, timeout: float):
+    data = {"From": "+15550000000", "NumMedia": "1", "MediaUrl0": media_url}
+    limits = aiohttp.TCPConnector(limit=0)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    async with aiohttp.ClientSession(connector=limits, timeout=client_timeout) as s:
+
+        async def post():
+            start = time.perf_counter()
+            try:
+                async with s.post(url, data=data) as r:
+                    body = await r.text()
+                    ok = r.status == 200 and "GPS coords detected" in body
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                ok = False
+            return ok, time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(post() for _ in range(count)))
+        return results, time.perf_counter() - start
+
+
+def run(worker: str, requests: int, delay: float, media_url: str, timeout: int):
+    port = free_port()
+    process = start_app(worker, port, timeout)
+    try:
+        url = f"http://127.0.0.1:{port}/gps/rcv_image_mms"
+        results, elapsed = asyncio.run(
+            post_webhooks(url, media_url, requests, timeout + 5)
+        )
+    finally:
+        process.terminate()
+        process.wait()
+    latencies = sorted(latency for ok, latency in results if ok)
+    succeeded = len(latencies)
+    return {
+        "worker": worker,
+        "requests": requests,
+        "succeeded": succeeded,
+        "elapsed_s": elapsed,
+        "concurrency": succeeded * delay / elapsed,
+        "median_latency_s": latencies[len(latencies) // 2] if latencies else None,
+        "max_latency_s": latencies[-1] if latencies else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="webhook capacity per worker")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--media-delay", type=float, default=2.0)
+    parser.add_argument(
+        "--workers", nargs="*", default=list(WORKER_CLASSES), choices=WORKER_CLASSES
+    )
+    parser.add_argument("--timeout", type=int, default=60, help="gunicorn --timeout")
+    args = parser.parse_args(argv)
+
+    server = SlowMediaServer(args.media_delay, corpus.make_image("JPEG", 100 * 1024))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    media_url = f"http://127.0.0.1:{server.server_address[1]}/media"
+    results = []
+    try:
+        for worker in args.workers:
+            results.append(
+                run(worker, args.requests, args.media_delay, media_url, args.timeout)
+            )
+            print(
+                f"{worker}: {results[-1]['succeeded']}/{args.requests} ok, "
+                f"concurrency {results[-1]['concurrency']:.1f}",
+                file=sys.stderr,
+            )
+    finally:
+        server.shutdown()
+    print(json.dumps({"media_delay_s": args.media_delay, "results": results}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,3 +4,28 @@ from django import forms
 
 class ImageUploadForm(forms.Form):
     file = forms.FileField()
+
+
+##
+# from: https://docs.djangoproject.com/en/5.2/topics/http/file-uploads/#uploading-multiple-files
+class MultipleFileInput(forms.ClearableFileInput):
+    allow_multiple_selected = True
+
+
+class MultipleFileField(forms.FileField):
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("widget", MultipleFileInput())
+        super().__init__(*args, **kwargs)
+
+    def clean(self, data, initial=None):
+        single_file_clean = super().clean
+        if isinstance(data, (list, tuple)):
+            return [single_file_clean(d, initial) for d in data]
+        return [single_file_clean(data, initial)]
+
+
+class ImageBatchUploadForm(forms.Form):
+    files = MultipleFileField(help_text="Photos, or ZIP archives of photos.")
+    output = forms.ChoiceField(
+        choices=[("csv", "CSV"), ("json", "JSON Lines")], initial="csv"
+    )
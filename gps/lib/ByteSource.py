@@ -0,0 +1,71 @@
+import io
+import logging
+import mmap
+
+logger = logging.getLogger(__name__)
+
+
+class NeedMoreData(Exception):
+    ##
+    # raised by the metadata parsers when the bytes available end before the
+    # structure being parsed does. `needed` is the smallest total length (from
+    # the start of the file) that would let parsing get further.
+    def __init__(self, needed: int):
+        super().__init__(f"need at least {needed} bytes")
+        self.needed = needed
+
+
+class ByteSource:
+    ##
+    # Random access to the leading bytes of an upload without copying it.
+    # Wraps bytes/bytearray/memoryview/mmap (sliced as memoryviews, zero copy)
+    # or a seekable file-like object (Django UploadedFile, BytesIO, open file),
+    # in which case only the requested ranges are read.
+    def __init__(self, data):
+        self.buffer = None
+        self.file = None
+        self.start = 0
+        if isinstance(data, (bytes, bytearray, memoryview, mmap.mmap)):
+            self.buffer = memoryview(data).cast("B")
+        elif hasattr(data, "read") and hasattr(data, "seek"):
+            self.file = data
+            try:
+                self.start = data.tell()
+            except (AttributeError, OSError, io.UnsupportedOperation):
+                self.start = 0
+        else:
+            raise TypeError(f"unsupported byte source: {type(data)}")
+
+    def __len__(self):
+        if self.buffer is not None:
+            return len(self.buffer)
+        size = getattr(self.file, "size", None)
+        if size is not None:
+            return size
+        pos = self.file.tell()
+        end = self.file.seek(0, io.SEEK_END)
+        self.file.seek(pos)
+        return end - self.start
+
+    ##
+    # return exactly `length` bytes at `offset`, or raise NeedMoreData
+    def read_at(self, offset: int, length: int):
+        if offset < 0 or length < 0:
+            raise ValueError(f"bad range: {offset}+{length}")
+        if self.buffer is not None:
+            end = offset + length
+            if end > len(self.buffer):
+                raise NeedMoreData(end)
+            return self.buffer[offset:end]
+        self.file.seek(self.start + offset)
+        data = self.file.read(length)
+        if len(data) < length:
+            raise NeedMoreData(offset + length)
+        return memoryview(data)
+
+    ##
+    # leave a wrapped file where we found it, so a fallback decoder (Pillow)
+    # can read it from the beginning.
+    def rewind(self):
+        if self.file is not None:
+            self.file.seek(self.start)
@@ -0,0 +1,22 @@
+import sys
+
+
+##
+# google-cloud-logging's RequestMiddleware, without importing the library
+# (most of a second) when the app starts. That middleware only keeps each
+# request in a thread local of google.cloud.logging_v2's middleware.request
+# module, for Cloud Logging's handlers to tag log records with, and those
+# handlers import the module themselves. Until something has, there is no
+# one to keep the request for; once it has, every request is kept there, as
+# before.
+class CloudLoggingMiddleware:
+    MODULE = "google.cloud.logging_v2.handlers.middleware.request"
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        module = sys.modules.get(self.MODULE)
+        if module is not None:
+            module._thread_locals.request = request
+        return self.get_response(request)
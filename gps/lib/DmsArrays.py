@@ -0,0 +1,96 @@
+import logging
+
+import numpy as np
+from PIL import ExifTags
+
+logger = logging.getLogger(__name__)
+
+
+class DmsArrays:
+    ##
+    # Vectorized counterpart of ImageGps.convert_dms_to_dd for bulk
+    # reprocessing: one NumPy call converts a whole batch of GPS IFDs instead
+    # of one float() per rational per photo.
+    #
+    # DMS values come in as numerator/denominator arrays of shape (n, 3).
+    # Entries that can't be converted (zero denominator, NaN/inf, missing) are
+    # reported through a boolean `valid` mask and come out as NaN, rather than
+    # raising. For valid entries the result is bit-for-bit what the scalar path
+    # gives: EXIF rationals are 32-bit, so float64 division is exact-rounded
+    # just like Python's int / int, and the terms are summed in the same order.
+
+    ##
+    # decimal degrees and validity mask from (n, 3) numerator/denominator arrays
+    @staticmethod
+    def dms_to_decimal(numerators, denominators):
+        num = np.asarray(numerators, dtype=np.float64).reshape(-1, 3)
+        den = np.asarray(denominators, dtype=np.float64).reshape(-1, 3)
+        valid = np.all((den != 0) & np.isfinite(num) & np.isfinite(den), axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            parts = num / den
+        decimal = parts[:, 0] + parts[:, 1] / 60 + parts[:, 2] / 3600
+        decimal[~valid] = np.nan
+        return decimal, valid
+
+    ##
+    # refs may be "N"/"S"/"E"/"W" strings (anything else counts as positive,
+    # like the scalar path) or booleans where True means negate.
+    @staticmethod
+    def negative_mask(refs, negative_ref: str):
+        refs = np.asarray(refs)
+        if refs.dtype == bool:
+            return refs
+        return refs == negative_ref
+
+    ##
+    # (lat, lon, valid) arrays; valid is False where either coordinate is
+    # unusable, and lat/lon are NaN there.
+    @staticmethod
+    def convert_dms_to_dd(lat_num, lat_den, lat_ref, lon_num, lon_den, lon_ref):
+        lat, lat_valid = DmsArrays.dms_to_decimal(lat_num, lat_den)
+        lon, lon_valid = DmsArrays.dms_to_decimal(lon_num, lon_den)
+        lat = np.where(DmsArrays.negative_mask(lat_ref, "S"), -lat, lat)
+        lon = np.where(DmsArrays.negative_mask(lon_ref, "W"), -lon, lon)
+        valid = lat_valid & lon_valid
+        lat[~valid] = np.nan
+        lon[~valid] = np.nan
+        return lat, lon, valid
+
+    ##
+    # numerator/denominator arrays from DMS tag values as they come out of a
+    # GPS IFD: Pillow IFDRationals, floats (from TiffIfd), or ints. a missing
+    # or malformed value becomes a 0/0 row, which the mask then rejects.
+    @staticmethod
+    def rationals(values):
+        num = np.zeros((len(values), 3), dtype=np.float64)
+        den = np.zeros((len(values), 3), dtype=np.float64)
+        for i, value in enumerate(values):
+            try:
+                if len(value) != 3:
+                    continue
+                for j, part in enumerate(value):
+                    num[i, j] = getattr(part, "numerator", part)
+                    den[i, j] = getattr(part, "denominator", 1)
+            except (TypeError, ValueError):
+                num[i] = 0
+                den[i] = 0
+        return num, den
+
+    ##
+    # (lat, lon, valid) for a batch of GPS IFD dicts ({tag: value})
+    @staticmethod
+    def from_gps_ifds(gps_ifds):
+        g = ExifTags.GPS
+        lat_num, lat_den = DmsArrays.rationals([d.get(g.GPSLatitude) for d in gps_ifds])
+        lon_num, lon_den = DmsArrays.rationals(
+            [d.get(g.GPSLongitude) for d in gps_ifds]
+        )
+        lat_ref = np.array(
+            [d.get(g.GPSLatitudeRef) == "S" for d in gps_ifds], dtype=bool
+        )
+        lon_ref = np.array(
+            [d.get(g.GPSLongitudeRef) == "W" for d in gps_ifds], dtype=bool
+        )
+        return DmsArrays.convert_dms_to_dd(
+            lat_num, lat_den, lat_ref, lon_num, lon_den, lon_ref
+        )
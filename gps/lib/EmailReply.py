@@ -1,9 +1,11 @@
 import logging
 
-from django.core.mail import send_mail
+from django.core.mail import EmailMessage
 from django.core.mail.message import sanitize_address
 
 from shed.settings import DEFAULT_FROM_EMAIL
+from .ReplyMailer import reply_mailer
+from .Tracing import tracer
 
 logger = logging.getLogger(__name__)
 
@@ -26,10 +28,10 @@ class EmailReply:
         logger.info(f"{__name__}.__init__: {self.__dict__}")
 
     def send(self):
-        send_mail(
-            self.subject,
-            self.body_text,
-            self.email_from,
-            [self.email_to],
-            fail_silently=False,
-        )
+        with tracer.start_as_current_span("EmailReply.send") as span:
+            span.set_attribute("email.body_bytes", len(self.body_text.encode()))
+            reply_mailer.send(
+                EmailMessage(
+                    self.subject, self.body_text, self.email_from, [self.email_to]
+                )
+            )
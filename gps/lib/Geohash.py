@@ -0,0 +1,86 @@
+import math
+
+
+class Geohash:
+    ##
+    # Geohash encoding of lat/lon, and covers of bounding boxes by geohash
+    # cells. Points close together share a prefix, so "everything in this
+    # box" becomes a few range scans over an index on the geohash column: one
+    # `prefix <= geohash < prefix + "{"` per covering cell ("{" sorts right
+    # after "z", the last character of the alphabet).
+    ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+    PRECISION = 12
+    RANGE_END = "{"
+
+    @staticmethod
+    def encode(lat: float, lon: float, precision: int = PRECISION) -> str:
+        lat_range = [-90.0, 90.0]
+        lon_range = [-180.0, 180.0]
+        chars = []
+        bits = 0
+        value = 0
+        even = True
+        while len(chars) < precision:
+            interval, coord = (lon_range, lon) if even else (lat_range, lat)
+            middle = (interval[0] + interval[1]) / 2
+            value <<= 1
+            if coord >= middle:
+                value |= 1
+                interval[0] = middle
+            else:
+                interval[1] = middle
+            even = not even
+            bits += 1
+            if bits == 5:
+                chars.append(Geohash.ALPHABET[value])
+                bits = 0
+                value = 0
+        return "".join(chars)
+
+    ##
+    # (height, width) in degrees of the cells of a precision
+    @staticmethod
+    def cell_size(precision: int):
+        bits = 5 * precision
+        lon_bits = (bits + 1) // 2
+        lat_bits = bits // 2
+        return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+    ##
+    # the geohash cells covering a bounding box, at the finest precision that
+    # needs no more than `max_cells` of them. a box crossing the antimeridian
+    # (west > east) is covered as two.
+    @staticmethod
+    def cover(south, west, north, east, max_cells: int = 32):
+        if west > east:
+            return Geohash.cover(south, west, north, 180.0, max_cells) + Geohash.cover(
+                south, -180.0, north, east, max_cells
+            )
+        south, north = max(south, -90.0), min(north, 90.0)
+        west, east = max(west, -180.0), min(east, 180.0)
+        cells = [""]
+        for precision in range(1, Geohash.PRECISION + 1):
+            height, width = Geohash.cell_size(precision)
+            rows = Geohash.indexes(south + 90.0, north + 90.0, height, 180.0)
+            columns = Geohash.indexes(west + 180.0, east + 180.0, width, 360.0)
+            if len(rows) * len(columns) > max_cells:
+                break
+            cells = sorted(
+                Geohash.encode(
+                    (row + 0.5) * height - 90.0,
+                    (column + 0.5) * width - 180.0,
+                    precision,
+                )
+                for row in rows
+                for column in columns
+            )
+        return cells
+
+    ##
+    # the row (or column) numbers of the cells of `size` degrees that
+    # [low, high] overlaps, in a grid `span` degrees across
+    @staticmethod
+    def indexes(low: float, high: float, size: float, span: float):
+        last = int(span / size) - 1
+        first = min(int(math.floor(low / size)), last)
+        return range(max(first, 0), min(int(math.floor(high / size)), last) + 1)
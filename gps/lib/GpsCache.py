@@ -0,0 +1,109 @@
+import hashlib
+import logging
+import threading
+
+from cachetools import LRUCache
+from django.core.cache import caches
+
+from .ByteSource import ByteSource, NeedMoreData
+from .ImageGps import ImageGps
+from .Tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class GpsCache:
+    ##
+    # Content-addressed cache of ImageGps results. The same photo shows up
+    # again and again (re-sent emails, MMS retries, the same file through the
+    # form and by email), so results are keyed by a hash of the first
+    # HEAD_BYTES of the file plus its length, which covers the EXIF/GPS data
+    # of JPEG and HEIC files. Two tiers:
+    #   - a bounded in-process LRU, checked first;
+    #   - the Django cache named by CACHE_ALIAS (see CACHES in settings),
+    #     shared by all gunicorn workers on the instance.
+    HEAD_BYTES = 64 * 1024
+    CACHE_ALIAS = "gps"
+    KEY_PREFIX = "gps:v2:"
+
+    def __init__(self, maxsize: int = 1024, alias: str = CACHE_ALIAS):
+        self.alias = alias
+        self.memory = LRUCache(maxsize=maxsize)
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def key_for(self, data) -> str:
+        source = ByteSource(data)
+        try:
+            size = len(source)
+            head = source.read_at(0, min(size, self.HEAD_BYTES))
+        except NeedMoreData:
+            head, size = b"", 0
+        finally:
+            source.rewind()
+        digest = hashlib.blake2b(head, digest_size=16)
+        digest.update(size.to_bytes(8, "little"))
+        return self.KEY_PREFIX + digest.hexdigest()
+
+    ##
+    # the cached result for `data`, or the result of `extract(data)`, which
+    # is then stored in both tiers. like from_image_bytes, the result is an
+    # ImageGps or None (not an image), and None results are cached too.
+    def get_or_extract(self, data, extract=None):
+        with tracer.start_as_current_span("GpsCache.get_or_extract") as span:
+            image_gps, tier = self.lookup_or_extract(data, extract)
+            span.set_attribute("cache.tier", tier)
+            return image_gps
+
+    def lookup_or_extract(self, data, extract=None):
+        if extract is None:
+            extract = ImageGps.from_image_bytes
+        key = self.key_for(data)
+        with self.lock:
+            if key in self.memory:
+                self.memory_hits += 1
+                return self.memory[key], "memory"
+
+        shared = caches[self.alias]
+        found = shared.get(key)
+        if found is not None:
+            (image_gps,) = found
+            with self.lock:
+                self.shared_hits += 1
+                self.memory[key] = image_gps
+            return image_gps, "shared"
+
+        image_gps = extract(data)
+        with self.lock:
+            self.misses += 1
+            self.memory[key] = image_gps
+        try:
+            # wrapped in a tuple so a cached None is not read back as a miss.
+            shared.set(key, (image_gps,))
+        except Exception as e:
+            logger.warning(f"{__name__}: could not store result for {key}: {e}")
+        return image_gps, "miss"
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "memory_size": len(self.memory),
+            }
+
+    ##
+    # empty the in-process tier and reset the counters. the shared tier is
+    # left alone; it belongs to every worker.
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.memory_hits = 0
+            self.shared_hits = 0
+            self.misses = 0
+
+
+gps_cache = GpsCache()
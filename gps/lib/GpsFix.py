@@ -0,0 +1,136 @@
+import logging
+import math
+from datetime import datetime, timedelta, timezone
+
+from PIL import ExifTags
+
+logger = logging.getLogger(__name__)
+
+
+class GpsFix:
+    ##
+    # Compact, immutable result of one GPS IFD: everything downstream code
+    # needs from a photo's location tags, decoded once, without holding on to
+    # the Pillow image, the exif object or the raw IFD.
+    #   lat, lon: decimal degrees, south/west negative
+    #   altitude: meters, below sea level negative
+    #   timestamp: UTC datetime (GPSDateStamp + GPSTimeStamp)
+    #   direction: degrees the camera was facing, direction_ref "T"rue/"M"agnetic
+    #   h_error: horizontal positioning error, meters
+    #   speed: km/h
+    __slots__ = (
+        "lat",
+        "lon",
+        "altitude",
+        "timestamp",
+        "direction",
+        "direction_ref",
+        "h_error",
+        "speed",
+    )
+
+    # GPSSpeedRef -> km/h
+    SPEED_TO_KMH = {"K": 1.0, "M": 1.609344, "N": 1.852}
+
+    def __init__(
+        self,
+        lat: float = None,
+        lon: float = None,
+        altitude: float = None,
+        timestamp: datetime = None,
+        direction: float = None,
+        direction_ref: str = None,
+        h_error: float = None,
+        speed: float = None,
+    ):
+        values = locals()
+        for name in self.__slots__:
+            object.__setattr__(self, name, values[name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __reduce__(self):
+        return type(self), tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        if not isinstance(other, GpsFix):
+            return NotImplemented
+        return all(getattr(self, n) == getattr(other, n) for n in self.__slots__)
+
+    def __hash__(self):
+        return hash(tuple(getattr(self, name) for name in self.__slots__))
+
+    def __repr__(self):
+        fields = ", ".join(f"{n}={getattr(self, n)!r}" for n in self.__slots__)
+        return f"GpsFix({fields})"
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    ##
+    # decode the non-coordinate tags of a GPS IFD ({tag: value}, from Pillow or
+    # TiffIfd) in one go. lat/lon come from ImageGps.get_lat_lon so there is a
+    # single implementation of the coordinate conversion.
+    @staticmethod
+    def from_gps_ifd(gps_ifd: dict, lat: float = None, lon: float = None):
+        g = ExifTags.GPS
+        altitude = GpsFix.number(gps_ifd.get(g.GPSAltitude))
+        if altitude is not None and GpsFix.byte(gps_ifd.get(g.GPSAltitudeRef)) == 1:
+            altitude = -altitude
+        speed = GpsFix.number(gps_ifd.get(g.GPSSpeed))
+        if speed is not None:
+            speed_ref = gps_ifd.get(g.GPSSpeedRef) or "K"
+            speed = speed * GpsFix.SPEED_TO_KMH.get(speed_ref, 1.0)
+        return GpsFix(
+            lat=lat,
+            lon=lon,
+            altitude=altitude,
+            timestamp=GpsFix.utc_timestamp(
+                gps_ifd.get(g.GPSDateStamp), gps_ifd.get(g.GPSTimeStamp)
+            ),
+            direction=GpsFix.number(gps_ifd.get(g.GPSImgDirection)),
+            direction_ref=gps_ifd.get(g.GPSImgDirectionRef) or None,
+            h_error=GpsFix.number(gps_ifd.get(g.GPSHPositioningError)),
+            speed=speed,
+        )
+
+    ##
+    # float of a rational/number tag value, None if missing or not finite
+    @staticmethod
+    def number(value):
+        if isinstance(value, tuple):
+            value = value[0] if value else None
+        if value is None:
+            return None
+        try:
+            value = float(value)
+        except (TypeError, ValueError, ZeroDivisionError):
+            return None
+        return value if math.isfinite(value) else None
+
+    ##
+    # BYTE tags come back as raw bytes (b"\x01") or, from some writers, ints
+    @staticmethod
+    def byte(value):
+        if isinstance(value, (bytes, bytearray)):
+            return value[0] if value else None
+        return value
+
+    @staticmethod
+    def utc_timestamp(date_stamp, time_stamp):
+        if not date_stamp or not time_stamp:
+            return None
+        try:
+            day = datetime.strptime(date_stamp.strip(), "%Y:%m:%d")
+            hours, minutes, seconds = (float(v) for v in time_stamp)
+            offset = timedelta(hours=hours, minutes=minutes, seconds=seconds)
+        except (TypeError, ValueError, OverflowError) as e:
+            logger.debug(
+                f"{__name__}: bad GPS date/time {date_stamp} {time_stamp}: {e}"
+            )
+            return None
+        return day.replace(tzinfo=timezone.utc) + offset
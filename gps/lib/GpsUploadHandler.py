@@ -0,0 +1,134 @@
+import logging
+from io import BytesIO
+
+from django.core.files.uploadedfile import (
+    InMemoryUploadedFile,
+    TemporaryUploadedFile,
+)
+from django.core.files.uploadhandler import FileUploadHandler
+
+from .ByteSource import ByteSource, NeedMoreData
+from .ImageGps import ImageGps
+
+logger = logging.getLogger(__name__)
+
+
+class GpsUploadHandler(FileUploadHandler):
+    ##
+    # Upload handler for the GPS endpoints that reads the GPS data while the
+    # multipart body is still arriving, instead of after Django has buffered
+    # the whole photo.
+    #
+    # Each chunk is appended to a small head buffer and the JPEG/HEIF header
+    # parsers are re-run on it; NeedMoreData from them says how much of the
+    # file they need, so nothing is re-parsed until that much has arrived.
+    # Once the Exif segment is in, the result is kept on the uploaded file as
+    # `gps_image` (an ImageGps, like from_image_bytes) and parsing stops.
+    #
+    # With discard=True the rest of the file is thrown away: the uploaded file
+    # the view sees holds only the bytes read up to that point (its `size` is
+    # still the real size) and is marked `truncated`. Anything the header
+    # parsers can't handle (PNG, WebP, a JPEG whose Exif lies beyond
+    # MAX_HEAD_BYTES, ...) is spooled to a temporary file as usual and left to
+    # Pillow. With discard=False every file is spooled to disk. With
+    # keep_located=True (thumbnails, see Thumbnailer) a photo whose header
+    # has coordinates is spooled whole too, and only those. Either way no
+    # more than about MAX_HEAD_BYTES of a file is held in memory.
+    MAX_HEAD_BYTES = 512 * 1024
+    # below this, "neither JPEG nor HEIF" may just mean "ftyp not complete yet"
+    MIN_IDENTIFY_BYTES = 4096
+
+    def __init__(self, request=None, discard: bool = True, keep_located=False):
+        super().__init__(request)
+        self.discard = discard
+        self.keep_located = keep_located
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.head = bytearray()
+        self.needed = 0
+        self.gps_image = None
+        self.parsing = True
+        self.resolved = False
+        self.spool = None
+        if not self.discard:
+            self.start_spool()
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.spool is not None:
+            self.spool.write(raw_data)
+        if self.parsing:
+            self.head += raw_data
+            if len(self.head) >= self.needed:
+                self.parse(final=False)
+        return None
+
+    def file_complete(self, file_size):
+        if self.parsing:
+            self.parse(final=True)
+        if self.spool is not None:
+            uploaded = self.spool
+            uploaded.seek(0)
+            uploaded.size = file_size
+        else:
+            # discarding, and the result came from the head alone
+            uploaded = InMemoryUploadedFile(
+                file=BytesIO(self.head),
+                field_name=self.field_name,
+                name=self.file_name,
+                content_type=self.content_type,
+                size=file_size,
+                charset=self.charset,
+                content_type_extra=self.content_type_extra,
+            )
+            uploaded.truncated = True
+        if self.resolved:
+            uploaded.gps_image = self.gps_image
+        self.head = None
+        logger.debug(
+            f"{__name__}: {self.file_name}: {file_size} bytes, resolved: {self.resolved}"
+        )
+        return uploaded
+
+    ##
+    # try the header parsers on what has arrived so far. gives up (and, when
+    # discarding, starts spooling for Pillow) when the file isn't JPEG/HEIF or
+    # its GPS data lies beyond MAX_HEAD_BYTES.
+    def parse(self, final: bool):
+        try:
+            image_format, gps_ifd = ImageGps.read_header_gps_ifd(
+                ByteSource(bytes(self.head))
+            )
+        except NeedMoreData as e:
+            self.needed = e.needed
+            if final or e.needed > self.MAX_HEAD_BYTES:
+                self.give_up()
+            return
+        except Exception as e:
+            logger.info(f"{__name__}: header parse failed: {type(e)}: {e}")
+            self.give_up()
+            return
+        if image_format is None:
+            if final or len(self.head) >= self.MIN_IDENTIFY_BYTES:
+                self.give_up()
+            return
+        self.gps_image = ImageGps(gps_ifd=gps_ifd)
+        self.parsing = False
+        self.resolved = True
+        if self.spool is None and self.keep_located and self.gps_image.lat is not None:
+            self.start_spool()
+            self.spool.write(self.head)
+        if self.spool is not None:
+            self.head = bytearray()
+
+    def give_up(self):
+        self.parsing = False
+        if self.spool is None:
+            self.start_spool()
+            self.spool.write(self.head)
+        self.head = bytearray()
+
+    def start_spool(self):
+        self.spool = TemporaryUploadedFile(
+            self.file_name, self.content_type, 0, self.charset, self.content_type_extra
+        )
@@ -0,0 +1,256 @@
+import logging
+import struct
+
+from .ByteSource import ByteSource
+from .TiffIfd import TiffIfd
+
+logger = logging.getLogger(__name__)
+
+
+class HeifExif:
+    ##
+    # HEIC/HEIF (ISOBMFF) Exif locator. iPhones send HEIC by default and
+    # Pillow can't open it without a plugin, so instead of decoding anything
+    # we walk the box tree: ftyp -> meta -> iinf (find the item whose type is
+    # "Exif") and iloc (find where that item's bytes live), then read just
+    # that byte range and hand the TIFF block inside it to TiffIfd.
+    BRANDS = {
+        b"heic",
+        b"heix",
+        b"hevc",
+        b"hevx",
+        b"heim",
+        b"heis",
+        b"mif1",
+        b"msf1",
+        b"avif",
+    }
+    MAX_BOXES = 64
+    # an Exif item bigger than this is not something we want to read.
+    MAX_EXIF_BYTES = 1024 * 1024
+
+    @staticmethod
+    def is_heif(source: ByteSource) -> bool:
+        try:
+            size, box_type, header = HeifExif.box_header(source, 0)
+            if box_type != b"ftyp" or size < header + 8:
+                return False
+            ftyp = bytes(source.read_at(header, size - header))
+        except Exception:
+            return False
+        brands = {ftyp[0:4]}
+        brands.update(ftyp[i : i + 4] for i in range(8, len(ftyp) - 3, 4))
+        return bool(brands & HeifExif.BRANDS)
+
+    ##
+    # (box size, box type, header length) of the box starting at `offset`.
+    # a size of 0 means "to the end of the file" and is only valid at the top
+    # level; it is reported as None.
+    @staticmethod
+    def box_header(source: ByteSource, offset: int):
+        size, box_type = struct.unpack(">L4s", source.read_at(offset, 8))
+        header = 8
+        if size == 1:
+            (size,) = struct.unpack(">Q", source.read_at(offset + 8, 8))
+            header = 16
+        elif size == 0:
+            size = None
+        if size is not None and size < header:
+            raise ValueError(f"bad box size {size} at offset {offset}")
+        return size, box_type, header
+
+    ##
+    # yield (type, payload offset, payload size) for the boxes in a range.
+    @staticmethod
+    def boxes(source: ByteSource, start: int, end: int = None):
+        offset = start
+        for _ in range(HeifExif.MAX_BOXES):
+            if end is not None and offset + 8 > end:
+                return
+            size, box_type, header = HeifExif.box_header(source, offset)
+            if size is None:
+                if end is not None:
+                    raise ValueError("open-ended box inside a container")
+                yield box_type, offset + header, None
+                return
+            yield box_type, offset + header, size - header
+            offset += size
+        raise ValueError("too many boxes")
+
+    ##
+    # what the meta box says about the items: ({item_ID: (type, content
+    # type)}, iloc locations (see item_locations), idat payload offset or
+    # None), or None when there is no meta box.
+    @staticmethod
+    def read_meta(source: ByteSource):
+        meta = None
+        for box_type, offset, size in HeifExif.boxes(source, 0):
+            if box_type == b"meta":
+                meta = (offset, size)
+                break
+        if meta is None or meta[1] is None:
+            return None
+
+        # meta is a FullBox: skip version + flags
+        meta_start = meta[0] + 4
+        meta_end = meta[0] + meta[1]
+        items = {}
+        locations = {}
+        idat_offset = None
+        for box_type, offset, size in HeifExif.boxes(source, meta_start, meta_end):
+            payload = source.read_at(offset, size) if box_type != b"idat" else None
+            if box_type == b"iinf":
+                items = HeifExif.item_infos(payload)
+            elif box_type == b"iloc":
+                locations = HeifExif.item_locations(payload)
+            elif box_type == b"idat":
+                idat_offset = offset
+        return items, locations, idat_offset
+
+    ##
+    # [(file offset, length)] of the extents of an item
+    @staticmethod
+    def item_extents(locations, item_id: int, idat_offset):
+        if item_id not in locations:
+            raise ValueError(f"item {item_id} has no iloc entry")
+        construction_method, base_offset, extents = locations[item_id]
+        if construction_method == 1:
+            if idat_offset is None:
+                raise ValueError(f"item {item_id} stored in idat, but no idat box")
+            base_offset += idat_offset
+        elif construction_method != 0:
+            raise ValueError(f"unsupported construction method {construction_method}")
+        return [(base_offset + offset, length) for offset, length in extents]
+
+    ##
+    # returns a memoryview (or bytes, for multi-extent items) of the TIFF
+    # block inside the Exif item, or None when there is no Exif item.
+    @staticmethod
+    def find_exif(source: ByteSource):
+        meta = HeifExif.read_meta(source)
+        if meta is None:
+            return None
+        items, locations, idat_offset = meta
+        exif_item_id = HeifExif.exif_item_id(items)
+        if exif_item_id is None or not locations:
+            return None
+        extents = HeifExif.item_extents(locations, exif_item_id, idat_offset)
+
+        total = sum(length for _, length in extents)
+        if total > HeifExif.MAX_EXIF_BYTES:
+            raise ValueError(f"Exif item too large: {total} bytes")
+        if len(extents) == 1:
+            item = source.read_at(*extents[0])
+        else:
+            item = b"".join(source.read_at(*extent) for extent in extents)
+        # Exif item payload: u32 offset to the TIFF header, then e.g. "Exif\0\0"
+        (tiff_offset,) = struct.unpack(">L", item[0:4])
+        return memoryview(item)[4 + tiff_offset :]
+
+    ##
+    # the item_ID of the first "Exif" item
+    @staticmethod
+    def exif_item_id(items: dict):
+        for item_id, (item_type, _) in items.items():
+            if item_type == b"Exif":
+                return item_id
+        return None
+
+    ##
+    # {item_ID: (item type, content type or None)} from an iinf payload, in
+    # order. content type is only set for "mime" items (e.g. XMP).
+    @staticmethod
+    def item_infos(iinf):
+        version = iinf[0]
+        if version == 0:
+            (count,) = struct.unpack_from(">H", iinf, 4)
+            offset = 6
+        else:
+            (count,) = struct.unpack_from(">L", iinf, 4)
+            offset = 8
+        items = {}
+        for _ in range(min(count, HeifExif.MAX_BOXES * 1024)):
+            if offset + 8 > len(iinf):
+                break
+            size, box_type = struct.unpack_from(">L4s", iinf, offset)
+            if size < 8:
+                raise ValueError("bad infe box size")
+            if box_type == b"infe":
+                infe_version = iinf[offset + 8]
+                body = offset + 12
+                if infe_version == 2:
+                    item_id, _, item_type = struct.unpack_from(">HH4s", iinf, body)
+                    body += 8
+                elif infe_version == 3:
+                    item_id, _, item_type = struct.unpack_from(">LH4s", iinf, body)
+                    body += 10
+                else:
+                    item_type = None
+                if item_type is not None:
+                    content_type = None
+                    if item_type == b"mime":
+                        # item_name, then content_type, both NUL terminated
+                        strings = bytes(iinf[body : offset + size]).split(b"\0")
+                        if len(strings) > 1:
+                            content_type = strings[1].decode("ascii", "replace")
+                    items[item_id] = (item_type, content_type)
+            offset += size
+        return items
+
+    ##
+    # {item_ID: (construction method, base offset, [(extent offset, length)])}
+    @staticmethod
+    def item_locations(iloc):
+        version = iloc[0]
+        offset_size = iloc[4] >> 4
+        length_size = iloc[4] & 0x0F
+        base_offset_size = iloc[5] >> 4
+        index_size = iloc[5] & 0x0F if version in (1, 2) else 0
+        pos = 6
+
+        def read(n):
+            nonlocal pos
+            if n == 0:
+                return 0
+            if n not in (4, 8):
+                raise ValueError(f"unsupported iloc field size {n}")
+            if pos + n > len(iloc):
+                raise ValueError("iloc box truncated")
+            value = int.from_bytes(iloc[pos : pos + n], "big")
+            pos += n
+            return value
+
+        def read_u16():
+            nonlocal pos
+            (value,) = struct.unpack_from(">H", iloc, pos)
+            pos += 2
+            return value
+
+        if version < 2:
+            item_count = read_u16()
+        else:
+            item_count = read(4)
+        locations = {}
+        for _ in range(item_count):
+            item_id = read_u16() if version < 2 else read(4)
+            construction_method = 0
+            if version in (1, 2):
+                construction_method = read_u16() & 0x0F
+            read_u16()  # data_reference_index
+            base_offset = read(base_offset_size)
+            extents = []
+            for _ in range(read_u16()):
+                read(index_size)
+                extents.append((read(offset_size), read(length_size)))
+            locations[item_id] = (construction_method, base_offset, extents)
+        return locations
+
+    ##
+    # GPS IFD of a HEIF image as {tag: value}, {} if it carries no GPS data.
+    @staticmethod
+    def read_gps_ifd(source: ByteSource) -> dict:
+        tiff = HeifExif.find_exif(source)
+        if tiff is None:
+            logger.debug(f"{__name__}: no Exif item found")
+            return {}
+        return TiffIfd.read_gps_ifd(tiff)
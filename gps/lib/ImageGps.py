@@ -1,15 +1,52 @@
 import logging
+import mmap
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
 
-from PIL import Image, ExifTags
+from PIL import ExifTags
+from opentelemetry import trace
+
+from .ByteSource import ByteSource
+from .GpsFix import GpsFix
+from .HeifExif import HeifExif
+from .JpegExif import JpegExif
+from .Tracing import Tracing, tracer
 
 logger = logging.getLogger(__name__)
 
 
 class ImageGps:
+    ##
+    # process pools for extract_many(), one per worker count, created on
+    # first use and reused for the life of the (gunicorn worker) process.
+    pools = {}
+    pools_lock = threading.Lock()
+
     @staticmethod
+    @tracer.start_as_current_span("ImageGps.from_image_bytes")
     def from_image_bytes(inMemoryUploadedFile):
+        span = trace.get_current_span()
+        Tracing.set_attributes(
+            span, {"image.bytes": Tracing.size_of(inMemoryUploadedFile)}
+        )
+        image_gps = ImageGps.from_image_header(inMemoryUploadedFile)
+        if image_gps is not None:
+            span.set_attribute("image.engine", "header")
+            return image_gps
+        span.set_attribute("image.engine", "pillow")
+        # PIL.Image is only needed here, for what the header parsers can't
+        # read, so it isn't imported until then
+        from PIL import Image
+
         try:
-            pil_image = Image.open(inMemoryUploadedFile)
+            with tracer.start_as_current_span("Image.open") as open_span:
+                pil_image = Image.open(inMemoryUploadedFile)
+                Tracing.set_attributes(open_span, {"image.format": pil_image.format})
             return ImageGps(pil_image)
         except Exception as e:
             logger.error(
@@ -17,31 +54,162 @@ class ImageGps:
             )
             return None
 
+    ##
+    # fast path: walk the JPEG markers (or HEIF boxes) of a file-like object or
+    # buffer and parse only the GPS IFD, without building a Pillow image.
+    # returns None when the input is not something the header parsers
+    # understand, so the caller can fall back to Pillow.
+    @staticmethod
+    @tracer.start_as_current_span("ImageGps.from_image_header")
+    def from_image_header(data):
+        span = trace.get_current_span()
+        try:
+            source = ByteSource(data)
+        except TypeError:
+            return None
+        try:
+            image_format, gps_ifd = ImageGps.read_header_gps_ifd(source)
+            if image_format is None:
+                return None
+            span.set_attribute("image.format", image_format)
+            return ImageGps(gps_ifd=gps_ifd)
+        except Exception as e:
+            logger.info(
+                f"{__name__}: header parse failed, falling back to Pillow: {type(e)}: {e}"
+            )
+            return None
+        finally:
+            source.rewind()
+
+    ##
+    # (format, GPS IFD) of a JPEG or HEIF ByteSource, or (None, None) when it
+    # is neither. unlike from_image_header, errors are left to the caller:
+    # NeedMoreData in particular tells a streaming caller to wait for more of
+    # the file (see GpsUploadHandler).
+    @staticmethod
+    def read_header_gps_ifd(source: ByteSource):
+        if JpegExif.is_jpeg(source):
+            return "JPEG", JpegExif.read_gps_ifd(source)
+        if HeifExif.is_heif(source):
+            return "HEIF", HeifExif.read_gps_ifd(source)
+        return None, None
+
+    ##
+    # extract GPS from many images on a bounded process pool. `items` may be
+    # bytes-like objects or file paths, and results (ImageGps or None, as with
+    # from_image_bytes) are yielded in input order.
+    #
+    # items go to the workers in batches (see extract_gps_batch) of up to
+    # `batch_size` items or BATCH_BYTES of in-memory data, so each batch's
+    # coordinates are converted in one DmsArrays call and the pool pays its
+    # pickling and scheduling overhead once per batch rather than per image.
+    # at most `max_workers * 2` batches are in flight at once, so a long
+    # iterable is never fully loaded into memory.
+    BATCH_SIZE = 32
+    BATCH_BYTES = 4 * 1024 * 1024
+
+    @staticmethod
+    def extract_many(items, max_workers: int = None, batch_size: int = None):
+        max_workers = max_workers or os.cpu_count() or 1
+        batch_size = batch_size or ImageGps.BATCH_SIZE
+        pool = ImageGps.process_pool(max_workers)
+        in_flight = deque()
+        try:
+            for batch in ImageGps.batches(items, batch_size):
+                in_flight.append(pool.submit(extract_gps_batch, batch))
+                if len(in_flight) >= max_workers * 2:
+                    yield from in_flight.popleft().result()
+            while in_flight:
+                yield from in_flight.popleft().result()
+        except BrokenProcessPool:
+            with ImageGps.pools_lock:
+                ImageGps.pools.pop(max_workers, None)
+            raise
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+    ##
+    # lists of up to `batch_size` consecutive items, a list closing early
+    # once the bytes-like items in it reach BATCH_BYTES (paths count as
+    # nothing: the worker reads them)
+    @staticmethod
+    def batches(items, batch_size: int):
+        batch = []
+        size = 0
+        for item in items:
+            batch.append(item)
+            if not isinstance(item, (str, os.PathLike)):
+                size += len(item)
+            if len(batch) >= batch_size or size >= ImageGps.BATCH_BYTES:
+                yield batch
+                batch = []
+                size = 0
+        if batch:
+            yield batch
+
+    @staticmethod
+    def process_pool(max_workers: int) -> ProcessPoolExecutor:
+        with ImageGps.pools_lock:
+            pool = ImageGps.pools.get(max_workers)
+            if pool is None:
+                # spawn, not fork: the parent is a threaded web worker.
+                pool = ProcessPoolExecutor(
+                    max_workers=max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                ImageGps.pools[max_workers] = pool
+            return pool
+
     def __init__(
         self,
-        pil_image: Image = None,
+        pil_image: "Image.Image" = None,
+        gps_ifd: dict = None,
+        lat_lon: tuple = None,
     ):
         self.lat = None
         self.lon = None
+        self.fix = None
         self.exif = None
-        self.gps_ifd = None
+        self.gps_ifd = gps_ifd
         self.image = pil_image
-        if self.image is None:
-            return
+        self.lat_lon = lat_lon
+        try:
+            self.extract()
+        finally:
+            self.release()
 
-        self.exif = self.get_exif(self.image)
-        logger.info(f"{__name__}.__init__: exif: {self.exif.__str__()}")
-        if self.exif is None or not self.exif:
-            return
+    def extract(self):
+        if self.gps_ifd is None:
+            if self.image is None:
+                return
+
+            self.exif = self.get_exif(self.image)
+            logger.info(f"{__name__}.__init__: exif: {self.exif.__str__()}")
+            if self.exif is None or not self.exif:
+                return
 
-        self.gps_ifd = self.get_gps_ifd(self.exif)
+            self.gps_ifd = self.get_gps_ifd(self.exif)
         logger.info(f"{__name__}.__init__: gps_ifd: {self.gps_ifd.__str__()}")
         if self.gps_ifd is None or not self.gps_ifd:
             return
 
-        self.lat, self.lon = self.get_lat_lon(self.gps_ifd)
-        logger.info(f"{__name__}.__init__: {self.__dict__}")
+        if self.lat_lon is not None:
+            self.lat, self.lon = self.lat_lon
+        else:
+            self.lat, self.lon = self.get_lat_lon(self.gps_ifd)
+        self.fix = GpsFix.from_gps_ifd(self.gps_ifd, self.lat, self.lon)
+        logger.info(f"{__name__}.__init__: {self.fix}")
+
+    ##
+    # everything worth keeping is in lat/lon/fix by now; drop the Pillow
+    # image, exif and raw IFD so they don't live as long as this object.
+    def release(self):
+        self.image = None
+        self.exif = None
+        self.gps_ifd = None
 
+    @tracer.start_as_current_span("ImageGps.get_exif")
     def get_exif(self, image):
         try:
             return image.getexif()
@@ -49,6 +217,7 @@ class ImageGps:
             logger.error(f"{__name__}: Error getting exif from image: {e}")
             return None
 
+    @tracer.start_as_current_span("ImageGps.get_gps_ifd")
     def get_gps_ifd(self, exif):
         try:
             gps_ifd = exif.get_ifd(ExifTags.IFD.GPSInfo)
@@ -57,13 +226,22 @@ class ImageGps:
             logger.error(f"{__name__}: Error processing image: {e}")
             return None
 
+    ##
+    # (lat, lon) in decimal degrees, or (None, None) when the GPS IFD has no
+    # usable coordinates: phones without a fix often write one holding only
+    # GPSVersionID (or a timestamp).
+    @tracer.start_as_current_span("ImageGps.get_lat_lon")
     def get_lat_lon(self, gps_ifd):
         g = ExifTags.GPS
         lat_dms = gps_ifd.get(g.GPSLatitude)
         lon_dms = gps_ifd.get(g.GPSLongitude)
         lat_ref = gps_ifd.get(g.GPSLatitudeRef)
         lon_ref = gps_ifd.get(g.GPSLongitudeRef)
-        return self.convert_dms_to_dd(lat_dms, lat_ref, lon_dms, lon_ref)
+        try:
+            return self.convert_dms_to_dd(lat_dms, lat_ref, lon_dms, lon_ref)
+        except (TypeError, ValueError, IndexError, ZeroDivisionError) as e:
+            logger.info(f"{__name__}: no coordinates in GPS IFD: {type(e)}: {e}")
+            return None, None
 
     ##
     # convert from a tuple of (d, m, s) to decimal degrees
@@ -85,3 +263,60 @@ class ImageGps:
         m = float(value[1]) / 60
         s = float(value[2]) / 3600
         return d + m + s
+
+
+##
+# extract_gps for a single item, without the batching. files are
+# memory-mapped rather than read, so only the pages the header parser
+# touches are ever loaded.
+def extract_gps(item):
+    return with_item_data(item, ImageGps.from_image_bytes)
+
+
+##
+# `read(data)` of a bytes-like item or of the file at a path, memory-mapped
+def with_item_data(item, read):
+    if isinstance(item, (str, os.PathLike)):
+        with open(item, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return read(f)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return read(mapped)
+    return read(BytesIO(item))
+
+
+##
+# (format, GPS IFD) from the header parsers, or (None, None) when they can't
+# read `data`
+def read_header(data):
+    try:
+        return ImageGps.read_header_gps_ifd(ByteSource(data))
+    except Exception as e:
+        logger.info(f"{__name__}: header parse failed: {type(e)}: {e}")
+        return None, None
+
+
+##
+# process pool entry point for ImageGps.extract_many(), module level so it
+# pickles: extract_gps for each of `items`, in order. the GPS IFDs the
+# header parsers read are converted to lat/lon together by DmsArrays (which
+# gives the same floats as get_lat_lon); anything else, including IFDs
+# DmsArrays can't convert, takes the one-image path.
+def extract_gps_batch(items):
+    from .DmsArrays import DmsArrays
+
+    images = [None] * len(items)
+    located = {}
+    for i, item in enumerate(items):
+        image_format, gps_ifd = with_item_data(item, read_header)
+        if image_format is None:
+            images[i] = extract_gps(item)
+        elif gps_ifd:
+            located[i] = gps_ifd
+        else:
+            images[i] = ImageGps(gps_ifd=gps_ifd)
+    lat, lon, valid = DmsArrays.from_gps_ifds(list(located.values()))
+    for j, (i, gps_ifd) in enumerate(located.items()):
+        lat_lon = (float(lat[j]), float(lon[j])) if valid[j] else None
+        images[i] = ImageGps(gps_ifd=gps_ifd, lat_lon=lat_lon)
+    return images
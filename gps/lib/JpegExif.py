@@ -0,0 +1,103 @@
+import logging
+
+from .ByteSource import ByteSource
+from .TiffIfd import TiffIfd
+
+logger = logging.getLogger(__name__)
+
+
+class ScanLimitReached(ValueError):
+    ##
+    # raised by JpegExif.segments when the segments run on past its limit
+    # without reaching the image data. unlike "no Exif", it says nothing about
+    # the image, so callers fall back to Pillow rather than reporting no GPS.
+    def __init__(self, limit: int):
+        super().__init__(f"no image data in first {limit} bytes")
+        self.limit = limit
+
+
+class JpegExif:
+    ##
+    # Streaming JPEG header walker. It hops from marker to marker using the
+    # segment lengths, stops at the first APP1 "Exif" segment and hands only
+    # that segment to TiffIfd. The entropy-coded image data is never read, so
+    # for a typical phone photo only the first few tens of KB are touched.
+    SOI = b"\xff\xd8"
+    APP1 = 0xE1
+    SOS = 0xDA
+    EOI = 0xD9
+    EXIF_HEADER = b"Exif\x00\x00"
+    # stop walking if no Exif segment turns up within this many bytes.
+    MAX_SCAN_BYTES = 256 * 1024
+
+    @staticmethod
+    def is_jpeg(source: ByteSource) -> bool:
+        try:
+            return bytes(source.read_at(0, 2)) == JpegExif.SOI
+        except Exception:
+            return False
+
+    ##
+    # yield (marker code, segment offset, payload offset, payload length) for
+    # each segment up to and including SOS (or EOI), walking no further than
+    # `limit` bytes (default MAX_SCAN_BYTES). standalone markers have a payload
+    # length of 0; SOS's payload is just its header, the image data follows.
+    # raises ValueError for a malformed marker stream, ScanLimitReached when
+    # `limit` is passed first and NeedMoreData when the source ends mid-header.
+    @staticmethod
+    def segments(source: ByteSource, limit: int = None):
+        if limit is None:
+            limit = JpegExif.MAX_SCAN_BYTES
+        if bytes(source.read_at(0, 2)) != JpegExif.SOI:
+            raise ValueError("not a JPEG (missing SOI)")
+        offset = 2
+        while offset < limit:
+            marker = source.read_at(offset, 2)
+            if marker[0] != 0xFF:
+                raise ValueError(f"expected JPEG marker at offset {offset}")
+            if marker[1] == 0xFF:
+                # fill byte before the marker
+                offset += 1
+                continue
+            code = marker[1]
+            if code == JpegExif.EOI or 0xD0 <= code <= 0xD7 or code == 0x01:
+                # standalone markers carry no length
+                yield code, offset, offset + 2, 0
+                if code == JpegExif.EOI:
+                    return
+                offset += 2
+                continue
+            length = int.from_bytes(source.read_at(offset + 2, 2), "big")
+            if length < 2:
+                raise ValueError(f"bad JPEG segment length at offset {offset}")
+            yield code, offset, offset + 4, length - 2
+            if code == JpegExif.SOS:
+                return
+            offset += 2 + length
+        raise ScanLimitReached(limit)
+
+    ##
+    # returns a memoryview of the TIFF block inside the APP1 Exif segment, or
+    # None when the JPEG has no Exif segment before the image data starts.
+    # raises as segments() does, so an Exif segment that may lie beyond
+    # MAX_SCAN_BYTES is a ScanLimitReached, not None.
+    @staticmethod
+    def find_exif(source: ByteSource):
+        header_length = len(JpegExif.EXIF_HEADER)
+        for code, _, payload_offset, payload_length in JpegExif.segments(source):
+            if code == JpegExif.APP1 and payload_length >= header_length:
+                header = bytes(source.read_at(payload_offset, header_length))
+                if header == JpegExif.EXIF_HEADER:
+                    return source.read_at(
+                        payload_offset + header_length, payload_length - header_length
+                    )
+        return None
+
+    ##
+    # GPS IFD of a JPEG as {tag: value}, {} if the image carries no GPS data.
+    @staticmethod
+    def read_gps_ifd(source: ByteSource) -> dict:
+        tiff = JpegExif.find_exif(source)
+        if tiff is None:
+            return {}
+        return TiffIfd.read_gps_ifd(tiff)
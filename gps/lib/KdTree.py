@@ -0,0 +1,77 @@
+import numpy as np
+
+
+class KdTree:
+    ##
+    # Static 2-D KD-tree over numpy coordinate arrays, packed into the arrays
+    # themselves (as in kdbush): the points are reordered so that each node's
+    # median sits in the middle of its slice, with the points left of it on
+    # one side and right of it on the other, alternating x and y by depth.
+    # Slices of NODE_SIZE points or fewer are leaves and are scanned with one
+    # vectorised comparison. Queries return indexes into the arrays passed to
+    # the constructor.
+    NODE_SIZE = 64
+
+    def __init__(self, xs, ys):
+        self.order = np.arange(len(xs))
+        self.xs = np.asarray(xs, dtype=np.float64).copy()
+        self.ys = np.asarray(ys, dtype=np.float64).copy()
+        stack = [(0, len(self.xs) - 1, 0)]
+        while stack:
+            left, right, axis = stack.pop()
+            if right - left <= self.NODE_SIZE:
+                continue
+            middle = (left + right) // 2
+            self.select(left, right, middle, axis)
+            stack.append((left, middle - 1, 1 - axis))
+            stack.append((middle + 1, right, 1 - axis))
+
+    def __len__(self):
+        return len(self.xs)
+
+    ##
+    # reorder [left, right] so the point at `middle` is the median along
+    # `axis`, smaller ones before it and larger ones after.
+    def select(self, left, right, middle, axis):
+        coords = self.xs if axis == 0 else self.ys
+        part = np.argpartition(coords[left : right + 1], middle - left)
+        for array in (self.xs, self.ys, self.order):
+            array[left : right + 1] = array[left : right + 1][part]
+
+    ##
+    # indexes of the points with min_x <= x <= max_x and min_y <= y <= max_y.
+    # each node on the stack carries the bounds its splits give it, so a node
+    # that lies wholly inside the query is taken without looking at it.
+    def range(self, min_x, min_y, max_x, max_y):
+        found = []
+        inf = np.inf
+        stack = [(0, len(self.xs) - 1, 0, -inf, -inf, inf, inf)] if len(self) else []
+        xs, ys = self.xs, self.ys
+        while stack:
+            left, right, axis, x0, y0, x1, y1 = stack.pop()
+            if min_x <= x0 and x1 <= max_x and min_y <= y0 and y1 <= max_y:
+                found.append(self.order[left : right + 1])
+                continue
+            if right - left <= self.NODE_SIZE:
+                x = xs[left : right + 1]
+                y = ys[left : right + 1]
+                inside = (x >= min_x) & (x <= max_x) & (y >= min_y) & (y <= max_y)
+                found.append(self.order[left : right + 1][inside])
+                continue
+            middle = (left + right) // 2
+            x, y = xs[middle], ys[middle]
+            if min_x <= x <= max_x and min_y <= y <= max_y:
+                found.append(self.order[middle : middle + 1])
+            if axis == 0:
+                if min_x <= x:
+                    stack.append((left, middle - 1, 1, x0, y0, x, y1))
+                if max_x >= x:
+                    stack.append((middle + 1, right, 1, x, y0, x1, y1))
+            else:
+                if min_y <= y:
+                    stack.append((left, middle - 1, 0, x0, y0, x1, y))
+                if max_y >= y:
+                    stack.append((middle + 1, right, 0, x0, y, x1, y1))
+        if not found:
+            return np.empty(0, dtype=self.order.dtype)
+        return np.concatenate(found)
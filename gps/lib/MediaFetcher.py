@@ -0,0 +1,414 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from .ByteSource import ByteSource, NeedMoreData
+from .ImageGps import ImageGps
+from .Tracing import Tracing, tracer
+
+logger = logging.getLogger(__name__)
+
+
+class Media:
+    ##
+    # what came back for one media URL. `content` is the whole file when
+    # `complete`, otherwise only its leading bytes; `gps_image` is set when
+    # the GPS data was read from those leading bytes (see fetch_partial).
+    __slots__ = ("status_code", "content", "complete", "gps_image")
+
+    def __init__(self, status_code, content=b"", complete=False, gps_image=None):
+        self.status_code = status_code
+        self.content = content
+        self.complete = complete
+        self.gps_image = gps_image
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code in (200, 206)
+
+
+class MediaFetcher:
+    ##
+    # Downloads MMS media from Twilio. One requests.Session per process keeps
+    # connections alive between webhooks (Twilio's API and the storage host it
+    # redirects to), so only the first fetch pays for the TCP+TLS handshake,
+    # and all the media of one message are fetched at once on a small shared
+    # thread pool.
+    #
+    # Every request has connect/read timeouts, and fetch_all gives up on
+    # whatever hasn't finished after TOTAL_TIMEOUT, so a slow media host
+    # can't hold a webhook anywhere near gunicorn's --timeout 60.
+    #
+    # requests (and aiohttp, for AsyncMediaFetcher) are imported on the first
+    # fetch rather than with this module: the views import it, and most
+    # requests a fresh instance serves never fetch media (see profile_startup).
+    CONNECT_TIMEOUT = 3.05
+    READ_TIMEOUT = 10
+    TOTAL_TIMEOUT = 25
+    # Twilio sends at most 10 media per MMS
+    MAX_WORKERS = 10
+    # fetch_partial: the first Range request, and the point past which the
+    # rest of the file is simply downloaded instead of widening further.
+    FIRST_RANGE_BYTES = 64 * 1024
+    MAX_RANGE_BYTES = 1024 * 1024
+    MAX_RANGE_REQUESTS = 4
+    CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+    def __init__(self, max_workers: int = MAX_WORKERS):
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        self.requests_session = None
+        self.pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="mms-media"
+        )
+
+    ##
+    # the keep-alive requests.Session, made on first use
+    @property
+    def session(self):
+        with self.lock:
+            if self.requests_session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.max_workers)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self.requests_session = session
+            return self.requests_session
+
+    ##
+    # the whole file at `url` as a Media, or None if it could not be fetched.
+    def fetch(self, url: str, auth=None):
+        import requests
+
+        with tracer.start_as_current_span("twilio.media_fetch") as span:
+            try:
+                r = self.get(url, auth)
+            except requests.RequestException as e:
+                logger.warning(f"{__name__}.fetch: {url}: {type(e)}: {e}")
+                span.record_exception(e)
+                return None
+            Tracing.set_attributes(
+                span,
+                {
+                    "http.response.status_code": r.status_code,
+                    "media.bytes": Tracing.size_of(r.content),
+                },
+            )
+            return Media(r.status_code, r.content, complete=r.status_code == 200)
+
+    ##
+    # like fetch, but only downloads as much of the file as the header
+    # parsers need. the first request asks for FIRST_RANGE_BYTES; when the
+    # Exif data runs past what has arrived (NeedMoreData) the next request
+    # asks for the missing bytes only, at least doubling the total each time.
+    # the rest of the file is downloaded, so Pillow can have it all, when:
+    #   - the file isn't JPEG/HEIF or its header can't be parsed,
+    #   - the GPS data lies beyond MAX_RANGE_BYTES / MAX_RANGE_REQUESTS.
+    # a server that ignores Range answers 200 with the whole file, which is
+    # used as is. with whole_if_located, the rest of a file whose header has
+    # coordinates is fetched as well, for its thumbnail.
+    def fetch_partial(self, url: str, auth=None, whole_if_located=False):
+        import requests
+
+        with tracer.start_as_current_span("twilio.media_fetch") as span:
+            span.set_attribute("media.range", True)
+            data = b""
+            requests_made = 0
+            try:
+                media = None
+                want = self.FIRST_RANGE_BYTES
+                while media is None:
+                    want = self.next_range_end(want, requests_made)
+                    requests_made += 1
+                    r = self.get(url, auth, start=len(data), end=want)
+                    media, data, want = self.range_step(r, data, want)
+                if whole_if_located and self.wants_rest(media):
+                    requests_made += 1
+                    r = self.get(url, auth, start=len(data))
+                    media = self.with_rest(media, r, data)
+            except (requests.RequestException, ValueError) as e:
+                logger.warning(f"{__name__}.fetch_partial: {url}: {type(e)}: {e}")
+                span.record_exception(e)
+                return None
+            Tracing.set_attributes(
+                span,
+                {
+                    "http.response.status_code": media.status_code,
+                    "media.bytes": len(media.content),
+                    "media.range_requests": requests_made,
+                    "media.complete": media.complete,
+                },
+            )
+            return media
+
+    ##
+    # None ("the rest of the file") once ranges stop being worth it
+    @staticmethod
+    def next_range_end(want, requests_made: int):
+        if requests_made >= MediaFetcher.MAX_RANGE_REQUESTS:
+            return None
+        if want is not None and want > MediaFetcher.MAX_RANGE_BYTES:
+            return None
+        return want
+
+    ##
+    # one round of fetch_partial: (Media when done or None, data so far,
+    # end of the next range or None for "the rest of the file").
+    @staticmethod
+    def range_step(r, data: bytes, want):
+        if r.status_code == 200:
+            # Range ignored; this is the whole file
+            return Media(200, r.content, complete=True), r.content, None
+        if r.status_code == 416 and data:
+            # asked past the end: what we have is the whole file
+            return Media(206, data, complete=True), data, None
+        if r.status_code != 206:
+            return Media(r.status_code), data, None
+        match = MediaFetcher.CONTENT_RANGE.fullmatch(r.headers.get("Content-Range", ""))
+        if match is None or int(match[1]) != len(data):
+            raise ValueError(
+                f"unexpected Content-Range: {r.headers.get('Content-Range')}"
+            )
+        data += r.content
+        complete = match[3] != "*" and len(data) >= int(match[3])
+        if want is None or complete:
+            # the rest of the file (or all there is): done either way
+            return MediaFetcher.complete_media(data), data, None
+        try:
+            image_format, gps_ifd = ImageGps.read_header_gps_ifd(ByteSource(data))
+        except NeedMoreData as e:
+            return None, data, max(e.needed, 2 * len(data))
+        except Exception as e:
+            logger.info(f"{__name__}: header parse failed, fetching it all: {e}")
+            return None, data, None
+        if image_format is None:
+            return None, data, None
+        return Media(206, data, gps_image=ImageGps(gps_ifd=gps_ifd)), data, None
+
+    ##
+    # whether `media` is the start of a photo with coordinates
+    @staticmethod
+    def wants_rest(media: Media) -> bool:
+        return (
+            not media.complete
+            and media.gps_image is not None
+            and media.gps_image.lat is not None
+        )
+
+    ##
+    # `media` completed by `r`, the reply to a Range request for the rest of
+    # the file; `media` as it was if that didn't work out
+    @staticmethod
+    def with_rest(media: Media, r, data: bytes) -> Media:
+        rest, _, _ = MediaFetcher.range_step(r, data, None)
+        if rest is None or not rest.complete:
+            return media
+        rest.gps_image = media.gps_image
+        return rest
+
+    ##
+    # the whole file, got in pieces. parsed here too: a small JPEG can end
+    # inside the first range.
+    @staticmethod
+    def complete_media(data: bytes):
+        media = Media(206, data, complete=True)
+        try:
+            image_format, gps_ifd = ImageGps.read_header_gps_ifd(ByteSource(data))
+        except Exception:
+            return media
+        if image_format is not None:
+            media.gps_image = ImageGps(gps_ifd=gps_ifd)
+        return media
+
+    ##
+    # GET `url`, or the bytes from `start` up to (not including) `end` of it
+    # when either is given (end None: to the end of the file).
+    def get(self, url: str, auth=None, start: int = None, end: int = None):
+        return self.session.get(
+            url,
+            auth=auth,
+            headers=self.range_headers(start, end),
+            timeout=(self.CONNECT_TIMEOUT, self.READ_TIMEOUT),
+        )
+
+    @staticmethod
+    def range_headers(start: int = None, end: int = None) -> dict:
+        if start is None and end is None:
+            return {}
+        last = "" if end is None else str(end - 1)
+        return {"Range": f"bytes={start or 0}-{last}"}
+
+    ##
+    # Media (or None) for `urls`, in order, fetched concurrently. each
+    # task runs in a copy of the caller's context so its span nests under
+    # the caller's.
+    def fetch_all(self, urls, auth=None, partial=False, whole_if_located=False):
+        if partial:
+            fetch = functools.partial(
+                self.fetch_partial, whole_if_located=whole_if_located
+            )
+        else:
+            fetch = self.fetch
+        futures = [
+            self.pool.submit(contextvars.copy_context().run, fetch, url, auth)
+            for url in urls
+        ]
+        done, not_done = wait(futures, timeout=self.TOTAL_TIMEOUT)
+        for future in not_done:
+            future.cancel()
+        if not_done:
+            logger.warning(
+                f"{__name__}.fetch_all: {len(not_done)} of {len(urls)} media not fetched within {self.TOTAL_TIMEOUT}s"
+            )
+        return [future.result() if future in done else None for future in futures]
+
+
+class HttpReply:
+    ##
+    # the parts of an aiohttp response that MediaFetcher.range_step reads,
+    # named like requests.Response's.
+    __slots__ = ("status_code", "headers", "content")
+
+    def __init__(self, status_code: int, headers, content: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+
+class AsyncMediaFetcher:
+    ##
+    # MediaFetcher for the async webhook views: the same requests (and the
+    # same Range logic, MediaFetcher.range_step) made with aiohttp, so a
+    # worker waiting on Twilio is free to serve other webhooks.
+    #
+    # Under an ASGI server the event loop lives as long as the worker, and
+    # one ClientSession on it keeps connections alive between webhooks
+    # (keep_alive=True). A view run by a WSGI server gets a fresh event loop
+    # per request (async_to_sync), so there fetch_all uses a session of its
+    # own and closes it before returning.
+    MAX_CONNECTIONS = 256
+
+    def __init__(self):
+        self.session = None
+        self.session_loop = None
+
+    def new_session(self) -> "aiohttp.ClientSession":
+        import aiohttp
+
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.MAX_CONNECTIONS),
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=MediaFetcher.CONNECT_TIMEOUT,
+                sock_read=MediaFetcher.READ_TIMEOUT,
+            ),
+        )
+
+    def shared_session(self) -> "aiohttp.ClientSession":
+        loop = asyncio.get_running_loop()
+        if self.session is None or self.session.closed or self.session_loop is not loop:
+            self.session = self.new_session()
+            self.session_loop = loop
+        return self.session
+
+    async def get(self, session, url: str, auth=None, start=None, end=None):
+        import aiohttp
+
+        async with session.get(
+            url,
+            auth=aiohttp.BasicAuth(*auth) if auth else None,
+            headers=MediaFetcher.range_headers(start, end),
+        ) as r:
+            return HttpReply(r.status, r.headers, await r.read())
+
+    async def fetch(self, session, url: str, auth=None):
+        import aiohttp
+
+        with tracer.start_as_current_span("twilio.media_fetch") as span:
+            try:
+                r = await self.get(session, url, auth)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"{__name__}.fetch: {url}: {type(e)}: {e}")
+                span.record_exception(e)
+                return None
+            Tracing.set_attributes(
+                span,
+                {
+                    "http.response.status_code": r.status_code,
+                    "media.bytes": len(r.content),
+                },
+            )
+            return Media(r.status_code, r.content, complete=r.status_code == 200)
+
+    async def fetch_partial(self, session, url: str, auth=None, whole_if_located=False):
+        import aiohttp
+
+        with tracer.start_as_current_span("twilio.media_fetch") as span:
+            span.set_attribute("media.range", True)
+            data = b""
+            requests_made = 0
+            try:
+                media = None
+                want = MediaFetcher.FIRST_RANGE_BYTES
+                while media is None:
+                    want = MediaFetcher.next_range_end(want, requests_made)
+                    requests_made += 1
+                    r = await self.get(session, url, auth, start=len(data), end=want)
+                    media, data, want = MediaFetcher.range_step(r, data, want)
+                if whole_if_located and MediaFetcher.wants_rest(media):
+                    requests_made += 1
+                    r = await self.get(session, url, auth, start=len(data))
+                    media = MediaFetcher.with_rest(media, r, data)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                logger.warning(f"{__name__}.fetch_partial: {url}: {type(e)}: {e}")
+                span.record_exception(e)
+                return None
+            Tracing.set_attributes(
+                span,
+                {
+                    "http.response.status_code": media.status_code,
+                    "media.bytes": len(media.content),
+                    "media.range_requests": requests_made,
+                    "media.complete": media.complete,
+                },
+            )
+            return media
+
+    ##
+    # Media (or None) for `urls`, in order, fetched concurrently; anything
+    # not done after MediaFetcher.TOTAL_TIMEOUT is cancelled.
+    async def fetch_all(
+        self, urls, auth=None, partial=False, keep_alive=True, whole_if_located=False
+    ):
+        session = self.shared_session() if keep_alive else self.new_session()
+        if partial:
+            fetch = functools.partial(
+                self.fetch_partial, whole_if_located=whole_if_located
+            )
+        else:
+            fetch = self.fetch
+        tasks = [asyncio.ensure_future(fetch(session, url, auth)) for url in urls]
+        try:
+            done, not_done = await asyncio.wait(
+                tasks, timeout=MediaFetcher.TOTAL_TIMEOUT
+            )
+            for task in not_done:
+                task.cancel()
+            if not_done:
+                logger.warning(
+                    f"{__name__}.fetch_all: {len(not_done)} of {len(urls)} media not fetched within {MediaFetcher.TOTAL_TIMEOUT}s"
+                )
+            return [task.result() if task in done else None for task in tasks]
+        finally:
+            if not keep_alive:
+                await session.close()
+
+
+media_fetcher = MediaFetcher()
+async_media_fetcher = AsyncMediaFetcher()
@@ -0,0 +1,202 @@
+import mmap
+import os
+import struct
+
+from .ByteSource import ByteSource
+from .HeifExif import HeifExif
+from .JpegExif import JpegExif
+from .TiffIfd import TiffIfd
+
+
+class MetadataStripper:
+    ##
+    # Removes location and other personal metadata from JPEG and HEIF photos
+    # without decoding them, using the same header walkers as ImageGps
+    # (JpegExif.segments, HeifExif.read_meta). The compressed image data is
+    # copied through byte for byte, so stripping runs at memory/disk speed and
+    # the picture is exactly what was sent.
+    #
+    # JPEG: every APPn segment except JFIF/JFXX (APP0), ICC profiles (APP2)
+    # and Adobe's colour transform (APP14) is dropped, which takes out Exif
+    # (GPS, camera serials, MakerNote), XMP, MPF, IPTC and the like, and so
+    # are comments. If the photo had an Exif orientation, a new Exif segment
+    # holding just that is written, so it still displays the right way up.
+    # Images that MPF says are appended after the primary one (phones put
+    # depth and HDR gain maps there, with their own Exif) are cut off.
+    #
+    # HEIF: items can't be removed without rewriting every offset in iloc, so
+    # the Exif item is overwritten in place with an Exif block holding only
+    # the orientation, padded with zeros, and XMP items with spaces. The file
+    # keeps its length and layout.
+    APP0 = 0xE0
+    APP2 = 0xE2
+    APP14 = 0xEE
+    COM = 0xFE
+    ICC_HEADER = b"ICC_PROFILE\x00"
+    MPF_HEADER = b"MPF\x00"
+    MP_ENTRY = 0xB002
+    ORIENTATION = 0x0112
+    XMP_CONTENT_TYPE = "application/rdf+xml"
+
+    ##
+    # the stripped photo, bytes-like. `data` is bytes-like (or an mmap).
+    # raises ValueError for anything that isn't a well-formed JPEG or HEIF.
+    @staticmethod
+    def strip(data):
+        source = ByteSource(data)
+        if JpegExif.is_jpeg(source):
+            return b"".join(MetadataStripper.jpeg_parts(source))
+        if HeifExif.is_heif(source):
+            return MetadataStripper.strip_heif(source)
+        raise ValueError("not a JPEG or HEIF photo")
+
+    ##
+    # strip the photo at `path` into `destination` with one write. the input
+    # is memory mapped, so only its headers are actually read into Python.
+    @staticmethod
+    def strip_file(path, destination):
+        with open(path, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as m:
+            stripped = MetadataStripper.strip(m)
+        tmp = f"{destination}.tmp"
+        with open(tmp, "wb") as out:
+            out.write(stripped)
+        os.replace(tmp, destination)
+        return len(stripped)
+
+    ##
+    # memoryviews of the pieces of the stripped JPEG, in order
+    @staticmethod
+    def jpeg_parts(source: ByteSource):
+        parts = [memoryview(JpegExif.SOI)]
+        orientation = None
+        end = len(source)
+        exif_at = 1
+        for code, offset, payload_offset, payload_length in JpegExif.segments(
+            source, limit=len(source)
+        ):
+            segment = source.read_at(offset, payload_offset + payload_length - offset)
+            payload = source.read_at(payload_offset, payload_length)
+            if code == JpegExif.SOS:
+                parts.append(source.read_at(offset, end - offset))
+                break
+            if code == JpegExif.EOI:
+                raise ValueError("JPEG has no image data")
+            if code == JpegExif.APP1 and orientation is None:
+                orientation = MetadataStripper.jpeg_orientation(payload)
+            if code == MetadataStripper.APP2:
+                if bytes(payload[:4]) == MetadataStripper.MPF_HEADER:
+                    end = min(end, MetadataStripper.primary_length(payload, end))
+            if MetadataStripper.keep_segment(code, payload):
+                parts.append(segment)
+                if code == MetadataStripper.APP0 and exif_at == len(parts) - 1:
+                    exif_at = len(parts)
+        else:
+            raise ValueError("JPEG has no image data")
+        if orientation not in (None, 1):
+            exif = JpegExif.EXIF_HEADER + MetadataStripper.tiff(orientation)
+            app1 = struct.pack(">BBH", 0xFF, JpegExif.APP1, 2 + len(exif)) + exif
+            parts.insert(exif_at, memoryview(app1))
+        return parts
+
+    @staticmethod
+    def keep_segment(code: int, payload) -> bool:
+        if code == MetadataStripper.COM:
+            return False
+        if not MetadataStripper.APP0 <= code <= 0xEF:
+            return True
+        if code == MetadataStripper.APP2:
+            header = MetadataStripper.ICC_HEADER
+            return bytes(payload[: len(header)]) == header
+        return code in (MetadataStripper.APP0, MetadataStripper.APP14)
+
+    @staticmethod
+    def jpeg_orientation(payload):
+        header = JpegExif.EXIF_HEADER
+        if bytes(payload[: len(header)]) != header:
+            return None
+        return MetadataStripper.orientation(payload[len(header) :])
+
+    ##
+    # the Orientation in a TIFF block, or None
+    @staticmethod
+    def orientation(tiff):
+        try:
+            tiff = memoryview(tiff).cast("B")
+            endian = TiffIfd.byte_order(tiff)
+            (ifd0,) = TiffIfd.unpack(tiff, endian + "L", 4)
+            value = TiffIfd.read_ifd(
+                tiff, endian, ifd0, MetadataStripper.ORIENTATION
+            ).get(MetadataStripper.ORIENTATION)
+        except (ValueError, struct.error):
+            return None
+        if isinstance(value, tuple):
+            value = value[0] if value else None
+        return value if isinstance(value, int) and 1 <= value <= 8 else None
+
+    ##
+    # a big-endian TIFF block whose IFD0 holds just an Orientation
+    @staticmethod
+    def tiff(orientation: int) -> bytes:
+        return (
+            b"MM\x00*"
+            + struct.pack(">L", 8)
+            + struct.pack(">H", 1)
+            + struct.pack(">HHLHH", MetadataStripper.ORIENTATION, 3, 1, orientation, 0)
+            + struct.pack(">L", 0)
+        )
+
+    ##
+    # the length of the primary image, from the first MP Entry of an MPF
+    # segment's payload; `default` when it can't be read
+    @staticmethod
+    def primary_length(payload, default: int) -> int:
+        try:
+            tiff = memoryview(payload).cast("B")[len(MetadataStripper.MPF_HEADER) :]
+            endian = TiffIfd.byte_order(tiff)
+            (ifd0,) = TiffIfd.unpack(tiff, endian + "L", 4)
+            entries = TiffIfd.read_ifd(
+                tiff, endian, ifd0, MetadataStripper.MP_ENTRY
+            ).get(MetadataStripper.MP_ENTRY)
+            if not isinstance(entries, bytes) or len(entries) < 16:
+                return default
+            (size,) = struct.unpack_from(endian + "L", entries, 4)
+        except (ValueError, struct.error):
+            return default
+        return size if 0 < size <= default else default
+
+    @staticmethod
+    def strip_heif(source: ByteSource) -> bytearray:
+        meta = HeifExif.read_meta(source)
+        stripped = bytearray(source.read_at(0, len(source)))
+        if meta is None:
+            return stripped
+        items, locations, idat_offset = meta
+        for item_id, (item_type, content_type) in items.items():
+            if item_type == b"Exif":
+                extents = HeifExif.item_extents(locations, item_id, idat_offset)
+                item = b"".join(source.read_at(*extent) for extent in extents)
+                if len(item) < 4:
+                    raise ValueError(f"Exif item {item_id} is {len(item)} bytes")
+                (tiff_offset,) = struct.unpack_from(">L", item, 0)
+                orientation = MetadataStripper.orientation(item[4 + tiff_offset :])
+                fill = struct.pack(">L", 0) + MetadataStripper.tiff(orientation or 1)
+            elif (
+                item_type == b"mime"
+                and content_type == MetadataStripper.XMP_CONTENT_TYPE
+            ):
+                extents = HeifExif.item_extents(locations, item_id, idat_offset)
+                fill = b""
+            else:
+                continue
+            padding = b" " if item_type == b"mime" else b"\x00"
+            total = sum(length for _, length in extents)
+            fill = (fill + padding * total)[:total]
+            done = 0
+            for offset, length in extents:
+                if offset + length > len(stripped):
+                    raise ValueError(f"item {item_id} runs past the end of the file")
+                stripped[offset : offset + length] = fill[done : done + length]
+                done += length
+        return stripped
@@ -0,0 +1,259 @@
+import json
+import logging
+from datetime import datetime, time
+from xml.sax.saxutils import escape
+
+from asgiref.sync import sync_to_async
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from ..models import GpsObservation
+from .Tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class ObservationExport:
+    ##
+    # Bulk export of the stored observations as GeoJSON, GPX or KML, for the
+    # /gps/export view and the export_observations command. Rows are read
+    # with QuerySet.iterator (a server-side cursor where the database has
+    # them, fetchmany batches with SQLite) and written out a few hundred at a
+    # time as text chunks of about CHUNK_BYTES, so memory use doesn't depend
+    # on how many observations are exported.
+    #
+    # Filters, as query parameters or command options:
+    #   start, end  - ISO 8601 date or datetime; [start, end)
+    #   time        - "taken" (the photo's GPS time, default) or "received"
+    #   source      - comma separated channels: html, mms, email
+    #   bbox        - south,west,north,east in degrees (west > east crosses
+    #                 the antimeridian)
+    CHUNK_BYTES = 64 * 1024
+    ITERATOR_CHUNK = 2000
+    COLUMNS = (
+        "id",
+        "lat",
+        "lon",
+        "altitude",
+        "timestamp",
+        "received_at",
+        "source",
+        "h_error",
+        "speed",
+        "direction",
+    )
+    TIME_FIELDS = {"taken": "timestamp", "received": "received_at"}
+
+    def __init__(self, format_name: str, params):
+        if format_name not in FORMATS:
+            raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+        self.format = FORMATS[format_name]()
+        self.filters = self.parse(params)
+
+    @property
+    def content_type(self) -> str:
+        return self.format.content_type
+
+    @property
+    def filename(self) -> str:
+        return f"observations.{self.format.extension}"
+
+    ##
+    # checked filters from query parameters / options (strings or None);
+    # ValueError for ones that don't make sense.
+    @classmethod
+    def parse(cls, params):
+        filters = {}
+        for name in ("start", "end"):
+            if params.get(name):
+                filters[name] = cls.parse_time(name, params[name])
+        time_field = params.get("time") or "taken"
+        if time_field not in cls.TIME_FIELDS:
+            raise ValueError(f"time must be one of {', '.join(cls.TIME_FIELDS)}")
+        filters["field"] = cls.TIME_FIELDS[time_field]
+        if params.get("source"):
+            sources = params["source"].split(",")
+            unknown = set(sources) - set(GpsObservation.Source.values)
+            if unknown:
+                raise ValueError(f"unknown source {', '.join(sorted(unknown))}")
+            filters["sources"] = sources
+        if params.get("bbox"):
+            try:
+                south, west, north, east = (float(v) for v in params["bbox"].split(","))
+            except ValueError:
+                raise ValueError("bbox must be south,west,north,east in degrees")
+            if not (-90 <= south <= north <= 90 and -180 <= west <= 180):
+                raise ValueError("bbox must be south,west,north,east in degrees")
+            if not -180 <= east <= 180:
+                raise ValueError("bbox must be south,west,north,east in degrees")
+            filters["bbox"] = (south, west, north, east)
+        return filters
+
+    @staticmethod
+    def parse_time(name: str, value: str) -> datetime:
+        try:
+            parsed = parse_datetime(value)
+            if parsed is None:
+                day = parse_date(value)
+                parsed = datetime.combine(day, time()) if day else None
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise ValueError(f"{name} must be an ISO 8601 date or datetime")
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+
+    def queryset(self):
+        filters = self.filters
+        qs = GpsObservation.objects.all()
+        if "bbox" in filters:
+            qs = qs.in_bbox(*filters["bbox"])
+        qs = qs.between(filters.get("start"), filters.get("end"), filters["field"])
+        if "sources" in filters:
+            qs = qs.filter(source__in=filters["sources"])
+        return qs.order_by("id").values_list(*self.COLUMNS)
+
+    ##
+    # the export as str chunks. the span isn't made current: the generator
+    # is resumed by whichever thread is sending the response.
+    def chunks(self):
+        count = 0
+        span = tracer.start_span("ObservationExport.chunks")
+        span.set_attribute("export.format", self.format.extension)
+        try:
+            parts = [self.format.header()]
+            size = len(parts[0])
+            rows = self.queryset().iterator(chunk_size=self.ITERATOR_CHUNK)
+            for row in rows:
+                part = self.format.row(dict(zip(self.COLUMNS, row)))
+                parts.append(part)
+                size += len(part)
+                count += 1
+                if size >= self.CHUNK_BYTES:
+                    yield "".join(parts)
+                    parts, size = [], 0
+            parts.append(self.format.footer())
+            yield "".join(parts)
+        finally:
+            span.set_attribute("export.observations", count)
+            span.end()
+        logger.debug(f"{__name__}: exported {count} observations")
+
+    ##
+    # chunks() for an ASGI response: Django would otherwise read a sync
+    # iterator into a list before sending any of it. each chunk is made on
+    # the sync thread, which is where the cursor's connection lives.
+    async def async_chunks(self):
+        chunks = self.chunks()
+        step = sync_to_async(next)
+        try:
+            while True:
+                chunk = await step(chunks, None)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            await sync_to_async(chunks.close)()
+
+
+def iso(value):
+    return value.isoformat() if value is not None else None
+
+
+##
+# a FeatureCollection, one feature per line
+class GeoJsonExport:
+    content_type = "application/geo+json"
+    extension = "geojson"
+
+    def __init__(self):
+        self.written = 0
+
+    def header(self):
+        return '{"type": "FeatureCollection", "features": [\n'
+
+    def row(self, fields):
+        coordinates = [fields["lon"], fields["lat"]]
+        if fields["altitude"] is not None:
+            coordinates.append(fields["altitude"])
+        properties = {
+            "id": fields["id"],
+            "source": fields["source"],
+            "timestamp": iso(fields["timestamp"]),
+            "received_at": iso(fields["received_at"]),
+        }
+        for name in ("h_error", "speed", "direction"):
+            if fields[name] is not None:
+                properties[name] = fields[name]
+        feature = {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": coordinates},
+            "properties": properties,
+        }
+        separator = ",\n" if self.written else ""
+        self.written += 1
+        return separator + json.dumps(feature)
+
+    def footer(self):
+        return "\n]}\n"
+
+
+##
+# GPX 1.1 waypoints: the observations are separate photos, not a track
+class GpxExport(GeoJsonExport):
+    content_type = "application/gpx+xml"
+    extension = "gpx"
+
+    def header(self):
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<gpx version="1.1" creator="Shed" '
+            'xmlns="http://www.topografix.com/GPX/1/1">\n'
+        )
+
+    def row(self, fields):
+        parts = [f'<wpt lat="{fields["lat"]!r}" lon="{fields["lon"]!r}">']
+        if fields["altitude"] is not None:
+            parts.append(f"<ele>{fields['altitude']!r}</ele>")
+        if fields["timestamp"] is not None:
+            parts.append(f"<time>{iso(fields['timestamp'])}</time>")
+        parts.append(f"<name>{fields['id']}</name>")
+        parts.append(f"<src>{escape(fields['source'])}</src>")
+        parts.append("</wpt>\n")
+        return "".join(parts)
+
+    def footer(self):
+        return "</gpx>\n"
+
+
+class KmlExport(GeoJsonExport):
+    content_type = "application/vnd.google-earth.kml+xml"
+    extension = "kml"
+
+    def header(self):
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<kml xmlns="http://www.opengis.net/kml/2.2"><Document>\n'
+            "<name>Shed observations</name>\n"
+        )
+
+    def row(self, fields):
+        coordinates = f"{fields['lon']!r},{fields['lat']!r}"
+        if fields["altitude"] is not None:
+            coordinates += f",{fields['altitude']!r}"
+        parts = [f"<Placemark><name>{fields['id']}</name>"]
+        parts.append(f"<description>{escape(fields['source'])}</description>")
+        if fields["timestamp"] is not None:
+            parts.append(
+                f"<TimeStamp><when>{iso(fields['timestamp'])}</when></TimeStamp>"
+            )
+        parts.append(f"<Point><coordinates>{coordinates}</coordinates></Point>")
+        parts.append("</Placemark>\n")
+        return "".join(parts)
+
+    def footer(self):
+        return "</Document></kml>\n"
+
+
+FORMATS = {"geojson": GeoJsonExport, "gpx": GpxExport, "kml": KmlExport}
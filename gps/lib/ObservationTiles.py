@@ -0,0 +1,153 @@
+import hashlib
+import json
+import logging
+import math
+
+import numpy as np
+from django.core.cache import caches
+
+from .SpatialIndex import SpatialIndex, spatial_index
+from .Tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class ObservationTiles:
+    ##
+    # Clustered GeoJSON map tiles of the stored observations, for
+    # /gps/tiles/{z}/{x}/{y} (standard XYZ Web Mercator tiles). A tile is
+    # built on first request from the SpatialIndex: its points are binned on
+    # a GRID x GRID grid and each non-empty cell becomes one Point feature at
+    # the cell's centroid with a `count` (and the observation `id` when it
+    # holds one), so a tile never has more than GRID * GRID features however
+    # many observations there are.
+    #
+    # Built tiles are kept, with an ETag, in the Django cache named by
+    # CACHE_ALIAS, shared by all workers. ObservationWriter calls invalidate
+    # with each batch it stores, which drops just the tiles, one per zoom
+    # level, that contain a new point; every other tile stays cached. (A tile
+    # being built while a batch is stored can miss that batch until the
+    # cache's TIMEOUT.)
+    CACHE_ALIAS = "tiles"
+    KEY_PREFIX = "tile:v1:"
+    GRID = 32
+    MAX_ZOOM = 18
+
+    def __init__(self, index: SpatialIndex = None, alias: str = CACHE_ALIAS):
+        self.index = index if index is not None else spatial_index
+        self.alias = alias
+
+    def key(self, z: int, x: int, y: int) -> str:
+        return f"{self.KEY_PREFIX}{z}/{x}/{y}"
+
+    @staticmethod
+    def valid(z: int, x: int, y: int) -> bool:
+        return 0 <= z <= ObservationTiles.MAX_ZOOM and 0 <= x < 2**z and 0 <= y < 2**z
+
+    ##
+    # (south, west, north, east) of a tile, degrees
+    @staticmethod
+    def bounds(z: int, x: int, y: int):
+        n = 2**z
+
+        def lat(row):
+            return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+        return lat(y + 1), x / n * 360.0 - 180.0, lat(y), (x + 1) / n * 360.0 - 180.0
+
+    ##
+    # (tile x, tile y) arrays of lat/lon arrays at zoom z
+    @staticmethod
+    def tile_of(lats, lons, z: int):
+        n = 2**z
+        lats = np.clip(
+            np.asarray(lats, dtype=np.float64),
+            -SpatialIndex.MAX_LAT,
+            SpatialIndex.MAX_LAT,
+        )
+        lat_r = np.radians(lats)
+        xs = (np.asarray(lons, dtype=np.float64) + 180.0) / 360.0 * n
+        ys = (1 - np.log(np.tan(lat_r) + 1 / np.cos(lat_r)) / math.pi) / 2 * n
+        clip = n - 1
+        return np.clip(xs.astype(np.int64), 0, clip), np.clip(
+            ys.astype(np.int64), 0, clip
+        )
+
+    ##
+    # (GeoJSON bytes, ETag) of a tile, from the cache or built now
+    def get(self, z: int, x: int, y: int):
+        key = self.key(z, x, y)
+        shared = caches[self.alias]
+        found = shared.get(key)
+        if found is not None:
+            return found
+        with tracer.start_as_current_span("ObservationTiles.build") as span:
+            span.set_attribute("tile", f"{z}/{x}/{y}")
+            # invalidate() ran after the rows were committed, so read them now
+            self.index.mark_stale()
+            body = self.build(z, x, y)
+            span.set_attribute("tile.bytes", len(body))
+        etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        try:
+            shared.set(key, (body, etag))
+        except Exception as e:
+            logger.warning(f"{__name__}: could not store tile {key}: {e}")
+        return body, etag
+
+    def build(self, z: int, x: int, y: int) -> bytes:
+        south, west, north, east = self.bounds(z, x, y)
+        ids, lats, lons = self.index.candidates(south, west, north, east)
+        features = []
+        if len(ids):
+            # bin on the tile's own Mercator pixel grid
+            tx, ty = self.tile_of(lats, lons, z + 5)
+            scale = 32 // self.GRID
+            columns = np.clip(tx - x * 32, 0, 31) // scale
+            rows = np.clip(ty - y * 32, 0, 31) // scale
+            cells = rows * self.GRID + columns
+            order = np.argsort(cells, kind="stable")
+            cells, ids, lats, lons = cells[order], ids[order], lats[order], lons[order]
+            starts = np.flatnonzero(np.r_[True, cells[1:] != cells[:-1]])
+            counts = np.diff(np.r_[starts, len(cells)])
+            lat_means = np.add.reduceat(lats, starts) / counts
+            lon_means = np.add.reduceat(lons, starts) / counts
+            for start, count, lat, lon in zip(
+                starts.tolist(), counts.tolist(), lat_means.tolist(), lon_means.tolist()
+            ):
+                properties = {"count": count}
+                if count == 1:
+                    properties["id"] = int(ids[start])
+                features.append(
+                    {
+                        "type": "Feature",
+                        "geometry": {
+                            "type": "Point",
+                            "coordinates": [round(lon, 7), round(lat, 7)],
+                        },
+                        "properties": properties,
+                    }
+                )
+        return json.dumps(
+            {"type": "FeatureCollection", "features": features},
+            separators=(",", ":"),
+        ).encode()
+
+    ##
+    # drop the cached tiles, at every zoom level, that contain any of the
+    # points (lat/lon sequences)
+    def invalidate(self, lats, lons) -> int:
+        if not len(lats):
+            return 0
+        keys = []
+        for z in range(self.MAX_ZOOM + 1):
+            xs, ys = self.tile_of(lats, lons, z)
+            for x, y in set(zip(xs.tolist(), ys.tolist())):
+                keys.append(self.key(z, x, y))
+        try:
+            caches[self.alias].delete_many(keys)
+        except Exception as e:
+            logger.warning(f"{__name__}: could not invalidate {len(keys)} tiles: {e}")
+        return len(keys)
+
+
+observation_tiles = ObservationTiles()
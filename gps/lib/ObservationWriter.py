@@ -0,0 +1,172 @@
+import atexit
+import hashlib
+import logging
+import threading
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connection
+
+from ..models import GpsObservation
+from .ObservationTiles import observation_tiles
+from .SpatialIndex import spatial_index
+from .Tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class ObservationWriter:
+    ##
+    # Stores GpsObservation rows for the GPS results of the upload, MMS and
+    # email views, in batches: rows are buffered per process and written with
+    # one bulk_create when BATCH_SIZE of them are waiting (by the request that
+    # fills the batch) or GPS_OBSERVATION_FLUSH_SECONDS after the first one
+    # was buffered (by a timer thread), and at exit. A flush interval of 0
+    # writes every row straight away. Failing to store history never fails
+    # the request: errors are logged and the batch is dropped.
+    BATCH_SIZE = 500
+    # the leading bytes hashed to recognise the same photo arriving again
+    # when that is all there is of it (a range-fetched MMS, or an upload
+    # whose rest was discarded); a whole photo is hashed in full.
+    CONTENT_HASH_BYTES = 4096
+    HASH_CHUNK_BYTES = 1024 * 1024
+    MIGRATION_CHECK = "gps.ObservationWriter.migrations"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = []
+        self.timer = None
+        self.written = 0
+        atexit.register(self.flush)
+
+    ##
+    # hex digest of the photo `data` (bytes or a file), in full unless it is
+    # not `complete` or is a `truncated` upload. thumbnails and archived
+    # photos are named by it too (Thumbnailer), so two photos must not share
+    # one just because their headers match.
+    @staticmethod
+    def content_hash(data, complete: bool = True) -> str:
+        whole = complete and not getattr(data, "truncated", False)
+        digest = hashlib.blake2b(digest_size=16)
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            digest.update(
+                data if whole else data[: ObservationWriter.CONTENT_HASH_BYTES]
+            )
+        else:
+            data.seek(0)
+            if whole:
+                while chunk := data.read(ObservationWriter.HASH_CHUNK_BYTES):
+                    digest.update(chunk)
+            else:
+                digest.update(data.read(ObservationWriter.CONTENT_HASH_BYTES))
+            data.seek(0)
+        return digest.hexdigest()
+
+    ##
+    # queue an observation of `image_gps` (an ImageGps, or None) from
+    # `source` (GpsObservation.Source). `data` is the photo, bytes or an
+    # uploaded file, and `complete` is False when it is only the start of
+    # one. results without coordinates are not observations.
+    def add(self, image_gps, source: str, data, complete: bool = True):
+        if not settings.GPS_STORE_OBSERVATIONS:
+            return
+        if image_gps is None or image_gps.lat is None or image_gps.lon is None:
+            return
+        observation = GpsObservation.from_image_gps(
+            image_gps, source, self.content_hash(data, complete)
+        )
+        interval = settings.GPS_OBSERVATION_FLUSH_SECONDS
+        with self.lock:
+            self.pending.append(observation)
+            full = len(self.pending) >= self.BATCH_SIZE or not interval
+            if not full and self.timer is None:
+                self.timer = threading.Timer(interval, self.flush_from_timer)
+                self.timer.daemon = True
+                self.timer.start()
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        with self.lock:
+            batch, self.pending = self.pending, []
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        if not batch:
+            return 0
+        with tracer.start_as_current_span("ObservationWriter.flush") as span:
+            span.set_attribute("observations", len(batch))
+            try:
+                GpsObservation.objects.bulk_create(batch, batch_size=self.BATCH_SIZE)
+            except Exception as e:
+                logger.error(
+                    f"{__name__}: dropped {len(batch)} observations: {type(e)}: {e}"
+                )
+                return 0
+        spatial_index.mark_stale()
+        observation_tiles.invalidate([o.lat for o in batch], [o.lon for o in batch])
+        with self.lock:
+            self.written += len(batch)
+        logger.debug(f"{__name__}: stored {len(batch)} observations")
+        return len(batch)
+
+    def flush_from_timer(self):
+        try:
+            self.flush()
+        finally:
+            # the timer thread's own connection
+            connection.close()
+
+    ##
+    # the migrations not yet applied to the database ("app.name"), logged as
+    # an error: until `python manage.py migrate` has run (the Procfile's
+    # release step, see README.md) every flush fails and drops its batch.
+    def check_migrations(self) -> list:
+        from django.db.migrations.executor import MigrationExecutor
+
+        try:
+            executor = MigrationExecutor(connection)
+            plan = executor.migration_plan(executor.loader.graph.leaf_nodes())
+        except Exception as e:
+            logger.error(f"{__name__}: can't check migrations: {type(e)}: {e}")
+            return []
+        unapplied = [f"{migration.app_label}.{migration.name}" for migration, _ in plan]
+        if unapplied:
+            logger.error(
+                f"{__name__}: {len(unapplied)} migrations not applied "
+                f"({', '.join(unapplied)}): observations can't be stored until "
+                f"`python manage.py migrate` runs"
+            )
+        return unapplied
+
+    ##
+    # start_migration_check when this process gets its first request
+    # (GpsConfig.ready, when observations are stored): a server's workers
+    # say so straight away if the database hasn't been migrated, while
+    # management commands, migrate included, and plain imports of the
+    # application never open it for this.
+    def check_migrations_on_first_request(self):
+        request_started.connect(self.first_request, dispatch_uid=self.MIGRATION_CHECK)
+
+    def first_request(self, **kwargs):
+        if request_started.disconnect(dispatch_uid=self.MIGRATION_CHECK):
+            self.start_migration_check()
+
+    ##
+    # check_migrations on a thread of its own, so the request doesn't wait
+    # for it
+    def start_migration_check(self):
+        thread = threading.Thread(
+            target=self.check_migrations_from_thread, name="migrations", daemon=True
+        )
+        thread.start()
+        return thread
+
+    def check_migrations_from_thread(self):
+        try:
+            self.check_migrations()
+        finally:
+            connection.close()
+
+
+observation_writer = ObservationWriter()
@@ -0,0 +1,71 @@
+import hashlib
+import threading
+import time
+
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+class PageCache:
+    ##
+    # The pages that are the same for everyone (the two indexes, the GET side
+    # of the MMS and email webhooks) rendered once per process and served
+    # from memory after that, with an ETag and Last-Modified, so a browser
+    # revalidating gets a 304 and no body.
+    #
+    # Their content only changes with a deploy, which restarts the process,
+    # so nothing is ever invalidated. Last-Modified is when this process
+    # first rendered the page: never earlier than the real change, so a 304
+    # is never wrong, though a client moving between workers may get a 200
+    # it didn't need. Clients revalidate each time (no-cache), the same as
+    # map tiles.
+    #
+    # Pages with a form (CSRF token) or per-request content must not use this.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pages = {}
+        self.rendered = 0
+
+    ##
+    # {body, etag, last_modified} of `template_name`, rendered the first time.
+    # `context` must be the same on every call: it comes from settings.
+    def get(self, template_name: str, context: dict = None) -> dict:
+        page = self.pages.get(template_name)
+        if page is not None:
+            return page
+        body = render_to_string(template_name, context).encode()
+        digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+        page = {
+            "body": body,
+            "etag": f'"{digest}"',
+            "last_modified": int(time.time()),
+        }
+        with self.lock:
+            # another thread may have rendered it meanwhile; keep one of them
+            page = self.pages.setdefault(template_name, page)
+            self.rendered += 1
+        return page
+
+    ##
+    # the response to a GET/HEAD of `template_name`: 304 when the client's
+    # copy is current, the cached page otherwise
+    def response(self, request, template_name: str, context=None) -> HttpResponse:
+        page = self.get(template_name, context)
+        response = get_conditional_response(
+            request, etag=page["etag"], last_modified=page["last_modified"]
+        )
+        if response is None:
+            response = HttpResponse(page["body"])
+        response["ETag"] = page["etag"]
+        response["Last-Modified"] = http_date(page["last_modified"])
+        response["Cache-Control"] = "no-cache"
+        return response
+
+    def clear(self):
+        with self.lock:
+            self.pages.clear()
+
+
+page_cache = PageCache()
@@ -0,0 +1,166 @@
+import logging
+import queue
+import smtplib
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.core.mail import get_connection
+
+from shed.settings import EMAIL_REPLY_CONNECTIONS
+from .Tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class MailConnection:
+    ##
+    # One long-lived connection of the configured EMAIL_BACKEND (SMTP to
+    # SendGrid, SendGridBackend, locmem in tests). It is opened on first use
+    # and kept open, so STARTTLS and AUTH happen once rather than per reply.
+    # A connection that has sat idle for HEALTH_CHECK_AFTER seconds gets an
+    # SMTP NOOP before it is used again, since servers drop idle clients;
+    # a dead one is replaced.
+    HEALTH_CHECK_AFTER = 30
+
+    def __init__(self):
+        self.backend = None
+        self.backend_path = None
+        self.last_used = 0.0
+        self.connects = 0
+
+    def get(self):
+        if self.backend is not None and self.backend_path != settings.EMAIL_BACKEND:
+            self.close()
+        if self.backend is not None and not self.fresh() and not self.healthy():
+            logger.info(f"{__name__}: idle mail connection went away, reconnecting")
+            self.close()
+        if self.backend is None:
+            self.backend_path = settings.EMAIL_BACKEND
+            self.backend = get_connection(fail_silently=False)
+            self.backend.open()
+            self.connects += 1
+        return self.backend
+
+    def fresh(self) -> bool:
+        return time.monotonic() - self.last_used < self.HEALTH_CHECK_AFTER
+
+    def healthy(self) -> bool:
+        smtp = getattr(self.backend, "connection", None)
+        if smtp is None or not hasattr(smtp, "noop"):
+            return True
+        try:
+            return smtp.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    ##
+    # send one message, reconnecting once if the connection turns out to be
+    # dead. returns the number of messages sent, like send_messages.
+    def send(self, message) -> int:
+        try:
+            sent = self.get().send_messages([message])
+        except (smtplib.SMTPServerDisconnected, OSError) as e:
+            logger.info(f"{__name__}: mail connection lost ({e}), reconnecting")
+            self.close()
+            sent = self.get().send_messages([message])
+        self.last_used = time.monotonic()
+        return sent
+
+    def close(self):
+        if self.backend is None:
+            return
+        try:
+            self.backend.close()
+        except Exception as e:
+            logger.debug(f"{__name__}: closing mail connection: {e}")
+        self.backend = None
+
+
+class ReplyMailer:
+    ##
+    # Sends EmailReply messages from a few sender threads, each holding one
+    # MailConnection. Webhooks hand their reply over and wait for it to be
+    # sent (so failures still surface in the request); a sender thread takes
+    # every reply that is waiting at that moment, up to BATCH_MAX, and sends
+    # them one after another over its connection. Replies that arrive close
+    # together therefore share a connection, and none of them pays for a
+    # connection of its own.
+    BATCH_MAX = 50
+    SEND_TIMEOUT = 30
+
+    def __init__(self, connections: int = 1):
+        self.connections = connections
+        self.queue = queue.Queue()
+        self.threads = []
+        self.lock = threading.Lock()
+        self.senders = []
+
+    ##
+    # send `message` (an EmailMessage), raising whatever sending it raised.
+    # a reply still queued after `timeout` is withdrawn before TimeoutError
+    # is raised: the webhook fails, and its retry must be the only reply.
+    # one already being sent is waited for instead (it is bounded by
+    # EMAIL_TIMEOUT), so that it isn't reported as failed.
+    def send(self, message, timeout: float = SEND_TIMEOUT):
+        future = Future()
+        self.start()
+        self.queue.put((message, future))
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            if future.cancel():
+                logger.warning(f"{__name__}: reply not sent within {timeout}s")
+                raise
+        return future.result()
+
+    def start(self):
+        with self.lock:
+            self.threads = [t for t in self.threads if t.is_alive()]
+            while len(self.threads) < self.connections:
+                thread = threading.Thread(
+                    target=self.run,
+                    name=f"reply-mailer-{len(self.threads)}",
+                    daemon=True,
+                )
+                thread.start()
+                self.threads.append(thread)
+
+    def run(self):
+        connection = MailConnection()
+        with self.lock:
+            self.senders.append(connection)
+        while True:
+            self.send_batch(connection, self.next_batch())
+
+    def next_batch(self):
+        batch = [self.queue.get()]
+        while len(batch) < self.BATCH_MAX:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def send_batch(self, connection: MailConnection, batch):
+        with tracer.start_as_current_span("ReplyMailer.send_batch") as span:
+            span.set_attribute("email.batch_size", len(batch))
+            for message, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(connection.send(message))
+                except Exception as e:
+                    logger.error(f"{__name__}: sending reply failed: {type(e)}: {e}")
+                    future.set_exception(e)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "connections": len(self.senders),
+                "connects": sum(sender.connects for sender in self.senders),
+            }
+
+
+reply_mailer = ReplyMailer(EMAIL_REPLY_CONNECTIONS)
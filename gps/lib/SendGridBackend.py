@@ -0,0 +1,82 @@
+import logging
+from email.utils import parseaddr
+
+import requests
+from django.conf import settings
+from django.core.mail.backends.base import BaseEmailBackend
+
+logger = logging.getLogger(__name__)
+
+
+class SendGridBackend(BaseEmailBackend):
+    ##
+    # Django email backend for SendGrid's v3 Web API, an alternative to SMTP:
+    #   EMAIL_BACKEND = "gps.lib.SendGridBackend.SendGridBackend"
+    # Messages go out as HTTPS POSTs on one keep-alive requests.Session per
+    # open backend, authenticated with SENDGRID_API_KEY.
+    API_URL = "https://api.sendgrid.com/v3/mail/send"
+    TIMEOUT = (3.05, 10)
+
+    def __init__(self, api_key: str = None, fail_silently: bool = False, **kwargs):
+        super().__init__(fail_silently=fail_silently)
+        self.api_key = api_key or settings.SENDGRID_API_KEY
+        self.session = None
+
+    def open(self) -> bool:
+        if self.session is not None:
+            return False
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {self.api_key}"
+        return True
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+    def send_messages(self, email_messages) -> int:
+        if not email_messages:
+            return 0
+        new_session = self.open()
+        sent = 0
+        try:
+            for message in email_messages:
+                try:
+                    r = self.session.post(
+                        self.API_URL, json=self.payload(message), timeout=self.TIMEOUT
+                    )
+                    r.raise_for_status()
+                    sent += 1
+                except requests.RequestException as e:
+                    logger.warning(f"{__name__}: SendGrid API: {type(e)}: {e}")
+                    if not self.fail_silently:
+                        raise
+        finally:
+            if new_session:
+                self.close()
+        return sent
+
+    @staticmethod
+    def address(value: str) -> dict:
+        name, email = parseaddr(value)
+        return {"email": email, "name": name} if name else {"email": email}
+
+    @staticmethod
+    def payload(message) -> dict:
+        personalization = {}
+        for field in ("to", "cc", "bcc"):
+            addresses = getattr(message, field)
+            if addresses:
+                personalization[field] = [SendGridBackend.address(a) for a in addresses]
+        content = [{"type": "text/plain", "value": message.body}]
+        for alternative, mimetype in getattr(message, "alternatives", []):
+            content.append({"type": mimetype, "value": alternative})
+        payload = {
+            "personalizations": [personalization],
+            "from": SendGridBackend.address(message.from_email),
+            "subject": message.subject,
+            "content": content,
+        }
+        if message.reply_to:
+            payload["reply_to"] = SendGridBackend.address(message.reply_to[0])
+        return payload
@@ -0,0 +1,222 @@
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+
+from ..models import GpsObservation
+from .KdTree import KdTree
+from .Tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class SpatialIndex:
+    ##
+    # In-memory index of every GpsObservation's location, for "what is within
+    # 200 m of here" and "everything in this viewport" without scanning the
+    # table. Each worker loads it from the database on first use. Points are
+    # kept in Web Mercator meters in a KdTree: lat/lon boxes map to Mercator
+    # boxes, and a radius query searches the box that contains the circle and
+    # then checks haversine distances.
+    #
+    # Rows stored since the last load (by this worker's ObservationWriter or
+    # any other worker) are picked up by id at most REFRESH_SECONDS apart, or
+    # on the next query after this worker's own flush (see mark_stale). They
+    # are scanned linearly until MERGE_AT of them have piled up, then merged
+    # into a rebuilt tree. This relies on ids being committed in order, as
+    # they are with SQLite. Observations are never deleted, so neither is
+    # anything in the index.
+    EARTH_RADIUS_M = 6371008.8
+    MERCATOR_RADIUS_M = 6378137.0
+    MAX_LAT = 85.05112878
+    REFRESH_SECONDS = 2.0
+    MERGE_AT = 4096
+    LOAD_CHUNK = 10000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.stale = False
+        self.refreshed_at = 0.0
+        self.last_id = 0
+        self.tree = None
+        self.ids = np.empty(0, dtype=np.int64)
+        self.lats = np.empty(0)
+        self.lons = np.empty(0)
+        self.recent_ids = np.empty(0, dtype=np.int64)
+        self.recent_lats = np.empty(0)
+        self.recent_lons = np.empty(0)
+
+    @staticmethod
+    def project(lats, lons):
+        lats = np.clip(
+            np.asarray(lats, dtype=np.float64),
+            -SpatialIndex.MAX_LAT,
+            SpatialIndex.MAX_LAT,
+        )
+        r = SpatialIndex.MERCATOR_RADIUS_M
+        xs = r * np.radians(np.asarray(lons, dtype=np.float64))
+        ys = r * np.log(np.tan(np.pi / 4 + np.radians(lats) / 2))
+        return xs, ys
+
+    @staticmethod
+    def distances(lat, lon, lats, lons):
+        lat1, lon1 = math.radians(lat), math.radians(lon)
+        lat2, lon2 = np.radians(lats), np.radians(lons)
+        a = (
+            np.sin((lat2 - lat1) / 2) ** 2
+            + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        )
+        return 2 * SpatialIndex.EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    def __len__(self):
+        return len(self.ids) + len(self.recent_ids)
+
+    ##
+    # say that rows were just stored here, so the next query reads them
+    def mark_stale(self):
+        self.stale = True
+
+    ##
+    # load the index if this worker hasn't yet, and pick up new rows if it's
+    # time to. queries call this themselves.
+    def refresh(self):
+        if self.loaded and not self.stale:
+            if time.monotonic() - self.refreshed_at < self.REFRESH_SECONDS:
+                return
+        with self.lock:
+            self.stale = False
+            self.refreshed_at = time.monotonic()
+            if not self.loaded:
+                self.load()
+            else:
+                self.catch_up()
+
+    def read_rows(self, after_id: int):
+        rows = (
+            GpsObservation.objects.filter(id__gt=after_id)
+            .order_by("id")
+            .values_list("id", "lat", "lon")
+        )
+        chunks = []
+        chunk = []
+        for row in rows.iterator(chunk_size=self.LOAD_CHUNK):
+            chunk.append(row)
+            if len(chunk) >= self.LOAD_CHUNK:
+                chunks.append(np.array(chunk))
+                chunk = []
+        if chunk:
+            chunks.append(np.array(chunk))
+        if not chunks:
+            return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+        rows = np.concatenate(chunks)
+        return rows[:, 0].astype(np.int64), rows[:, 1], rows[:, 2]
+
+    def load(self):
+        with tracer.start_as_current_span("SpatialIndex.load") as span:
+            ids, lats, lons = self.read_rows(0)
+            self.build(ids, lats, lons)
+            self.loaded = True
+            span.set_attribute("spatial_index.points", len(ids))
+        logger.info(f"{__name__}: loaded {len(ids)} observations")
+
+    def catch_up(self):
+        ids, lats, lons = self.read_rows(self.last_id)
+        if not len(ids):
+            return
+        recent_ids = np.concatenate([self.recent_ids, ids])
+        recent_lats = np.concatenate([self.recent_lats, lats])
+        recent_lons = np.concatenate([self.recent_lons, lons])
+        self.last_id = int(ids[-1])
+        if len(recent_ids) >= self.MERGE_AT:
+            self.build(
+                np.concatenate([self.ids, recent_ids]),
+                np.concatenate([self.lats, recent_lats]),
+                np.concatenate([self.lons, recent_lons]),
+            )
+            return
+        self.recent_ids, self.recent_lats, self.recent_lons = (
+            recent_ids,
+            recent_lats,
+            recent_lons,
+        )
+
+    def build(self, ids, lats, lons):
+        tree = KdTree(*self.project(lats, lons))
+        # swapped in together; queries take a snapshot of these attributes
+        self.tree, self.ids, self.lats, self.lons = tree, ids, lats, lons
+        self.recent_ids = np.empty(0, dtype=np.int64)
+        self.recent_lats = np.empty(0)
+        self.recent_lons = np.empty(0)
+        if len(ids):
+            self.last_id = max(self.last_id, int(ids.max()))
+
+    ##
+    # (ids, lats, lons) of the points in a lat/lon box, west <= east
+    def candidates(self, south, west, north, east):
+        self.refresh()
+        with self.lock:
+            tree, ids, lats, lons = self.tree, self.ids, self.lats, self.lons
+            recent = self.recent_ids, self.recent_lats, self.recent_lons
+        (min_x, max_x), (min_y, max_y) = self.project([south, north], [west, east])
+        found = tree.range(min_x, min_y, max_x, max_y)
+        recent_ids, recent_lats, recent_lons = recent
+        inside = (
+            (recent_lats >= south)
+            & (recent_lats <= north)
+            & (recent_lons >= west)
+            & (recent_lons <= east)
+        )
+        return (
+            np.concatenate([ids[found], recent_ids[inside]]),
+            np.concatenate([lats[found], recent_lats[inside]]),
+            np.concatenate([lons[found], recent_lons[inside]]),
+        )
+
+    ##
+    # ids of the observations in a bounding box (degrees), newest (highest
+    # id) first, at most `limit` of them. west > east crosses the antimeridian.
+    def bbox(self, south, west, north, east, limit: int = None) -> np.ndarray:
+        if west > east:
+            boxes = [(west, 180.0), (-180.0, east)]
+        else:
+            boxes = [(west, east)]
+        ids = np.concatenate([self.candidates(south, w, north, e)[0] for w, e in boxes])
+        return np.sort(ids)[::-1][:limit]
+
+    ##
+    # (ids, distances in meters) of the observations within `radius_m` of
+    # lat/lon, nearest first, at most `limit` of them.
+    def nearby(self, lat, lon, radius_m, limit: int = None):
+        dlat = math.degrees(radius_m / self.EARTH_RADIUS_M)
+        south, north = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+        widest = min(max(abs(south), abs(north)), self.MAX_LAT)
+        dlon = math.degrees(
+            radius_m / (self.EARTH_RADIUS_M * math.cos(math.radians(widest)))
+        )
+        if dlon >= 180.0:
+            boxes = [(-180.0, 180.0)]
+        else:
+            west, east = lon - dlon, lon + dlon
+            boxes = [(max(west, -180.0), min(east, 180.0))]
+            if west < -180.0:
+                boxes.append((west + 360.0, 180.0))
+            if east > 180.0:
+                boxes.append((-180.0, east - 360.0))
+        found = [self.candidates(south, w, north, e) for w, e in boxes]
+        ids = np.concatenate([f[0] for f in found])
+        distances = self.distances(
+            lat,
+            lon,
+            np.concatenate([f[1] for f in found]),
+            np.concatenate([f[2] for f in found]),
+        )
+        within = distances <= radius_m
+        ids, distances = ids[within], distances[within]
+        order = np.argsort(distances, kind="stable")[:limit]
+        return ids[order], distances[order]
+
+
+spatial_index = SpatialIndex()
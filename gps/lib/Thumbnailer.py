@@ -0,0 +1,204 @@
+import logging
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+
+from .ByteSource import NeedMoreData
+from .JpegExif import JpegExif
+from .MetadataStripper import MetadataStripper
+from .ObservationWriter import ObservationWriter
+from .Tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class Thumbnailer:
+    ##
+    # Preview thumbnails of the photos whose coordinates are kept, for the
+    # upload results page and the observation admin. They are made off the
+    # request path, on a small thread pool (Pillow releases the GIL while it
+    # decodes and resizes), and written as JPEGs under
+    # MEDIA_ROOT/thumbnails/, named by the same content hash as the
+    # GpsObservation rows (ObservationWriter.content_hash), so a photo that
+    # arrives again is not thumbnailed again.
+    #
+    # A JPEG is decoded once, in draft mode: libjpeg scales it down by 1/2,
+    # 1/4 or 1/8 while decoding, to the smallest scale still at least
+    # DRAFT_GAP times the largest of SIZES. A 12 MP photo is decoded at
+    # 1008x756 instead of 4032x3024, and every size is resized from that
+    # one decode. Other formats Pillow can open are decoded in full.
+    #
+    # With GPS_ARCHIVE_PHOTOS the photo itself is kept too, under
+    # MEDIA_ROOT/photos/, with its location and other personal metadata
+    # removed by MetadataStripper (JPEG and HEIF only, not re-encoded).
+    SIZES = (160, 640)
+    DRAFT_GAP = 1.5
+    QUALITY = 80
+    # photos waiting for a worker, each held in memory; more are dropped
+    MAX_PENDING = 16
+    DIRECTORY = "thumbnails"
+    ARCHIVE_DIRECTORY = "photos"
+
+    def __init__(self, max_workers: int = 2):
+        self.max_workers = max_workers
+        self.pool = None
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.made = 0
+
+    def configure(self, max_workers: int):
+        self.max_workers = max_workers
+
+    def path(self, content_hash: str, size: int, root: str = None) -> str:
+        return os.path.join(
+            root or settings.MEDIA_ROOT,
+            self.DIRECTORY,
+            content_hash[:2],
+            f"{content_hash}_{size}.jpg",
+        )
+
+    def archive_path(self, content_hash: str, extension: str, root: str = None):
+        return os.path.join(
+            root or settings.MEDIA_ROOT,
+            self.ARCHIVE_DIRECTORY,
+            content_hash[:2],
+            f"{content_hash}.{extension}",
+        )
+
+    def exists(self, content_hash: str) -> bool:
+        return all(os.path.exists(self.path(content_hash, s)) for s in self.SIZES)
+
+    ##
+    # queue thumbnails of the photo `data` (bytes or an uploaded file) if
+    # `image_gps` has coordinates and the whole photo is there. returns the
+    # content hash they will be under, or None.
+    def submit(self, image_gps, data, complete: bool = True):
+        if not settings.GPS_THUMBNAILS:
+            return None
+        if image_gps is None or image_gps.lat is None or image_gps.lon is None:
+            return None
+        if not complete or getattr(data, "truncated", False):
+            return None
+        content_hash = ObservationWriter.content_hash(data)
+        if self.exists(content_hash):
+            return content_hash
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            # uploaded files are closed (and deleted) when the request ends
+            data.seek(0)
+            data = data.read()
+        with self.lock:
+            if content_hash in self.pending:
+                return content_hash
+            if len(self.pending) >= self.MAX_PENDING:
+                logger.warning(
+                    f"{__name__}: queue full, no thumbnails for {content_hash}"
+                )
+                return None
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="thumbnails"
+                )
+            future = self.pool.submit(
+                self.make,
+                bytes(data),
+                content_hash,
+                settings.MEDIA_ROOT,
+                settings.GPS_ARCHIVE_PHOTOS,
+            )
+            self.pending[content_hash] = future
+        future.add_done_callback(lambda f: self.done(content_hash))
+        return content_hash
+
+    def done(self, content_hash: str):
+        with self.lock:
+            self.pending.pop(content_hash, None)
+
+    ##
+    # wait up to `timeout` seconds for thumbnails still being made; True if
+    # they exist now.
+    def wait(self, content_hash: str, timeout: float) -> bool:
+        with self.lock:
+            future = self.pending.get(content_hash)
+        if future is not None:
+            try:
+                future.result(timeout=timeout)
+            except Exception:
+                pass
+        return self.exists(content_hash)
+
+    def make(
+        self, data: bytes, content_hash: str, root: str = None, archive: bool = False
+    ) -> bool:
+        # Pillow is loaded by the first photo, not at startup (apps, admin)
+        from PIL import Image, UnidentifiedImageError
+
+        with tracer.start_as_current_span("Thumbnailer.make") as span:
+            span.set_attribute("thumbnail.bytes", len(data))
+            if archive:
+                self.archive(data, content_hash, root)
+            try:
+                images = self.render(data)
+            except (OSError, UnidentifiedImageError, Image.DecompressionBombError) as e:
+                logger.info(f"{__name__}: {content_hash}: {type(e)}: {e}")
+                return False
+            for size, image in images.items():
+                path = self.path(content_hash, size, root)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # written aside and renamed, so a half-written file is never served
+                tmp = f"{path}.{threading.get_ident()}.tmp"
+                image.save(tmp, "JPEG", quality=self.QUALITY, optimize=True)
+                os.replace(tmp, path)
+        with self.lock:
+            self.made += 1
+        return True
+
+    ##
+    # keep the photo, stripped of its metadata. not a JPEG or HEIF, or a
+    # broken one, is logged and not kept.
+    def archive(self, data: bytes, content_hash: str, root: str = None):
+        try:
+            stripped = MetadataStripper.strip(data)
+        except (ValueError, NeedMoreData) as e:
+            logger.info(f"{__name__}: not archiving {content_hash}: {type(e)}: {e}")
+            return None
+        extension = "jpg" if data[:2] == JpegExif.SOI else "heic"
+        path = self.archive_path(content_hash, extension, root)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as out:
+            out.write(stripped)
+        os.replace(tmp, path)
+        return path
+
+    ##
+    # {size: image} of the photo `data`, the largest side of each at most size
+    @classmethod
+    def render(cls, data: bytes) -> dict:
+        from PIL import Image, ImageOps
+
+        largest = max(cls.SIZES)
+        with Image.open(BytesIO(data)) as image:
+            # draft() wants a size both sides must stay above, so the box
+            # has to have the photo's shape
+            scale = largest * cls.DRAFT_GAP / max(image.size)
+            if scale < 1:
+                image.draft(
+                    "RGB",
+                    (math.ceil(image.width * scale), math.ceil(image.height * scale)),
+                )
+            image = ImageOps.exif_transpose(image)
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+        images = {}
+        for size in sorted(cls.SIZES, reverse=True):
+            image = image.copy()
+            image.thumbnail((size, size), Image.Resampling.LANCZOS)
+            images[size] = image
+        return images
+
+
+thumbnailer = Thumbnailer()
@@ -0,0 +1,118 @@
+import logging
+import struct
+
+logger = logging.getLogger(__name__)
+
+
+class TiffIfd:
+    ##
+    # Minimal TIFF/EXIF IFD reader. It understands just enough of the TIFF
+    # layout to follow IFD0 to the GPS IFD and decode its entries, and it
+    # decodes values the way Pillow's Exif.get_ifd() does, so callers get the
+    # same values they would have gotten from Pillow: single values unwrapped,
+    # rationals as floats (nan for a zero denominator), ASCII with the trailing
+    # NUL removed, BYTE/UNDEFINED as raw bytes.
+    GPS_IFD_POINTER = 0x8825
+    MAX_ENTRIES = 512
+
+    # tag type -> (struct code, size in bytes)
+    TYPES = {
+        1: ("B", 1),  # BYTE
+        2: ("s", 1),  # ASCII
+        3: ("H", 2),  # SHORT
+        4: ("L", 4),  # LONG
+        5: ("LL", 8),  # RATIONAL
+        6: ("b", 1),  # SBYTE
+        7: ("s", 1),  # UNDEFINED
+        8: ("h", 2),  # SSHORT
+        9: ("l", 4),  # SLONG
+        10: ("ll", 8),  # SRATIONAL
+        11: ("f", 4),  # FLOAT
+        12: ("d", 8),  # DOUBLE
+    }
+
+    ##
+    # `tiff` is a bytes-like object starting at the TIFF header ("II*\0" or
+    # "MM\0*"). returns the GPS IFD as {tag: value}, {} when the image has EXIF
+    # but no GPS IFD, and raises ValueError when the TIFF structure is broken.
+    @staticmethod
+    def read_gps_ifd(tiff) -> dict:
+        tiff = memoryview(tiff).cast("B")
+        endian = TiffIfd.byte_order(tiff)
+        ifd0_offset = TiffIfd.unpack(tiff, endian + "L", 4)[0]
+        ifd0 = TiffIfd.read_ifd(tiff, endian, ifd0_offset, TiffIfd.GPS_IFD_POINTER)
+        gps_offset = ifd0.get(TiffIfd.GPS_IFD_POINTER)
+        if gps_offset is None:
+            return {}
+        if isinstance(gps_offset, tuple):
+            gps_offset = gps_offset[0]
+        return TiffIfd.read_ifd(tiff, endian, gps_offset)
+
+    @staticmethod
+    def byte_order(tiff) -> str:
+        header = bytes(tiff[0:4])
+        if header == b"II*\x00":
+            return "<"
+        if header == b"MM\x00*":
+            return ">"
+        raise ValueError(f"not a TIFF header: {header!r}")
+
+    @staticmethod
+    def unpack(tiff, fmt: str, offset: int):
+        size = struct.calcsize(fmt)
+        if offset < 0 or offset + size > len(tiff):
+            raise ValueError(f"TIFF offset {offset}+{size} out of range")
+        return struct.unpack_from(fmt, tiff, offset)
+
+    ##
+    # read one IFD. when `only_tag` is given, every other entry is skipped
+    # without decoding its value.
+    @staticmethod
+    def read_ifd(tiff, endian: str, offset: int, only_tag: int = None) -> dict:
+        (count,) = TiffIfd.unpack(tiff, endian + "H", offset)
+        if count > TiffIfd.MAX_ENTRIES:
+            raise ValueError(f"implausible IFD entry count: {count}")
+        entries = {}
+        for i in range(count):
+            entry_offset = offset + 2 + i * 12
+            tag, tag_type, n = TiffIfd.unpack(tiff, endian + "HHL", entry_offset)
+            if only_tag is not None and tag != only_tag:
+                continue
+            if tag_type not in TiffIfd.TYPES:
+                logger.debug(f"{__name__}: skipping tag {tag} of type {tag_type}")
+                continue
+            code, size = TiffIfd.TYPES[tag_type]
+            length = size * n
+            value_offset = entry_offset + 8
+            if length > 4:
+                (value_offset,) = TiffIfd.unpack(tiff, endian + "L", value_offset)
+            if value_offset + length > len(tiff):
+                raise ValueError(f"TIFF tag {tag} value out of range")
+            raw = tiff[value_offset : value_offset + length]
+            entries[tag] = TiffIfd.decode(endian, tag_type, code, n, raw)
+        return entries
+
+    @staticmethod
+    def decode(endian: str, tag_type: int, code: str, n: int, raw):
+        if tag_type in (1, 7):
+            return bytes(raw)
+        if tag_type == 2:
+            data = bytes(raw)
+            if data.endswith(b"\x00"):
+                data = data[:-1]
+            return data.decode("latin-1", "replace")
+        values = struct.unpack(endian + code * n, raw)
+        if tag_type in (5, 10):
+            values = tuple(
+                TiffIfd.rational(values[i], values[i + 1])
+                for i in range(0, len(values), 2)
+            )
+        if len(values) == 1:
+            return values[0]
+        return values
+
+    @staticmethod
+    def rational(numerator: int, denominator: int) -> float:
+        if denominator == 0:
+            return float("nan")
+        return numerator / denominator
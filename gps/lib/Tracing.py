@@ -0,0 +1,94 @@
+import logging
+
+from django.utils.module_loading import import_string
+from opentelemetry import trace
+
+logger = logging.getLogger(__name__)
+
+##
+# Instrumented code only ever uses this tracer (opentelemetry-api). Until
+# Tracing.configure() installs an SDK TracerProvider its spans are no-ops.
+tracer = trace.get_tracer("gps")
+
+
+class Tracing:
+    ##
+    # Span export is pluggable via the OTEL_TRACES_EXPORTER setting:
+    #   "none"    - no export (default)
+    #   "console" - print finished spans to stdout
+    #   "memory"  - keep finished spans in memory (tests)
+    #   "otlp"    - OTLP/HTTP, needs opentelemetry-exporter-otlp-proto-http
+    #   any dotted path to a SpanExporter class, e.g. a Cloud Trace exporter
+    SERVICE_NAME = "shed"
+
+    @staticmethod
+    def configure(exporter: str = None):
+        if not exporter or exporter == "none":
+            return None
+        try:
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import (
+                BatchSpanProcessor,
+                SimpleSpanProcessor,
+            )
+        except ImportError as e:
+            logger.warning(f"{__name__}: opentelemetry-sdk not installed: {e}")
+            return None
+
+        span_exporter = Tracing.make_exporter(exporter)
+        provider = trace.get_tracer_provider()
+        if not isinstance(provider, TracerProvider):
+            provider = TracerProvider(
+                resource=Resource.create({"service.name": Tracing.SERVICE_NAME})
+            )
+            trace.set_tracer_provider(provider)
+        if exporter == "memory":
+            # export synchronously so tests see spans as soon as they end.
+            provider.add_span_processor(SimpleSpanProcessor(span_exporter))
+        else:
+            provider.add_span_processor(BatchSpanProcessor(span_exporter))
+        logger.info(f"{__name__}: exporting spans with {type(span_exporter)}")
+        return span_exporter
+
+    @staticmethod
+    def make_exporter(exporter: str):
+        if exporter == "console":
+            from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+
+            return ConsoleSpanExporter()
+        if exporter == "memory":
+            from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+                InMemorySpanExporter,
+            )
+
+            return InMemorySpanExporter()
+        if exporter == "otlp":
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+                OTLPSpanExporter,
+            )
+
+            return OTLPSpanExporter()
+        return import_string(exporter)()
+
+    ##
+    # set span attributes, skipping None values (which OpenTelemetry rejects)
+    @staticmethod
+    def set_attributes(span, attributes: dict):
+        for key, value in attributes.items():
+            if value is not None:
+                span.set_attribute(key, value)
+
+    ##
+    # size in bytes of an upload/body, whatever it is wrapped in, or None.
+    @staticmethod
+    def size_of(data):
+        size = getattr(data, "size", None)
+        if size is None:
+            try:
+                size = len(data)
+            except TypeError:
+                size = None
+        if size is None and hasattr(data, "getbuffer"):
+            size = data.getbuffer().nbytes
+        return size
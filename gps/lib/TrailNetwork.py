@@ -0,0 +1,234 @@
+import json
+import logging
+import math
+import time
+import xml.etree.ElementTree as ElementTree
+
+import numpy as np
+
+from .KdTree import KdTree
+
+logger = logging.getLogger(__name__)
+
+
+class TrailMatch:
+    ##
+    # where a point snapped to: the trail's name, how far the point is from
+    # it and how far along the trail (chainage) the nearest spot is, meters.
+    __slots__ = ("trail", "distance_m", "chainage_m", "length_m")
+
+    def __init__(self, trail: str, distance_m: float, chainage_m: float, length_m):
+        self.trail = trail
+        self.distance_m = distance_m
+        self.chainage_m = chainage_m
+        self.length_m = length_m
+
+    def __repr__(self):
+        fields = ", ".join(f"{n}={getattr(self, n)!r}" for n in self.__slots__)
+        return f"TrailMatch({fields})"
+
+    def describe(self) -> str:
+        return (
+            f"{self.trail}, {self.chainage_m / 1000:.2f} km along, "
+            f"{self.distance_m:.0f} m off the trail"
+        )
+
+
+class TrailNetwork:
+    ##
+    # The TrailPgh trail network, for snapping photo locations to "which
+    # trail, how far along it". Trails are read from a GeoJSON file
+    # (LineString/MultiLineString features, named by properties.name) or a
+    # GPX file (tracks and routes) once, when the app starts (GPS_TRAILS_FILE).
+    # The parts of a trail (a MultiLineString's lines, a track's segments)
+    # are measured as one, in order: chainage runs on from the end of one
+    # part to the start of the next, without counting any gap between them,
+    # and the trail's length is theirs together.
+    #
+    # Vertices are projected to local planar meters (equirectangular about
+    # the network's mean latitude, accurate to well under a meter over a
+    # city). Segments are split into pieces of at most MAX_PIECE_M, whose
+    # midpoints go in a KdTree; a snap looks at the pieces whose midpoint is
+    # within the snap distance plus half a piece and takes the nearest one.
+    EARTH_RADIUS_M = 6371008.8
+    MAX_PIECE_M = 50.0
+
+    def __init__(self, max_distance_m: float = 100.0):
+        self.max_distance_m = max_distance_m
+        self.names = []
+        self.lengths = []
+        self.tree = None
+
+    def __len__(self):
+        return len(self.tree) if self.tree is not None else 0
+
+    ##
+    # load GPS_TRAILS_FILE, if set. a missing, unreadable or malformed file
+    # (a point without coordinates, say) is logged and leaves the network
+    # empty: replies just don't mention trails.
+    def configure(self, path: str, max_distance_m: float = None):
+        if max_distance_m is not None:
+            self.max_distance_m = max_distance_m
+        if not path:
+            return
+        start = time.perf_counter()
+        try:
+            self.build(self.read_trails(path))
+        except (
+            OSError,
+            ValueError,
+            KeyError,
+            IndexError,
+            TypeError,
+            ElementTree.ParseError,
+        ) as e:
+            logger.error(f"{__name__}: could not load trails from {path}: {e}")
+            return
+        logger.info(
+            f"{__name__}: {len(self.names)} trails, {len(self)} segments from {path} in {time.perf_counter() - start:.3f}s"
+        )
+
+    ##
+    # [(name, [[(lat, lon), ...], ...])] of the trails in a GeoJSON or GPX
+    # file, each with its parts
+    @staticmethod
+    def read_trails(path: str):
+        with open(path, "rb") as f:
+            data = f.read()
+        if data.lstrip()[:1] == b"<":
+            return TrailNetwork.gpx_trails(ElementTree.fromstring(data))
+        return TrailNetwork.geojson_trails(json.loads(data))
+
+    @staticmethod
+    def geojson_trails(document):
+        if document.get("type") == "FeatureCollection":
+            features = document["features"]
+        elif document.get("type") == "Feature":
+            features = [document]
+        else:
+            features = [{"geometry": document, "properties": {}}]
+        trails = []
+        for n, feature in enumerate(features, 1):
+            geometry = feature.get("geometry") or {}
+            name = (feature.get("properties") or {}).get("name") or f"trail {n}"
+            if geometry.get("type") == "LineString":
+                parts = [geometry["coordinates"]]
+            elif geometry.get("type") == "MultiLineString":
+                parts = geometry["coordinates"]
+            else:
+                continue
+            trails.append(
+                (name, [[(float(p[1]), float(p[0])) for p in part] for part in parts])
+            )
+        return trails
+
+    @staticmethod
+    def gpx_trails(root):
+        def local(element):
+            return element.tag.rsplit("}", 1)[-1]
+
+        def children(element, name):
+            return [child for child in element if local(child) == name]
+
+        def points(elements):
+            return [(float(p.get("lat")), float(p.get("lon"))) for p in elements]
+
+        trails = []
+        for n, element in enumerate(root, 1):
+            if local(element) not in ("trk", "rte"):
+                continue
+            names = children(element, "name")
+            name = names[0].text if names and names[0].text else f"trail {n}"
+            if local(element) == "rte":
+                trails.append((name, [points(children(element, "rtept"))]))
+            else:
+                segments = children(element, "trkseg")
+                trails.append((name, [points(children(s, "trkpt")) for s in segments]))
+        return trails
+
+    def project(self, lats, lons):
+        r = self.EARTH_RADIUS_M
+        xs = r * np.radians(np.asarray(lons, dtype=np.float64)) * self.cos0
+        ys = r * np.radians(np.asarray(lats, dtype=np.float64))
+        return xs, ys
+
+    def build(self, trails):
+        trails = [
+            (name, [coords for coords in parts if len(coords) >= 2])
+            for name, parts in trails
+        ]
+        trails = [(name, parts) for name, parts in trails if parts]
+        if not trails:
+            raise ValueError("no trails with two or more points")
+        all_lats = np.concatenate(
+            [[lat for lat, lon in c] for _, parts in trails for c in parts]
+        )
+        self.cos0 = math.cos(math.radians(float(all_lats.mean())))
+        names, lengths, columns = [], [], []
+        for trail, (name, parts) in enumerate(trails):
+            offset = 0.0
+            for coords in parts:
+                x, y = self.project(*zip(*coords))
+                seg_lengths = np.hypot(np.diff(x), np.diff(y))
+                starts = offset + np.concatenate([[0.0], np.cumsum(seg_lengths)[:-1]])
+                pieces = np.maximum(np.ceil(seg_lengths / self.MAX_PIECE_M), 1)
+                pieces = pieces.astype(int)
+                seg = np.repeat(np.arange(len(seg_lengths)), pieces)
+                k = np.arange(len(seg)) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+                f0 = k / pieces[seg]
+                f1 = (k + 1) / pieces[seg]
+                dx, dy = x[seg + 1] - x[seg], y[seg + 1] - y[seg]
+                columns.append(
+                    (
+                        x[seg] + f0 * dx,
+                        y[seg] + f0 * dy,
+                        x[seg] + f1 * dx,
+                        y[seg] + f1 * dy,
+                        starts[seg] + f0 * seg_lengths[seg],
+                        np.full(len(seg), trail),
+                    )
+                )
+                offset += float(seg_lengths.sum())
+            names.append(name)
+            lengths.append(offset)
+        ax, ay, bx, by, chainage, line = (np.concatenate(c) for c in zip(*columns))
+        self.ax, self.ay, self.bx, self.by = ax, ay, bx, by
+        self.chainage, self.line = chainage, line
+        self.reach = float(np.hypot(bx - ax, by - ay).max()) / 2
+        self.names, self.lengths = names, lengths
+        self.tree = KdTree((ax + bx) / 2, (ay + by) / 2)
+
+    ##
+    # the trail nearest lat/lon, if one is within max_distance_m (default:
+    # the network's), otherwise None.
+    def snap(self, lat: float, lon: float, max_distance_m: float = None):
+        if self.tree is None or lat is None or lon is None:
+            return None
+        if max_distance_m is None:
+            max_distance_m = self.max_distance_m
+        (px,), (py,) = self.project([lat], [lon])
+        r = max_distance_m + self.reach
+        found = self.tree.range(px - r, py - r, px + r, py + r)
+        if not len(found):
+            return None
+        ax, ay = self.ax[found], self.ay[found]
+        dx, dy = self.bx[found] - ax, self.by[found] - ay
+        length2 = dx * dx + dy * dy
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = np.where(length2 > 0, ((px - ax) * dx + (py - ay) * dy) / length2, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        distances = np.hypot(ax + t * dx - px, ay + t * dy - py)
+        best = int(np.argmin(distances))
+        if distances[best] > max_distance_m:
+            return None
+        piece = found[best]
+        line = int(self.line[piece])
+        return TrailMatch(
+            trail=self.names[line],
+            distance_m=float(distances[best]),
+            chainage_m=float(self.chainage[piece] + t[best] * math.sqrt(length2[best])),
+            length_m=self.lengths[line],
+        )
+
+
+trail_network = TrailNetwork()
@@ -0,0 +1,82 @@
+import importlib
+import logging
+import threading
+import time
+from wsgiref.util import setup_testing_defaults
+
+logger = logging.getLogger(__name__)
+
+
+class Warmup:
+    ##
+    # Warms a freshly started worker up (WARMUP in settings). Started by
+    # shed/wsgi.py and shed/asgi.py once the application has loaded, it runs
+    # on a background thread, so the worker starts listening straight away.
+    # While it waits for its first request:
+    #   - the modules the views only import on first use (MODULES) are
+    #     imported;
+    #   - each of WARMUP_PATHS is fetched through Django, which loads the
+    #     URLconf and the views, compiles the templates and fills PageCache.
+    # A request arriving before it has finished just does some of the same
+    # work itself: imports and template loading are safe to run twice.
+    MODULES = (
+        "requests",
+        "aiohttp",
+        "PIL.Image",
+        "PIL.ImageOps",
+        "PIL.JpegImagePlugin",
+    )
+
+    def __init__(self):
+        self.thread = None
+        self.done = threading.Event()
+        self.statuses = {}
+        self.seconds = None
+
+    def start(self, paths):
+        if self.thread is None:
+            self.thread = threading.Thread(
+                target=self.run, args=(list(paths),), name="warmup", daemon=True
+            )
+            self.thread.start()
+        return self.thread
+
+    def run(self, paths):
+        started = time.perf_counter()
+        try:
+            for module in self.MODULES:
+                importlib.import_module(module)
+            # a handler of its own: the URLconf, templates and imports it
+            # loads are shared with the server's application
+            from django.core.handlers.wsgi import WSGIHandler
+
+            handler = WSGIHandler()
+            for path in paths:
+                self.statuses[path] = self.get(handler, path)
+        except Exception as e:
+            logger.warning(f"{__name__}: warm-up failed: {type(e)}: {e}")
+        finally:
+            self.seconds = time.perf_counter() - started
+            self.done.set()
+        logger.info(f"{__name__}: warm in {self.seconds * 1e3:.0f} ms: {self.statuses}")
+
+    ##
+    # GET `path` through `handler`; the response's status code
+    @staticmethod
+    def get(handler, path: str) -> int:
+        environ = {"REQUEST_METHOD": "GET", "PATH_INFO": path}
+        setup_testing_defaults(environ)
+        statuses = []
+
+        def start_response(status, headers, exc_info=None):
+            statuses.append(int(status.split()[0]))
+
+        response = handler(environ, start_response)
+        try:
+            b"".join(response)
+        finally:
+            response.close()
+        return statuses[0]
+
+
+warmup = Warmup()
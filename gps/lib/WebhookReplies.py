@@ -0,0 +1,148 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from enum import Enum
+
+from django.core.cache import caches
+from django.http import HttpResponse
+from opentelemetry import trace
+
+logger = logging.getLogger(__name__)
+
+
+class Delivery(Enum):
+    Claimed = 1
+    Pending = 2
+    Done = 3
+
+
+class WebhookReplies:
+    ##
+    # Idempotency for the MMS and email webhooks. Twilio and SendGrid retry a
+    # webhook that is slow to answer, and every retry used to download and
+    # parse the media again and send another EmailReply.
+    #
+    # The first delivery of a message claims its key (MessageSid, Message-ID,
+    # ...) in the Django cache named by CACHE_ALIAS, which all gunicorn
+    # workers on the instance share, and stores its response under the key
+    # when done; the cache's TIMEOUT is how long it is replayed. A retry that
+    # arrives while the first delivery is still running polls until the
+    # response is there instead of redoing the work; one that arrives later
+    # gets the stored response straight away. A failed delivery drops its
+    # claim so the next retry does the work again, and the claim of a worker
+    # that died expires after CLAIM_TIMEOUT, when a waiting retry takes over.
+    # (FileBasedCache.add is not atomic across processes, so two deliveries
+    # within a few milliseconds of each other could both run; retries come
+    # seconds apart.)
+    CACHE_ALIAS = "webhooks"
+    KEY_PREFIX = "webhook:v1:"
+    CLAIM_TIMEOUT = 60
+    POLL_INTERVAL = 0.25
+    PENDING = "pending"
+
+    def __init__(self, alias: str = CACHE_ALIAS):
+        self.alias = alias
+        self.lock = threading.Lock()
+        self.delivered = 0
+        self.replayed = 0
+
+    def cache_key(self, key: str) -> str:
+        return (
+            self.KEY_PREFIX + hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+        )
+
+    ##
+    # claim `cache_key`, or find the stored response or someone else's claim.
+    # returns (Delivery, response or None).
+    def check(self, cache_key: str):
+        shared = caches[self.alias]
+        if shared.add(cache_key, self.PENDING, self.CLAIM_TIMEOUT):
+            return Delivery.Claimed, None
+        found = shared.get(cache_key)
+        if found is None or found == self.PENDING:
+            # None: the claim expired in between, claim it next time round
+            return Delivery.Pending, None
+        status, content_type, content = found
+        return Delivery.Done, HttpResponse(
+            content, content_type=content_type, status=status
+        )
+
+    ##
+    # keep the response of a delivery for replaying, or drop the claim when
+    # the delivery failed.
+    def finish(self, cache_key: str, response):
+        shared = caches[self.alias]
+        if response is None or response.status_code != 200 or response.streaming:
+            shared.delete(cache_key)
+            return
+        try:
+            shared.set(
+                cache_key,
+                (response.status_code, response["Content-Type"], response.content),
+            )
+        except Exception as e:
+            logger.warning(f"{__name__}: could not store response for {cache_key}: {e}")
+            shared.delete(cache_key)
+
+    ##
+    # the response of `view(*args)` for the webhook delivery identified by
+    # `key`, running it only if no other delivery of the same message has.
+    # with no key every delivery is run.
+    def run(self, key, view, *args):
+        if key is None:
+            return view(*args)
+        cache_key = self.cache_key(key)
+        while True:
+            delivery, response = self.check(cache_key)
+            if delivery is not Delivery.Pending:
+                break
+            time.sleep(self.POLL_INTERVAL)
+        if delivery is Delivery.Done:
+            return self.replay(key, response)
+        self.count_delivery()
+        response = None
+        try:
+            response = view(*args)
+        finally:
+            self.finish(cache_key, response)
+        return response
+
+    async def run_async(self, key, view, *args):
+        if key is None:
+            return await view(*args)
+        cache_key = self.cache_key(key)
+        while True:
+            delivery, response = await asyncio.to_thread(self.check, cache_key)
+            if delivery is not Delivery.Pending:
+                break
+            await asyncio.sleep(self.POLL_INTERVAL)
+        if delivery is Delivery.Done:
+            return self.replay(key, response)
+        self.count_delivery()
+        response = None
+        try:
+            response = await view(*args)
+        finally:
+            await asyncio.to_thread(self.finish, cache_key, response)
+        return response
+
+    def replay(self, key: str, response):
+        logger.info(f"{__name__}: replaying the response to {key}")
+        trace.get_current_span().set_attribute("webhook.replayed", True)
+        with self.lock:
+            self.replayed += 1
+        return response
+
+    def count_delivery(self):
+        trace.get_current_span().set_attribute("webhook.replayed", False)
+        with self.lock:
+            self.delivered += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"delivered": self.delivered, "replayed": self.replayed}
+
+
+webhook_replies = WebhookReplies()
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from gps.lib.ObservationExport import FORMATS, ObservationExport
+
+
+##
+# Export the stored observations, the same way as /gps/export.
+#
+#   python manage.py export_observations --format gpx --source mms,email \
+#       --start 2025-06-01 --bbox 40.3,-80.1,40.6,-79.8 --output june.gpx
+#
+# Rows are streamed from the database to the output in chunks, so memory
+# use stays flat however many observations there are.
+class Command(BaseCommand):
+    help = "Export stored GPS observations as GeoJSON, GPX or KML."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=list(FORMATS), default="geojson")
+        parser.add_argument("--output", help="output file (default: stdout)")
+        parser.add_argument("--start", help="ISO 8601 date or datetime, inclusive")
+        parser.add_argument("--end", help="ISO 8601 date or datetime, exclusive")
+        parser.add_argument(
+            "--time",
+            choices=list(ObservationExport.TIME_FIELDS),
+            default="taken",
+            help="filter --start/--end on GPS time or arrival time",
+        )
+        parser.add_argument("--source", help="comma separated: html, mms, email")
+        parser.add_argument("--bbox", help="south,west,north,east in degrees")
+
+    def handle(self, *args, **options):
+        try:
+            exporter = ObservationExport(options["format"], options)
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as out:
+                for chunk in exporter.chunks():
+                    out.write(chunk)
+        else:
+            for chunk in exporter.chunks():
+                self.stdout.write(chunk, ending="")
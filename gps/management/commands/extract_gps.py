@@ -0,0 +1,341 @@
+import csv
+import json
+import os
+import tarfile
+import time
+import zipfile
+import zlib
+from io import StringIO
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gps.lib.ImageGps import ImageGps
+
+
+##
+# Bulk, offline GPS extraction for backlogs of field photos.
+#
+#   python manage.py extract_gps photos/ more.zip --format geojson \
+#       --output photos.geojson --checkpoint photos.ckpt
+#
+# Directories are walked recursively and tar/zip archives are opened in
+# place. Everything is visited in a stable (sorted) order, files are handed
+# to ImageGps.extract_many's process pool by path (the workers memory-map
+# them) and archive members as bytes. Results stream to CSV, GeoJSON or JSON
+# Lines in that same order.
+#
+# With --checkpoint, progress is saved every --checkpoint-every files as the
+# number of inputs finished plus the output file's length at that point. A
+# rerun with the same arguments truncates the output back to that length and
+# carries on from the next input.
+#
+# A file that can't be read or an archive that turns out to be corrupt gets
+# a row with result "error" (the reason goes to stderr) and the run carries
+# on, so it still counts as one input and resuming stays in step.
+class Command(BaseCommand):
+    help = "Extract GPS coordinates from image files, directories and archives."
+
+    IMAGE_EXTENSIONS = {
+        ".jpg",
+        ".jpeg",
+        ".heic",
+        ".heif",
+        ".png",
+        ".tif",
+        ".tiff",
+        ".webp",
+    }
+    ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+    FIELDS = [
+        "path",
+        "lat",
+        "lon",
+        "altitude",
+        "timestamp",
+        "direction",
+        "h_error",
+        "speed",
+        "result",
+    ]
+    SOURCE_ERRORS = (
+        OSError,
+        EOFError,
+        zlib.error,
+        zipfile.BadZipFile,
+        tarfile.TarError,
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="files, directories, archives")
+        parser.add_argument(
+            "--format", choices=["csv", "geojson", "jsonl"], default="csv"
+        )
+        parser.add_argument("--output", help="output file (default: stdout)")
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        parser.add_argument("--checkpoint", help="resumable progress file")
+        parser.add_argument("--checkpoint-every", type=int, default=500)
+        parser.add_argument(
+            "--max-files", type=int, help="stop after this many files in this run"
+        )
+        parser.add_argument("--progress-every", type=float, default=2.0, help="seconds")
+
+    def handle(self, *args, **options):
+        if options["checkpoint"] and not options["output"]:
+            raise CommandError("--checkpoint needs --output")
+        for path in options["paths"]:
+            if not os.path.exists(path):
+                raise CommandError(f"no such file or directory: {path}")
+
+        writer = FORMATS[options["format"]]()
+        checkpoint = self.load_checkpoint(options)
+        done = checkpoint["done"] if checkpoint else 0
+
+        out = None
+        if options["output"]:
+            # binary, so tell()/truncate() are plain byte offsets
+            out = open(options["output"], "r+b" if checkpoint else "wb")
+            if checkpoint:
+                out.truncate(checkpoint["output_offset"])
+                out.seek(checkpoint["output_offset"])
+                writer.written = checkpoint["written"]
+
+            def emit(text):
+                out.write(text.encode())
+
+        else:
+
+            def emit(text):
+                self.stdout.write(text, ending="")
+
+        try:
+            if not checkpoint:
+                emit(writer.header())
+            if self.run(emit, out, writer, done, options):
+                emit(writer.footer())
+        finally:
+            if out is not None:
+                out.close()
+
+    ##
+    # returns True when every input has been processed, False when this run
+    # stopped early because of --max-files.
+    def run(self, emit, out, writer, done, options):
+        sources = self.iter_sources(options["paths"])
+        names = []
+        errors = {}
+        stopped_early = False
+
+        def items():
+            nonlocal stopped_early
+            for index, (name, load) in enumerate(sources):
+                if index < done:
+                    continue
+                if (
+                    options["max_files"] is not None
+                    and len(names) >= options["max_files"]
+                ):
+                    stopped_early = True
+                    return
+                names.append(name)
+                try:
+                    item = load()
+                except self.SOURCE_ERRORS as e:
+                    errors[len(names) - 1] = e
+                    # a stand-in, so results stay in step with names
+                    item = b""
+                yield item
+
+        started = time.monotonic()
+        last_report = started
+        count = 0
+        for image in ImageGps.extract_many(items(), options["workers"]):
+            if count in errors:
+                error = errors.pop(count)
+                self.stderr.write(f"{names[count]}: {type(error).__name__}: {error}")
+                emit(writer.row(names[count], None, error=True))
+            else:
+                emit(writer.row(names[count], image))
+            count += 1
+            if options["checkpoint"] and count % options["checkpoint_every"] == 0:
+                self.save_checkpoint(options, out, writer, done + count)
+            now = time.monotonic()
+            if now - last_report >= options["progress_every"]:
+                last_report = now
+                self.report(done + count, count, now - started)
+        self.report(done + count, count, time.monotonic() - started)
+
+        if options["checkpoint"]:
+            self.save_checkpoint(options, out, writer, done + count)
+        return not stopped_early
+
+    def report(self, total, count, elapsed):
+        rate = count / elapsed if elapsed > 0 else 0.0
+        self.stderr.write(f"{total} files done, {rate:.1f} files/s")
+
+    ##
+    # yield (name, loader) for every image, in a stable order. loaders return
+    # a path for plain files and the member's bytes for archive members, and
+    # are only called for inputs that actually get processed, so resuming
+    # skips already-finished archive members without reading them. an archive
+    # that fails part way through ends with one entry for the archive itself,
+    # whose loader raises the error.
+    def iter_sources(self, paths):
+        for path in paths:
+            path = Path(path)
+            if path.is_dir():
+                for root, dirs, files in os.walk(path):
+                    dirs.sort()
+                    for filename in sorted(files):
+                        yield from self.iter_file(Path(root, filename))
+            else:
+                yield from self.iter_file(path)
+
+    def iter_file(self, path: Path):
+        name = path.name.lower()
+        if name.endswith(self.ARCHIVE_SUFFIXES):
+            # neither a zip nor a tar still goes to the opener its name
+            # suggests, which reports it as corrupt
+            try:
+                if zipfile.is_zipfile(path) or (
+                    name.endswith(".zip") and not tarfile.is_tarfile(path)
+                ):
+                    yield from self.iter_zip(path)
+                else:
+                    yield from self.iter_tar(path)
+            except self.SOURCE_ERRORS as e:
+                yield str(path), lambda e=e: raise_(e)
+            return
+        if path.suffix.lower() in self.IMAGE_EXTENSIONS:
+            yield str(path), lambda: readable(path)
+
+    def iter_zip(self, path: Path):
+        with zipfile.ZipFile(path) as archive:
+            for info in sorted(archive.infolist(), key=lambda i: i.filename):
+                if info.is_dir() or not self.is_image_name(info.filename):
+                    continue
+                yield f"{path}!{info.filename}", lambda info=info: archive.read(info)
+
+    def iter_tar(self, path: Path):
+        with tarfile.open(path) as archive:
+            for member in archive:
+                if not member.isfile() or not self.is_image_name(member.name):
+                    continue
+                yield f"{path}!{member.name}", lambda m=member: (
+                    archive.extractfile(m).read()
+                )
+
+    def is_image_name(self, name: str) -> bool:
+        if name.startswith("__MACOSX/"):
+            return False
+        return Path(name).suffix.lower() in self.IMAGE_EXTENSIONS
+
+    def load_checkpoint(self, options):
+        path = options["checkpoint"]
+        if not path or not os.path.exists(path):
+            return None
+        with open(path) as f:
+            checkpoint = json.load(f)
+        if (
+            checkpoint.get("paths") != options["paths"]
+            or checkpoint.get("format") != options["format"]
+        ):
+            raise CommandError(f"{path} was made for different paths or format")
+        self.stderr.write(f"resuming after {checkpoint['done']} files")
+        return checkpoint
+
+    def save_checkpoint(self, options, out, writer, done):
+        out.flush()
+        checkpoint = {
+            "paths": options["paths"],
+            "format": options["format"],
+            "done": done,
+            "written": writer.written,
+            "output_offset": out.tell(),
+        }
+        tmp = options["checkpoint"] + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp, options["checkpoint"])
+
+
+def raise_(error):
+    raise error
+
+
+##
+# the path, once it's known to open: the workers read it, and an error there
+# would take the whole batch with it
+def readable(path: Path) -> str:
+    with open(path, "rb"):
+        pass
+    return str(path)
+
+
+def result_fields(name, image, error=False):
+    fields = {"path": name, "result": "error" if error else "not_image"}
+    if image is None:
+        return fields
+    fields["result"] = "ok" if image.lat and image.lon else "no_gps"
+    fix = image.fix
+    if fix is not None:
+        fields.update(fix.as_dict())
+        fields.pop("direction_ref")
+        if fix.timestamp is not None:
+            fields["timestamp"] = fix.timestamp.isoformat()
+    return fields
+
+
+class CsvFormat:
+    def __init__(self):
+        self.written = 0
+
+    def header(self):
+        return self.line(dict(zip(Command.FIELDS, Command.FIELDS)))
+
+    def row(self, name, image, error=False):
+        self.written += 1
+        return self.line(result_fields(name, image, error))
+
+    def line(self, fields):
+        buffer = StringIO()
+        csv.DictWriter(buffer, fieldnames=Command.FIELDS).writerow(fields)
+        return buffer.getvalue()
+
+    def footer(self):
+        return ""
+
+
+class JsonLinesFormat(CsvFormat):
+    def header(self):
+        return ""
+
+    def line(self, fields):
+        return json.dumps(fields) + "\n"
+
+
+##
+# a FeatureCollection written one feature per line; only images with
+# coordinates become features.
+class GeoJsonFormat(CsvFormat):
+    def header(self):
+        return '{"type": "FeatureCollection", "features": [\n'
+
+    def row(self, name, image, error=False):
+        fields = result_fields(name, image, error)
+        if fields["result"] != "ok":
+            return ""
+        feature = {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [image.lon, image.lat]},
+            "properties": fields,
+        }
+        separator = ",\n" if self.written else ""
+        self.written += 1
+        return separator + json.dumps(feature)
+
+    def footer(self):
+        return "\n]}\n"
+
+
+FORMATS = {"csv": CsvFormat, "geojson": GeoJsonFormat, "jsonl": JsonLinesFormat}
@@ -0,0 +1,152 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+##
+# What a cold start costs, and where it goes.
+#
+#   python manage.py profile_startup [--path /gps/] [--runs 5] [--by module]
+#
+# Each run starts a fresh `python -X importtime` process that loads
+# shed.wsgi's application (as a new gunicorn worker does) and then serves
+# one GET of --path, then reports:
+#   - startup: loading the application, settings and apps included;
+#   - first response: the first request, which also loads the URLconf and
+#     views and whatever they import;
+#   - the import time in each of the two, per top-level package (--by
+#     package) or per module (--by module). This is self time, so the
+#     numbers add up.
+# Medians over --runs. WARMUP is turned off in the child processes: this
+# measures the cold path that it would hide.
+class Command(BaseCommand):
+    help = "Measure startup and time to first response, with import time per module."
+
+    PHASES = ("startup", "first_response")
+    MARKER = "profile_startup: first request"
+    CHILD = """
+import json, os, sys, time
+from wsgiref.util import setup_testing_defaults
+
+started = time.perf_counter()
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "shed.settings")
+from shed.wsgi import application
+
+loaded = time.perf_counter()
+print(MARKER, file=sys.stderr, flush=True)
+environ = {"REQUEST_METHOD": "GET", "PATH_INFO": sys.argv[1]}
+setup_testing_defaults(environ)
+statuses = []
+response = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+b"".join(response)
+response.close()
+done = time.perf_counter()
+print(json.dumps({"status": statuses[0], "startup": loaded - started, "first_response": done - loaded}))
+"""
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", default="/gps/", help="the first request")
+        parser.add_argument("--runs", type=int, default=3)
+        parser.add_argument("--by", choices=["package", "module"], default="package")
+        parser.add_argument("--top", type=int, default=15, help="rows per phase")
+        parser.add_argument("--json", action="store_true", help="JSON output")
+
+    def handle(self, *args, **options):
+        runs = [self.run_once(options["path"]) for _ in range(max(options["runs"], 1))]
+        result = self.summarize(runs, options["by"], options["top"])
+        result["path"] = options["path"]
+        if options["json"]:
+            self.stdout.write(json.dumps(result, indent=2))
+            return
+        self.stdout.write(
+            f"GET {result['path']} -> {result['status']}, median of {result['runs']} runs:\n"
+            f"  process  {result['process_ms']:8.1f} ms (interpreter included)\n"
+            f"  startup  {result['startup_ms']:8.1f} ms\n"
+            f"  first response {result['first_response_ms']:8.1f} ms"
+        )
+        for phase in self.PHASES:
+            self.stdout.write(
+                f"\nimport time, {phase.replace('_', ' ')} "
+                f"({result['imports_ms'][phase]['total']:.1f} ms):"
+            )
+            for name, ms in result["imports_ms"][phase]["top"]:
+                self.stdout.write(f"  {ms:8.1f} ms  {name}")
+
+    ##
+    # one cold process: ({wall times}, {phase: [(module, self seconds)]})
+    def run_once(self, path: str):
+        env = dict(os.environ, WARMUP="False", PYTHONDONTWRITEBYTECODE="1")
+        code = f"MARKER = {self.MARKER!r}\n{self.CHILD}"
+        started = time.perf_counter()
+        child = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code, path],
+            cwd=settings.BASE_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        elapsed = time.perf_counter() - started
+        if child.returncode != 0:
+            raise CommandError(f"startup failed:\n{child.stderr[-2000:]}")
+        times = json.loads(child.stdout.strip().splitlines()[-1])
+        times["process"] = elapsed
+        return times, self.parse_importtime(child.stderr)
+
+    ##
+    # {phase: [(module, self seconds)]} from `python -X importtime` output,
+    # split at MARKER
+    @classmethod
+    def parse_importtime(cls, stderr: str) -> dict:
+        phases = {phase: [] for phase in cls.PHASES}
+        phase = cls.PHASES[0]
+        for line in stderr.splitlines():
+            if line == cls.MARKER:
+                phase = cls.PHASES[1]
+                continue
+            if not line.startswith("import time:"):
+                continue
+            fields = line[len("import time:") :].split("|")
+            if len(fields) != 3 or not fields[0].strip().isdigit():
+                continue  # the header line
+            phases[phase].append((fields[2].strip(), int(fields[0]) / 1e6))
+        return phases
+
+    @classmethod
+    def summarize(cls, runs, by: str, top: int) -> dict:
+        def median_ms(values):
+            return statistics.median(values) * 1e3
+
+        result = {
+            "runs": len(runs),
+            "status": runs[0][0]["status"],
+            "process_ms": median_ms([t["process"] for t, _ in runs]),
+            "startup_ms": median_ms([t["startup"] for t, _ in runs]),
+            "first_response_ms": median_ms([t["first_response"] for t, _ in runs]),
+            "imports_ms": {},
+        }
+        for phase in cls.PHASES:
+            per_run = []
+            for _, imports in runs:
+                seconds = defaultdict(float)
+                for module, self_seconds in imports[phase]:
+                    name = module.split(".")[0] if by == "package" else module
+                    seconds[name] += self_seconds
+                per_run.append(seconds)
+            names = set().union(*per_run)
+            ms = {
+                name: median_ms([seconds.get(name, 0.0) for seconds in per_run])
+                for name in names
+            }
+            ranked = sorted(ms.items(), key=lambda item: item[1], reverse=True)
+            result["imports_ms"][phase] = {
+                "total": median_ms([sum(seconds.values()) for seconds in per_run]),
+                "top": [(name, round(value, 3)) for name, value in ranked[:top]],
+            }
+        return result
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:56
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="GpsObservation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("lat", models.FloatField()),
+                ("lon", models.FloatField()),
+                ("geohash", models.CharField(max_length=12)),
+                ("altitude", models.FloatField(blank=True, null=True)),
+                ("timestamp", models.DateTimeField(blank=True, null=True)),
+                ("direction", models.FloatField(blank=True, null=True)),
+                (
+                    "direction_ref",
+                    models.CharField(blank=True, max_length=1, null=True),
+                ),
+                ("h_error", models.FloatField(blank=True, null=True)),
+                ("speed", models.FloatField(blank=True, null=True)),
+                (
+                    "source",
+                    models.CharField(
+                        choices=[("html", "Html"), ("mms", "Mms"), ("email", "Email")],
+                        max_length=8,
+                    ),
+                ),
+                ("content_hash", models.CharField(max_length=32)),
+                (
+                    "received_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["geohash", "timestamp"], name="gps_obs_geohash_time"
+                    ),
+                    models.Index(
+                        fields=["timestamp", "geohash"], name="gps_obs_time_geohash"
+                    ),
+                    models.Index(
+                        fields=["source", "received_at"], name="gps_obs_source_time"
+                    ),
+                    models.Index(fields=["content_hash"], name="gps_obs_content_hash"),
+                ],
+            },
+        ),
+    ]
@@ -1,3 +1,88 @@
 from django.db import models
+from django.db.models import Q
+from django.utils import timezone
 
-# Create your models here.
+from .lib.Geohash import Geohash
+
+
+class GpsObservationQuerySet(models.QuerySet):
+    ##
+    # observations inside a bounding box (degrees; west > east crosses the
+    # antimeridian). the geohash cells covering the box are index range
+    # scans on geohash; lat/lon then trim the cells' overhang.
+    def in_bbox(self, south, west, north, east, max_cells: int = 32):
+        ranges = Q()
+        for prefix in Geohash.cover(south, west, north, east, max_cells):
+            if not prefix:
+                ranges = Q()
+                break
+            ranges |= Q(geohash__gte=prefix, geohash__lt=prefix + Geohash.RANGE_END)
+        lon = Q(lon__gte=west, lon__lte=east)
+        if west > east:
+            lon = Q(lon__gte=west) | Q(lon__lte=east)
+        return self.filter(ranges, lon, lat__gte=south, lat__lte=north)
+
+    ##
+    # observations whose GPS time (or, with field="received_at", arrival
+    # time) is in [start, end). either end may be None.
+    def between(self, start=None, end=None, field: str = "timestamp"):
+        qs = self
+        if start is not None:
+            qs = qs.filter(**{f"{field}__gte": start})
+        if end is not None:
+            qs = qs.filter(**{f"{field}__lt": end})
+        return qs
+
+
+class GpsObservation(models.Model):
+    ##
+    # One photo location, as extracted by ImageGps: the GpsFix fields, where
+    # the photo came from and a hash of its content (see
+    # ObservationWriter.content_hash). The image itself is not kept.
+    # geohash is the full-precision Geohash of lat/lon, so bounding-box
+    # queries are range scans on the (geohash, timestamp) index, and
+    # time-range queries on (timestamp, geohash).
+    class Source(models.TextChoices):
+        HTML = "html"
+        MMS = "mms"
+        EMAIL = "email"
+
+    lat = models.FloatField()
+    lon = models.FloatField()
+    geohash = models.CharField(max_length=Geohash.PRECISION)
+    altitude = models.FloatField(null=True, blank=True)
+    timestamp = models.DateTimeField(null=True, blank=True)
+    direction = models.FloatField(null=True, blank=True)
+    direction_ref = models.CharField(max_length=1, null=True, blank=True)
+    h_error = models.FloatField(null=True, blank=True)
+    speed = models.FloatField(null=True, blank=True)
+    source = models.CharField(max_length=8, choices=Source.choices)
+    content_hash = models.CharField(max_length=32)
+    received_at = models.DateTimeField(default=timezone.now)
+
+    objects = GpsObservationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["geohash", "timestamp"], name="gps_obs_geohash_time"),
+            models.Index(fields=["timestamp", "geohash"], name="gps_obs_time_geohash"),
+            models.Index(fields=["source", "received_at"], name="gps_obs_source_time"),
+            models.Index(fields=["content_hash"], name="gps_obs_content_hash"),
+        ]
+
+    def __str__(self):
+        return f"{self.source} {self.lat}, {self.lon} at {self.timestamp}"
+
+    ##
+    # an unsaved observation of an ImageGps result (which must have lat/lon)
+    @staticmethod
+    def from_image_gps(image_gps, source: str, content_hash: str):
+        fix = image_gps.fix
+        fields = fix.as_dict() if fix is not None else {}
+        fields.update(lat=image_gps.lat, lon=image_gps.lon)
+        return GpsObservation(
+            geohash=Geohash.encode(image_gps.lat, image_gps.lon),
+            source=source,
+            content_hash=content_hash,
+            **fields,
+        )
@@ -1,20 +1,135 @@
+import json
+import asyncio
+import os
+import re
+import tempfile
+import threading
+import time
 import logging
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
 from unittest.mock import patch, MagicMock
 
 from PIL import ExifTags as PIL_ExifTags
+from PIL import Image as PIL_Image
+from PIL.TiffImagePlugin import IFDRational
+from django.conf import settings
+from django.core.cache import caches
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.http import QueryDict
-from django.test import TestCase, RequestFactory, SimpleTestCase
+from django.http import Http404, QueryDict
+from django.test import TestCase, RequestFactory, SimpleTestCase, override_settings
 
 from . import views
+from .benchmarks.corpus import box, make_heif
+from .lib.GpsCache import gps_cache
 
 logger = logging.getLogger(__name__)
 
 
+def make_jpeg(gps=None, fmt="JPEG", size=(32, 24)):
+    exif = PIL_Image.Exif()
+    if gps:
+        exif.get_ifd(PIL_ExifTags.IFD.GPSInfo).update(gps)
+    out = BytesIO()
+    PIL_Image.new("RGB", size, (10, 20, 30)).save(out, fmt, exif=exif)
+    return out.getvalue()
+
+
+##
+# keep the GPS result, webhook and tile caches out of the file system (and out of
+# other test runs)
+TEST_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "gps": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "gps-tests",
+    },
+    "webhooks": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "webhook-tests",
+    },
+    "tiles": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "tile-tests",
+    },
+}
+
+
+##
+# staticfiles/ is build output (collectstatic), not part of the tree: render
+# {% static %} without its manifest. tests that need one make it with
+# collect_static.
+static_storage = override_settings(
+    STORAGES={
+        **settings.STORAGES,
+        "staticfiles": {
+            "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"
+        },
+    }
+)
+
+
+def setUpModule():
+    static_storage.enable()
+
+
+def tearDownModule():
+    static_storage.disable()
+
+
+##
+# collectstatic into `root` with the real (manifest) storage, as the build
+# does, but from assets/ only, to be quick
+def collect_static(root):
+    from django.core.management import call_command
+
+    from shed import settings as shed_settings
+
+    with override_settings(
+        STATIC_ROOT=root,
+        STORAGES=shed_settings.STORAGES,
+        STATICFILES_FINDERS=["django.contrib.staticfiles.finders.FileSystemFinder"],
+    ):
+        call_command("collectstatic", "--noinput", verbosity=0)
+
+
+##
+# a request from a logged-in staff member, for the staff-only views
+def staff_request(path, params=None, **extra):
+    from django.contrib.auth.models import User
+
+    request = RequestFactory().get(path, params, **extra)
+    request.user = User(username="staff", is_staff=True, is_active=True)
+    return request
+
+
+PITTSBURGH_GPS = {
+    PIL_ExifTags.GPS.GPSLatitudeRef: "N",
+    PIL_ExifTags.GPS.GPSLatitude: (
+        IFDRational(40),
+        IFDRational(26),
+        IFDRational(4623, 100),
+    ),
+    PIL_ExifTags.GPS.GPSLongitudeRef: "W",
+    PIL_ExifTags.GPS.GPSLongitude: (
+        IFDRational(79),
+        IFDRational(58),
+        IFDRational(3, 1),
+    ),
+}
+
+
+@override_settings(
+    CACHES=TEST_CACHES, GPS_OBSERVATION_FLUSH_SECONDS=0, GPS_THUMBNAILS=False
+)
 class ViewsTests(TestCase):
     def setUp(self):
         logging.disable(logging.FATAL)
         self.factory = RequestFactory()
+        gps_cache.clear()
+        caches["gps"].clear()
+        caches["webhooks"].clear()
 
     def tearDown(self):
         logging.disable(logging.NOTSET)
@@ -42,12 +157,117 @@ class ViewsTests(TestCase):
             post_data = QueryDict(mutable=True)
             post_data.update({"file": uploaded})
             request = self.factory.post("/gps/rcv_image_html", data=post_data)
+            # the view is csrf_protect'ed; skip the check like the test Client does
+            request._dont_enforce_csrf_checks = True
             response = views.rcv_image_html(request)
             self.assertEqual(response.status_code, 200)
             # Check the rendered content includes coordinates (the view logs and sets context with lat/lon)
             self.assertIn(b"37.42", response.content)
             self.assertIn(b"-122.08", response.content)
 
+    # --- rcv_images_batch ---
+
+    def test_rcv_images_batch_get_renders(self):
+        request = self.factory.get("/gps/rcv_images_batch")
+        response = views.rcv_images_batch(request)
+        self.assertEqual(response.status_code, 200)
+
+    def test_rcv_images_batch_streams_csv_rows_in_order(self):
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, "w") as zf:
+            zf.writestr("trail/a.jpg", make_jpeg(PITTSBURGH_GPS))
+            zf.writestr("trail/b.txt", b"not an image")
+        uploads = [
+            SimpleUploadedFile("one.jpg", make_jpeg(PITTSBURGH_GPS)),
+            SimpleUploadedFile("two.jpg", make_jpeg()),
+            SimpleUploadedFile("photos.zip", archive.getvalue()),
+        ]
+        request = self.factory.post(
+            "/gps/rcv_images_batch", data={"files": uploads, "output": "csv"}
+        )
+        request._dont_enforce_csrf_checks = True
+        response = views.rcv_images_batch(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "file,lat,lon,result")
+        self.assertEqual(
+            [line.split(",")[0] for line in lines[1:]],
+            ["one.jpg", "two.jpg", "trail/a.jpg", "trail/b.txt"],
+        )
+        self.assertIn("40.446175", lines[1])
+        self.assertIn("GPS info missing or incomplete.", lines[2])
+        self.assertIn("does not appear to be an image", lines[4])
+
+    def test_rcv_images_batch_json_lines(self):
+        uploads = [SimpleUploadedFile("one.jpg", make_jpeg(PITTSBURGH_GPS))]
+        request = self.factory.post(
+            "/gps/rcv_images_batch", data={"files": uploads, "output": "json"}
+        )
+        request._dont_enforce_csrf_checks = True
+        response = views.rcv_images_batch(request)
+        rows = [json.loads(line) for line in response.streaming_content]
+        self.assertEqual(rows[0]["file"], "one.jpg")
+        self.assertAlmostEqual(rows[0]["lon"], -79.9675, places=6)
+
+    def test_rcv_images_batch_passes_files_by_path(self):
+        uploads = [SimpleUploadedFile(f"{n}.jpg", make_jpeg()) for n in range(2)]
+        request = self.factory.post(
+            "/gps/rcv_images_batch", data={"files": uploads, "output": "json"}
+        )
+        request._dont_enforce_csrf_checks = True
+        items = []
+
+        def extract_many(iterable):
+            for item in iterable:
+                items.append(item)
+                yield None
+
+        with patch.object(views.ImageGps, "extract_many", extract_many):
+            response = views.rcv_images_batch(request)
+            b"".join(response.streaming_content)
+        self.assertEqual(len(items), 2)
+        for item in items:
+            self.assertIsInstance(item, str)
+        response.close()
+
+    def test_rcv_images_batch_checks_csrf(self):
+        uploads = [SimpleUploadedFile("one.jpg", make_jpeg())]
+        request = self.factory.post("/gps/rcv_images_batch", data={"files": uploads})
+        self.assertEqual(views.rcv_images_batch(request).status_code, 403)
+
+    def test_rcv_images_batch_refuses_oversized_bodies(self):
+        uploads = [SimpleUploadedFile("one.jpg", make_jpeg())]
+        request = self.factory.post(
+            "/gps/rcv_images_batch", data={"files": uploads, "output": "json"}
+        )
+        with patch.object(views, "GPS_BATCH_UPLOAD_MAX_BYTES", 100):
+            response = views.rcv_images_batch(request)
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(hasattr(request, "_files"))
+
+    def test_rcv_images_batch_streams_under_asgi(self):
+        from asgiref.sync import async_to_sync
+        from django.core.handlers.wsgi import WSGIRequest
+
+        uploads = [
+            SimpleUploadedFile(f"{n}.jpg", make_jpeg(PITTSBURGH_GPS)) for n in range(3)
+        ]
+        request = self.factory.post(
+            "/gps/rcv_images_batch", data={"files": uploads, "output": "json"}
+        )
+        request._dont_enforce_csrf_checks = True
+        with patch.object(views, "ASGIRequest", WSGIRequest):
+            response = views.rcv_images_batch(request)
+        # sent line by line, not read into a list first
+        self.assertTrue(response.is_async)
+
+        async def collect():
+            return [line async for line in response.streaming_content]
+
+        rows = [json.loads(line) for line in async_to_sync(collect)()]
+        self.assertEqual([row["file"] for row in rows], ["0.jpg", "1.jpg", "2.jpg"])
+
     # --- rcv_image_mms ---
 
     def test_rcv_image_mms_get_renders(self):
@@ -115,8 +335,8 @@ class ViewsTests(TestCase):
             mock_image.lat = 40.0
             mock_image.lon = -75.0
 
-            with patch.object(views, "MessagingResponse", FakeMsgResp), patch(
-                "requests.get", return_value=fake_resp
+            with patch.object(views, "MessagingResponse", FakeMsgResp), patch.object(
+                views.media_fetcher.session, "get", return_value=fake_resp
             ), patch.object(
                 views.ImageGps, "from_image_bytes", return_value=mock_image
             ):
@@ -135,6 +355,57 @@ class ViewsTests(TestCase):
                     response.content,
                 )
 
+    def post_mms(self, media, get):
+        post_data = {"From": "+15557654321", "NumMedia": str(len(media))}
+        for i, (url, content_type) in enumerate(media):
+            post_data[f"MediaUrl{i}"] = url
+            post_data[f"MediaContentType{i}"] = content_type
+        with patch.object(views, "TWILIO_ACCOUNT_SID", "sid"), patch.object(
+            views, "TWILIO_AUTH_TOKEN", "token"
+        ), patch.object(views.media_fetcher.session, "get", side_effect=get) as m:
+            request = self.factory.post("/gps/image_via_mms", data=post_data)
+            return views.rcv_image_mms(request), m
+
+    def test_rcv_image_mms_fetches_every_image_concurrently(self):
+
+        photos = {
+            "https://example.com/a": make_jpeg(PITTSBURGH_GPS),
+            "https://example.com/b": make_jpeg(),
+        }
+
+        def get(url, **kwargs):
+            time.sleep(0.2)
+            return MagicMock(status_code=200, content=photos[url])
+
+        start = time.monotonic()
+        response, get_mock = self.post_mms(
+            [
+                ("https://example.com/a", "image/jpeg"),
+                ("https://example.com/video", "video/mp4"),
+                ("https://example.com/b", "image/jpeg"),
+            ],
+            get,
+        )
+        self.assertLess(time.monotonic() - start, 0.35)
+        # the video is never downloaded
+        self.assertEqual(
+            sorted(call.args[0] for call in get_mock.call_args_list), sorted(photos)
+        )
+        self.assertTrue(all(call.kwargs["timeout"] for call in get_mock.call_args_list))
+        self.assertIn(b"2 images received:", response.content)
+        self.assertIn(b"1: GPS coords detected: 40.446175, -79.9675", response.content)
+        self.assertIn(b"2: no GPS info found.", response.content)
+
+    def test_rcv_image_mms_survives_fetch_errors(self):
+        import requests
+
+        response, _ = self.post_mms(
+            [("https://example.com/a", "image/jpeg")],
+            requests.ConnectionError("connection reset"),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(b"<Message>", response.content)
+
     # --- rcv_image_email ---
 
     def test_rcv_image_email_get_renders(self):
@@ -266,6 +537,52 @@ class ViewsTests(TestCase):
                     self.assertEqual(response.status_code, 200)
                     self.assertIn(b"GPS info missing or incomplete.", response.content)
 
+    def post_email_attachments(self, *attachments):
+        from django.test import Client
+
+        data = {"from": "user@example.com", "subject": "trail photos"}
+        data["attachments"] = str(len(attachments))
+        for i, (name, content) in enumerate(attachments, 1):
+            data[f"attachment{i}"] = SimpleUploadedFile(name, content)
+        return Client().post("/gps/rcv_image_email", data)
+
+    def test_rcv_image_email_processes_every_attachment(self):
+        from django.core import mail
+
+        response = self.post_email_attachments(
+            ("a.jpg", make_jpeg(PITTSBURGH_GPS)),
+            ("b.jpg", make_jpeg()),
+            ("c.txt", b"not a photo"),
+        )
+        self.assertEqual(
+            response.content.decode().splitlines(),
+            [
+                "a.jpg: GPS latitude, longitude: 40.446175, -79.9675",
+                "b.jpg: GPS info missing or incomplete.",
+                "c.txt: Attached media does not appear to be an image.",
+            ],
+        )
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn("c.txt: Attached media", mail.outbox[0].body)
+
+    def test_rcv_image_email_attachments_run_concurrently(self):
+
+        def slow_upload_gps(uploaded):
+            time.sleep(0.2)
+            return None
+
+        with patch.object(views, "upload_gps", side_effect=slow_upload_gps):
+            start = time.monotonic()
+            response = self.post_email_attachments(
+                *[
+                    (f"{i}.jpg", make_jpeg())
+                    for i in range(views.EMAIL_ATTACHMENT_WORKERS)
+                ]
+            )
+            elapsed = time.monotonic() - start
+        self.assertEqual(len(response.content.decode().splitlines()), 4)
+        self.assertLess(elapsed, 0.2 * views.EMAIL_ATTACHMENT_WORKERS * 0.75)
+
     # --- get_inputs_from_email ---
 
     def test_get_inputs_from_email_reads_post_fields(self):
@@ -391,7 +708,7 @@ class ImageGpsTests(SimpleTestCase):
         exif_mock.get_ifd.return_value = gps_ifd
         image_mock.getexif.return_value = exif_mock
 
-        with patch("gps.lib.ImageGps.Image.open", return_value=image_mock):
+        with patch("PIL.Image.open", return_value=image_mock):
             obj = ImageGps.from_image_bytes(b"fake-bytes")
             self.assertIsNotNone(obj)
             self.assertIsInstance(obj, ImageGps)
@@ -401,5 +718,2273 @@ class ImageGpsTests(SimpleTestCase):
     def test_from_image_bytes_failure_returns_none(self):
         from .lib.ImageGps import ImageGps
 
-        with patch("gps.lib.ImageGps.Image.open", side_effect=Exception("bad image")):
+        with patch("PIL.Image.open", side_effect=Exception("bad image")):
             self.assertIsNone(ImageGps.from_image_bytes(b"not-an-image"))
+
+
+class JpegExifTests(SimpleTestCase):
+    def setUp(self):
+        logging.disable(logging.FATAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_header_parse_matches_pillow(self):
+        from .lib.ImageGps import ImageGps
+
+        data = make_jpeg(PITTSBURGH_GPS)
+        fast = ImageGps.from_image_header(BytesIO(data))
+        slow = ImageGps(PIL_Image.open(BytesIO(data)))
+        self.assertIsNone(fast.image)
+        self.assertEqual((fast.lat, fast.lon), (slow.lat, slow.lon))
+        self.assertAlmostEqual(fast.lat, 40.446175, places=6)
+        self.assertAlmostEqual(fast.lon, -79.9675, places=6)
+
+    def test_header_parse_accepts_buffers(self):
+        from .lib.ImageGps import ImageGps
+
+        data = make_jpeg(PITTSBURGH_GPS)
+        for buffer in (data, bytearray(data), memoryview(data)):
+            image = ImageGps.from_image_header(buffer)
+            self.assertAlmostEqual(image.lat, 40.446175, places=6)
+
+    def test_header_parse_rewinds_file(self):
+        from .lib.ImageGps import ImageGps
+
+        f = BytesIO(make_jpeg(PITTSBURGH_GPS))
+        ImageGps.from_image_header(f)
+        self.assertEqual(f.tell(), 0)
+
+    def test_jpeg_without_gps_has_no_lat_lon(self):
+        from .lib.ImageGps import ImageGps
+
+        image = ImageGps.from_image_bytes(BytesIO(make_jpeg()))
+        self.assertIsNotNone(image)
+        self.assertIsNone(image.lat)
+        self.assertIsNone(image.lon)
+
+    def test_non_jpeg_falls_back_to_pillow(self):
+        from .lib.ImageGps import ImageGps
+
+        data = make_jpeg(PITTSBURGH_GPS, fmt="WEBP")
+        self.assertIsNone(ImageGps.from_image_header(data))
+        image = ImageGps.from_image_bytes(BytesIO(data))
+        self.assertAlmostEqual(image.lat, 40.446175, places=6)
+
+    def test_truncated_header_needs_more_data(self):
+        from .lib.ByteSource import ByteSource, NeedMoreData
+        from .lib.JpegExif import JpegExif
+
+        data = make_jpeg(PITTSBURGH_GPS)
+        with self.assertRaises(NeedMoreData) as cm:
+            JpegExif.read_gps_ifd(ByteSource(memoryview(data)[:40]))
+        self.assertGreater(cm.exception.needed, 40)
+
+    def test_exif_past_scan_limit_falls_back_to_pillow(self):
+        from .lib.ByteSource import ByteSource
+        from .lib.ImageGps import ImageGps
+        from .lib.JpegExif import JpegExif, ScanLimitReached
+
+        # ICC-sized APP2 segments ahead of the Exif segment
+        data = make_jpeg(PITTSBURGH_GPS)
+        app2 = b"\xff\xe2" + (65535).to_bytes(2, "big") + b"\x00" * 65533
+        data = data[:2] + app2 * 5 + data[2:]
+        with self.assertRaises(ScanLimitReached):
+            JpegExif.read_gps_ifd(ByteSource(data))
+        self.assertIsNone(ImageGps.from_image_header(data))
+        image = ImageGps.from_image_bytes(BytesIO(data))
+        self.assertAlmostEqual(image.lat, 40.446175, places=6)
+
+
+class GpsFixTests(SimpleTestCase):
+    FULL_GPS = {
+        **PITTSBURGH_GPS,
+        PIL_ExifTags.GPS.GPSAltitudeRef: b"\x01",
+        PIL_ExifTags.GPS.GPSAltitude: IFDRational(2505, 10),
+        PIL_ExifTags.GPS.GPSDateStamp: "2025:06:01",
+        PIL_ExifTags.GPS.GPSTimeStamp: (
+            IFDRational(14),
+            IFDRational(5),
+            IFDRational(3050, 100),
+        ),
+        PIL_ExifTags.GPS.GPSImgDirectionRef: "T",
+        PIL_ExifTags.GPS.GPSImgDirection: IFDRational(27150, 100),
+        PIL_ExifTags.GPS.GPSHPositioningError: IFDRational(47, 10),
+        PIL_ExifTags.GPS.GPSSpeedRef: "N",
+        PIL_ExifTags.GPS.GPSSpeed: IFDRational(10),
+    }
+
+    def test_fix_decodes_all_fields(self):
+        from datetime import datetime, timezone
+
+        from .lib.ImageGps import ImageGps
+
+        for data in (make_jpeg(self.FULL_GPS), make_heif(self.FULL_GPS)):
+            fix = ImageGps.from_image_bytes(data).fix
+            self.assertAlmostEqual(fix.lat, 40.446175, places=6)
+            self.assertAlmostEqual(fix.lon, -79.9675, places=6)
+            self.assertAlmostEqual(fix.altitude, -250.5)
+            self.assertEqual(
+                fix.timestamp,
+                datetime(2025, 6, 1, 14, 5, 30, 500000, tzinfo=timezone.utc),
+            )
+            self.assertAlmostEqual(fix.direction, 271.5)
+            self.assertEqual(fix.direction_ref, "T")
+            self.assertAlmostEqual(fix.h_error, 4.7)
+            self.assertAlmostEqual(fix.speed, 18.52)
+
+    def test_pillow_and_header_fix_agree(self):
+        from .lib.ImageGps import ImageGps
+
+        data = make_jpeg(self.FULL_GPS)
+        fast = ImageGps.from_image_header(data)
+        slow = ImageGps(PIL_Image.open(BytesIO(data)))
+        self.assertEqual(fast.fix, slow.fix)
+
+    def test_heavy_objects_are_released(self):
+        from .lib.ImageGps import ImageGps
+
+        image = ImageGps(PIL_Image.open(BytesIO(make_jpeg(self.FULL_GPS))))
+        self.assertIsNone(image.image)
+        self.assertIsNone(image.exif)
+        self.assertIsNone(image.gps_ifd)
+        self.assertIsNotNone(image.fix)
+
+    def test_fix_is_immutable_slotted_and_picklable(self):
+        import pickle
+
+        from .lib.GpsFix import GpsFix
+
+        fix = GpsFix(lat=1.0, lon=2.0)
+        self.assertFalse(hasattr(fix, "__dict__"))
+        with self.assertRaises(AttributeError):
+            fix.lat = 3.0
+        self.assertEqual(pickle.loads(pickle.dumps(fix)), fix)
+
+    def test_missing_or_bad_fields_are_none(self):
+        from .lib.GpsFix import GpsFix
+
+        g = PIL_ExifTags.GPS
+        fix = GpsFix.from_gps_ifd(
+            {
+                g.GPSAltitude: float("nan"),
+                g.GPSDateStamp: "not a date",
+                g.GPSTimeStamp: (1.0, 2.0, 3.0),
+            }
+        )
+        self.assertEqual(fix, GpsFix())
+
+
+class ExtractManyTests(SimpleTestCase):
+    def test_extract_many_yields_in_order(self):
+        from .lib.ImageGps import ImageGps
+
+        items = [make_jpeg(PITTSBURGH_GPS), b"junk", make_heif(PITTSBURGH_GPS)] * 3
+        results = list(ImageGps.extract_many(iter(items), max_workers=2))
+        self.assertEqual(len(results), 9)
+        for i in (0, 3, 6):
+            self.assertAlmostEqual(results[i].lat, 40.446175, places=6)
+            self.assertIsNone(results[i + 1])
+            self.assertAlmostEqual(results[i + 2].lon, -79.9675, places=6)
+
+    def test_extract_many_accepts_paths(self):
+        import tempfile
+
+        from .lib.ImageGps import ImageGps
+
+        with tempfile.NamedTemporaryFile(suffix=".jpg") as tmp:
+            tmp.write(make_jpeg(PITTSBURGH_GPS))
+            tmp.flush()
+            (result,) = ImageGps.extract_many([tmp.name], max_workers=1)
+        self.assertAlmostEqual(result.lat, 40.446175, places=6)
+        self.assertIsNone(result.image)
+
+    def test_batch_matches_one_at_a_time(self):
+        from .lib.ImageGps import ImageGps, extract_gps, extract_gps_batch
+
+        items = [
+            make_jpeg(PITTSBURGH_GPS),
+            make_jpeg(),
+            make_jpeg({PIL_ExifTags.GPS.GPSVersionID: b"\x02\x02\x00\x00"}),
+            make_jpeg(PITTSBURGH_GPS, fmt="PNG"),
+            make_heif(PITTSBURGH_GPS),
+            b"junk",
+        ]
+        logging.disable(logging.FATAL)
+        try:
+            batch = extract_gps_batch(items)
+            single = [extract_gps(item) for item in items]
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertEqual(
+            [(i.lat, i.lon, i.fix) if i else None for i in batch],
+            [(i.lat, i.lon, i.fix) if i else None for i in single],
+        )
+        self.assertIsNotNone(batch[0].lat)
+        self.assertIsNone(batch[2].lat)
+
+    def test_batches_close_on_count_or_bytes(self):
+        from .lib.ImageGps import ImageGps
+
+        sizes = [
+            len(batch) for batch in ImageGps.batches(["a.jpg"] * 5 + [b"x"] * 2, 3)
+        ]
+        self.assertEqual(sizes, [3, 3, 1])
+        big = b"x" * ImageGps.BATCH_BYTES
+        sizes = [len(batch) for batch in ImageGps.batches([b"x", big, b"x"], 32)]
+        self.assertEqual(sizes, [2, 1])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class GpsCacheTests(SimpleTestCase):
+    def setUp(self):
+        from .lib.GpsCache import GpsCache
+
+        caches["gps"].clear()
+        self.cache = GpsCache(maxsize=2)
+
+    def test_second_lookup_is_a_memory_hit(self):
+        data = make_jpeg(PITTSBURGH_GPS)
+        extract = MagicMock(wraps=views.ImageGps.from_image_bytes)
+        first = self.cache.get_or_extract(BytesIO(data), extract)
+        second = self.cache.get_or_extract(BytesIO(data), extract)
+        self.assertEqual(extract.call_count, 1)
+        self.assertEqual((first.lat, first.lon), (second.lat, second.lon))
+        self.assertIsNone(first.image)
+        self.assertEqual(self.cache.stats()["memory_hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_shared_tier_serves_other_workers(self):
+        from .lib.GpsCache import GpsCache
+
+        data = make_jpeg(PITTSBURGH_GPS)
+        self.cache.get_or_extract(data)
+        other_worker = GpsCache()
+        extract = MagicMock()
+        image = other_worker.get_or_extract(data, extract)
+        extract.assert_not_called()
+        self.assertAlmostEqual(image.lat, 40.446175, places=6)
+        self.assertEqual(other_worker.stats()["shared_hits"], 1)
+
+    def test_non_images_are_cached_too(self):
+        extract = MagicMock(return_value=None)
+        self.assertIsNone(self.cache.get_or_extract(b"junk", extract))
+        self.cache.clear()
+        self.assertIsNone(self.cache.get_or_extract(b"junk", extract))
+        self.assertEqual(extract.call_count, 1)
+        self.assertEqual(self.cache.stats()["shared_hits"], 1)
+
+    def test_memory_tier_is_bounded(self):
+        for i in range(5):
+            self.cache.get_or_extract(b"junk-%d" % i, MagicMock(return_value=None))
+        self.assertEqual(self.cache.stats()["memory_size"], 2)
+
+    def test_key_depends_on_head_and_length(self):
+        head = b"x" * self.cache.HEAD_BYTES
+        self.assertEqual(
+            self.cache.key_for(head + b"a"), self.cache.key_for(head + b"b")
+        )
+        self.assertNotEqual(
+            self.cache.key_for(head + b"a"), self.cache.key_for(head + b"ab")
+        )
+        self.assertNotEqual(
+            self.cache.key_for(b"a" + head), self.cache.key_for(b"b" + head)
+        )
+
+
+@override_settings(
+    CACHES=TEST_CACHES, GPS_STORE_OBSERVATIONS=False, GPS_THUMBNAILS=False
+)
+class TracingTests(SimpleTestCase):
+    exporter = None
+
+    @classmethod
+    def setUpClass(cls):
+        from .lib.Tracing import Tracing
+
+        super().setUpClass()
+        if TracingTests.exporter is None:
+            TracingTests.exporter = Tracing.configure("memory")
+
+    def setUp(self):
+        logging.disable(logging.FATAL)
+        self.factory = RequestFactory()
+        gps_cache.clear()
+        caches["gps"].clear()
+        caches["webhooks"].clear()
+        self.exporter.clear()
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def spans(self):
+        return {span.name: span for span in self.exporter.get_finished_spans()}
+
+    def test_email_pipeline_spans(self):
+        uploaded = SimpleUploadedFile(
+            "photo.jpg", make_jpeg(PITTSBURGH_GPS), content_type="image/jpeg"
+        )
+        post_data = {"from": "user@example.com", "subject": "s", "attachments": "1"}
+        request = self.factory.post("/gps/rcv_image_email", data=post_data)
+        request.FILES["attachment1"] = uploaded
+        views.rcv_image_email(request)
+
+        spans = self.spans()
+        for name in (
+            "request.parse",
+            "get_inputs_from_email",
+            "GpsCache.get_or_extract",
+            "ImageGps.from_image_bytes",
+            "ImageGps.from_image_header",
+            "ImageGps.get_lat_lon",
+            "EmailReply.send",
+        ):
+            self.assertIn(name, spans)
+        view = spans["gps.rcv_image_email"]
+        self.assertEqual(view.attributes["email.process_state"], "Success")
+        self.assertEqual(
+            spans["ImageGps.from_image_header"].attributes["image.format"], "JPEG"
+        )
+        self.assertEqual(
+            spans["ImageGps.from_image_bytes"].parent.span_id,
+            spans["GpsCache.get_or_extract"].context.span_id,
+        )
+        self.assertEqual(
+            spans["ImageGps.from_image_bytes"].attributes["image.engine"], "header"
+        )
+
+    def test_pillow_fallback_spans(self):
+        from .lib.ImageGps import ImageGps
+
+        data = make_jpeg(PITTSBURGH_GPS, fmt="WEBP")
+        ImageGps.from_image_bytes(BytesIO(data))
+        spans = self.spans()
+        for name in ("Image.open", "ImageGps.get_exif", "ImageGps.get_gps_ifd"):
+            self.assertIn(name, spans)
+        self.assertEqual(spans["Image.open"].attributes["image.format"], "WEBP")
+        self.assertEqual(
+            spans["ImageGps.from_image_bytes"].attributes["image.bytes"], len(data)
+        )
+
+    def test_mms_media_fetch_span(self):
+        fake_resp = MagicMock(status_code=404, content=b"")
+        with patch.object(views, "TWILIO_ACCOUNT_SID", "sid"), patch.object(
+            views, "TWILIO_AUTH_TOKEN", "token"
+        ), patch.object(views.media_fetcher.session, "get", return_value=fake_resp):
+            post_data = {"NumMedia": "1", "MediaUrl0": "https://example.com/m"}
+            request = self.factory.post("/gps/image_via_mms", data=post_data)
+            views.rcv_image_mms(request)
+        span = self.spans()["twilio.media_fetch"]
+        self.assertEqual(span.attributes["http.response.status_code"], 404)
+
+
+class DmsArraysTests(SimpleTestCase):
+    def test_matches_scalar_path_exactly(self):
+        import random
+
+        from .lib.DmsArrays import DmsArrays
+        from .lib.ImageGps import ImageGps
+
+        rng = random.Random(8)
+
+        def r(top):
+            return IFDRational(rng.randint(0, top), rng.choice([1, 7, 100, 10**6]))
+
+        ifds = []
+        for _ in range(500):
+            ifds.append(
+                {
+                    PIL_ExifTags.GPS.GPSLatitude: (r(90), r(59), r(5999)),
+                    PIL_ExifTags.GPS.GPSLatitudeRef: rng.choice("NS"),
+                    PIL_ExifTags.GPS.GPSLongitude: (r(180), r(59), r(5999)),
+                    PIL_ExifTags.GPS.GPSLongitudeRef: rng.choice("EW"),
+                }
+            )
+        lat, lon, valid = DmsArrays.from_gps_ifds(ifds)
+        self.assertTrue(valid.all())
+        img = ImageGps(pil_image=None)
+        for i, gps_ifd in enumerate(ifds):
+            self.assertEqual((lat[i], lon[i]), img.get_lat_lon(gps_ifd))
+
+    def test_bad_entries_are_masked_not_raised(self):
+        import math
+
+        from .lib.DmsArrays import DmsArrays
+
+        lat, lon, valid = DmsArrays.convert_dms_to_dd(
+            [[10, 30, 0], [10, 30, 0], [1, 2, 3]],
+            [[1, 1, 1], [1, 0, 1], [1, 1, 1]],
+            ["S", "N", "N"],
+            [[122, 4, 48], [1, 1, 1], [float("nan"), 0, 0]],
+            [[1, 1, 1], [1, 1, 1], [1, 1, 1]],
+            [True, False, False],
+        )
+        self.assertEqual(valid.tolist(), [True, False, False])
+        self.assertEqual(lat[0], -10.5)
+        self.assertAlmostEqual(lon[0], -122.08, places=6)
+        self.assertTrue(math.isnan(lat[1]) and math.isnan(lon[2]))
+
+    def test_missing_and_malformed_values(self):
+        from .lib.DmsArrays import DmsArrays
+
+        g = PIL_ExifTags.GPS
+        ifds = [
+            {},
+            {g.GPSLatitude: (1, 2), g.GPSLongitude: (1, 2, 3)},
+            {g.GPSLatitude: "x"},
+        ]
+        lat, lon, valid = DmsArrays.from_gps_ifds(ifds)
+        self.assertFalse(valid.any())
+        self.assertEqual(DmsArrays.from_gps_ifds([])[2].shape, (0,))
+
+
+class BenchmarkTests(SimpleTestCase):
+    def test_corpus_is_deterministic_and_sized(self):
+        from .benchmarks import corpus
+
+        for fmt in corpus.FORMATS:
+            first = corpus.make_image(fmt, 20 * 1024)
+            self.assertEqual(first, corpus.make_image(fmt, 20 * 1024))
+            self.assertAlmostEqual(len(first) / (20 * 1024), 1.0, delta=0.15)
+        self.assertNotEqual(
+            corpus.make_image("JPEG", 20 * 1024, gps=True),
+            corpus.make_image("JPEG", 20 * 1024, gps=False),
+        )
+
+    def test_corpus_gps_is_found(self):
+        from .benchmarks import corpus
+        from .lib.ImageGps import ImageGps
+
+        for fmt in ("JPEG", "WEBP", "HEIC"):
+            image = ImageGps.from_image_bytes(BytesIO(corpus.make_image(fmt, 8192)))
+            self.assertAlmostEqual(image.lat, 40.446175, places=6)
+
+    def test_compare_flags_regressions(self):
+        import tempfile
+        from contextlib import redirect_stdout
+        from io import StringIO
+
+        from .benchmarks import run
+
+        old = {
+            "extraction": [
+                {"case": "a", "median_s": 1.0},
+                {"case": "b", "median_s": 1.0},
+            ]
+        }
+        new = {
+            "extraction": [
+                {"case": "a", "median_s": 1.5},
+                {"case": "b", "median_s": 0.5},
+            ]
+        }
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for name, doc in (("old", old), ("new", new)):
+                paths.append(f"{tmp}/{name}.json")
+                with open(paths[-1], "w") as f:
+                    json.dump(doc, f)
+            with redirect_stdout(StringIO()) as out:
+                self.assertEqual(run.compare(*paths), 1)
+        self.assertIn("REGRESSION", out.getvalue())
+
+
+class HeifExifTests(SimpleTestCase):
+    def setUp(self):
+        logging.disable(logging.FATAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_heif_gps_matches_jpeg(self):
+        from .lib.ImageGps import ImageGps
+
+        heif = ImageGps.from_image_bytes(BytesIO(make_heif(PITTSBURGH_GPS)))
+        jpeg = ImageGps.from_image_bytes(BytesIO(make_jpeg(PITTSBURGH_GPS)))
+        self.assertIsNotNone(heif)
+        self.assertEqual((heif.lat, heif.lon), (jpeg.lat, jpeg.lon))
+
+    def test_heif_without_gps_is_still_an_image(self):
+        from .lib.ImageGps import ImageGps
+
+        image = ImageGps.from_image_bytes(make_heif())
+        self.assertIsNotNone(image)
+        self.assertIsNone(image.lat)
+
+    def test_heif_reads_only_the_exif_range(self):
+        from .lib.ByteSource import ByteSource
+        from .lib.HeifExif import HeifExif
+
+        data = make_heif(PITTSBURGH_GPS, image_bytes=b"\x00" * 100_000)
+        reads = []
+        source = ByteSource(data)
+        read_at = source.read_at
+        source.read_at = lambda offset, length: reads.append(offset + length) or (
+            read_at(offset, length)
+        )
+        self.assertTrue(HeifExif.is_heif(source))
+        self.assertTrue(HeifExif.read_gps_ifd(source))
+        self.assertLess(max(reads), 2048)
+
+    def test_not_heif(self):
+        from .lib.ByteSource import ByteSource
+        from .lib.HeifExif import HeifExif
+
+        self.assertFalse(HeifExif.is_heif(ByteSource(make_jpeg())))
+        self.assertFalse(HeifExif.is_heif(ByteSource(box(b"ftyp", b"isom" * 3))))
+
+
+class ExtractGpsCommandTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.root = self.dir.name + "/photos"
+        os.makedirs(self.root + "/sub")
+        with open(self.root + "/a.jpg", "wb") as f:
+            f.write(make_jpeg(PITTSBURGH_GPS))
+        with open(self.root + "/sub/b.jpg", "wb") as f:
+            f.write(make_jpeg())
+        with open(self.root + "/notes.txt", "w") as f:
+            f.write("not a photo")
+        with zipfile.ZipFile(self.root + "/more.zip", "w") as archive:
+            archive.writestr("c.heic", make_heif(PITTSBURGH_GPS))
+            archive.writestr("d.jpg", make_jpeg(PITTSBURGH_GPS))
+
+    def extract(self, *args):
+        from io import StringIO
+
+        from django.core.management import call_command
+
+        stdout = StringIO()
+        call_command("extract_gps", self.root, *args, stdout=stdout, stderr=StringIO())
+        return stdout.getvalue()
+
+    def test_csv_in_stable_order(self):
+        rows = self.extract("--workers", "1").splitlines()
+        self.assertEqual(rows[0].split(",")[0], "path")
+        paths = [row.split(",")[0].removeprefix(self.root) for row in rows[1:]]
+        self.assertEqual(
+            paths, ["/a.jpg", "/more.zip!c.heic", "/more.zip!d.jpg", "/sub/b.jpg"]
+        )
+        self.assertEqual(
+            [row.split(",")[-1] for row in rows[1:]], ["ok", "ok", "ok", "no_gps"]
+        )
+
+    def test_geojson_has_only_located_images(self):
+        collection = json.loads(self.extract("--format", "geojson", "--workers", "1"))
+        self.assertEqual(collection["type"], "FeatureCollection")
+        self.assertEqual(len(collection["features"]), 3)
+        lon, lat = collection["features"][0]["geometry"]["coordinates"]
+        self.assertAlmostEqual(lat, 40.446175)
+        self.assertAlmostEqual(lon, -79.9675)
+
+    def test_resume_from_checkpoint(self):
+        output = self.dir.name + "/out.geojson"
+        checkpoint = self.dir.name + "/out.ckpt"
+        resumable = ["--format", "geojson", "--workers", "1"]
+        resumable += ["--output", output, "--checkpoint", checkpoint]
+        self.extract(*resumable, "--max-files", "2", "--checkpoint-every", "1")
+        with open(checkpoint) as f:
+            self.assertEqual(json.load(f)["done"], 2)
+        self.extract(*resumable)
+        with open(output) as f:
+            resumed = f.read()
+        self.assertEqual(resumed, self.extract("--format", "geojson", "--workers", "1"))
+        json.loads(resumed)
+
+    def test_unreadable_sources_are_error_rows(self):
+        import tarfile
+
+        with open(self.root + "/bad.zip", "wb") as f:
+            f.write(b"not a zip")
+        with tarfile.open(self.root + "/sub/cut.tar.gz", "w:gz") as archive:
+            archive.add(self.root + "/a.jpg", "f.jpg")
+        with open(self.root + "/sub/cut.tar.gz", "r+b") as f:
+            f.truncate(f.seek(0, os.SEEK_END) // 2)
+        os.symlink(self.root + "/missing.jpg", self.root + "/gone.jpg")
+        with zipfile.ZipFile(self.root + "/crc.zip", "w") as archive:
+            archive.writestr("e.jpg", make_jpeg(PITTSBURGH_GPS))
+        with open(self.root + "/crc.zip", "r+b") as f:
+            f.seek(200)
+            f.write(b"\xff" * 8)
+
+        rows = self.extract("--workers", "1").splitlines()[1:]
+        results = {
+            row.split(",")[0].removeprefix(self.root): row.split(",")[-1]
+            for row in rows
+        }
+        self.assertEqual(
+            results,
+            {
+                "/a.jpg": "ok",
+                "/bad.zip": "error",
+                "/crc.zip!e.jpg": "error",
+                "/gone.jpg": "error",
+                "/more.zip!c.heic": "ok",
+                "/more.zip!d.jpg": "ok",
+                "/sub/b.jpg": "no_gps",
+                "/sub/cut.tar.gz!f.jpg": "error",
+                "/sub/cut.tar.gz": "error",
+            },
+        )
+
+
+@override_settings(GPS_STORE_OBSERVATIONS=False, GPS_THUMBNAILS=False)
+class GpsUploadHandlerTests(SimpleTestCase):
+    def setUp(self):
+        logging.disable(logging.FATAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def feed(self, data, discard=True, chunk_size=64 * 1024, keep_located=False):
+        from .lib.GpsUploadHandler import GpsUploadHandler
+
+        handler = GpsUploadHandler(discard=discard, keep_located=keep_located)
+        handler.new_file("file", "photo", "image/jpeg", len(data))
+        handler.peak = 0
+        for start in range(0, len(data), chunk_size):
+            handler.receive_data_chunk(data[start : start + chunk_size], start)
+            handler.peak = max(handler.peak, len(handler.head))
+        return handler, handler.file_complete(len(data))
+
+    def test_gps_read_before_upload_ends(self):
+        from .benchmarks.corpus import make_image
+
+        data = make_image("JPEG", 1024 * 1024)
+        handler, uploaded = self.feed(data)
+        self.assertAlmostEqual(uploaded.gps_image.lat, 40.446175)
+        self.assertTrue(uploaded.truncated)
+        self.assertEqual(uploaded.size, len(data))
+        # only the first chunk was ever buffered
+        self.assertEqual(handler.peak, 64 * 1024)
+        self.assertEqual(uploaded.read(), data[: 64 * 1024])
+
+    def test_keep_spools_whole_file(self):
+        data = make_heif(PITTSBURGH_GPS, image_bytes=b"\x01" * 300_000)
+        _, uploaded = self.feed(data, discard=False)
+        self.assertAlmostEqual(uploaded.gps_image.lon, -79.9675)
+        self.assertFalse(hasattr(uploaded, "truncated"))
+        self.assertEqual(uploaded.read(), data)
+        uploaded.close()
+
+    def test_keep_located_spools_only_photos_with_coordinates(self):
+        from .benchmarks.corpus import make_image
+
+        data = make_image("JPEG", 1024 * 1024)
+        handler, uploaded = self.feed(data, keep_located=True)
+        self.assertAlmostEqual(uploaded.gps_image.lat, 40.446175)
+        self.assertFalse(hasattr(uploaded, "truncated"))
+        self.assertEqual(uploaded.read(), data)
+        # spooled to disk, not held in memory
+        self.assertLessEqual(handler.peak, 64 * 1024)
+        uploaded.close()
+
+        # no coordinates, no thumbnail: discarded as before
+        data = make_jpeg() + b"\x00" * 300_000
+        _, uploaded = self.feed(data, keep_located=True)
+        self.assertIsNone(uploaded.gps_image.lat)
+        self.assertTrue(uploaded.truncated)
+
+    def test_unparsed_formats_are_left_for_pillow(self):
+        from .lib.ImageGps import ImageGps
+
+        data = make_jpeg(PITTSBURGH_GPS, fmt="WEBP")
+        _, uploaded = self.feed(data, chunk_size=100)
+        self.assertFalse(hasattr(uploaded, "gps_image"))
+        self.assertEqual(uploaded.read(), data)
+        uploaded.seek(0)
+        self.assertAlmostEqual(ImageGps.from_image_bytes(uploaded).lat, 40.446175)
+        uploaded.close()
+
+    def test_memory_bounded_without_exif(self):
+        from .lib.GpsUploadHandler import GpsUploadHandler
+
+        # a JPEG that keeps going with APP segments and no Exif
+        segment = b"\xff\xe2" + (65535).to_bytes(2, "big") + b"\x00" * 65533
+        data = b"\xff\xd8" + segment * 20
+        handler, uploaded = self.feed(data)
+        self.assertLessEqual(handler.peak, GpsUploadHandler.MAX_HEAD_BYTES)
+        # JpegExif gives up after MAX_SCAN_BYTES, which leaves it to Pillow
+        self.assertFalse(hasattr(uploaded, "gps_image"))
+        self.assertEqual(uploaded.read(), data)
+        uploaded.close()
+
+    @override_settings(CACHES=TEST_CACHES)
+    def test_gps_ifd_without_coordinates(self):
+        from django.test import Client
+
+        # what phones write without a fix: a GPS IFD with only GPSVersionID
+        data = make_jpeg({PIL_ExifTags.GPS.GPSVersionID: b"\x02\x02\x00\x00"})
+        _, uploaded = self.feed(data)
+        self.assertIsNone(uploaded.gps_image.lat)
+        self.assertIsNone(uploaded.gps_image.lon)
+
+        upload = SimpleUploadedFile("photo.jpg", data)
+        response = Client().post("/gps/rcv_image_html", {"file": upload})
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(CACHES=TEST_CACHES)
+    def test_html_view_uses_streamed_result(self):
+        from django.test import Client
+
+        from .benchmarks.corpus import make_image
+
+        upload = SimpleUploadedFile("photo.jpg", make_image("JPEG", 1024 * 1024))
+        with patch.object(views.ImageGps, "from_image_bytes") as from_image_bytes:
+            response = Client().post("/gps/rcv_image_html", {"file": upload})
+        from_image_bytes.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"40.446175", response.content)
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    ##
+    # stand-in for Twilio's media host: serves `files`, honoring single
+    # "bytes=a-b" / "bytes=a-" ranges except under /norange/, and taking
+    # 0.3s to answer under /slow/.
+    files = {}
+    ranges = []
+
+    def do_GET(self):
+        name = self.path.rsplit("/", 1)[-1]
+        data = self.files.get(name)
+        if data is None:
+            self.send_error(404)
+            return
+        if self.path.startswith("/slow/"):
+            time.sleep(0.3)
+        header = self.headers.get("Range")
+        self.ranges.append(header)
+        if header and not self.path.startswith("/norange/"):
+            first, last = header.removeprefix("bytes=").split("-")
+            first = int(first)
+            last = min(int(last), len(data) - 1) if last else len(data) - 1
+            if first >= len(data):
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {first}-{last}/{len(data)}")
+            data = data[first : last + 1]
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(GPS_STORE_OBSERVATIONS=False, GPS_THUMBNAILS=False)
+class MediaFetcherTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        import threading
+
+        from .benchmarks.corpus import make_image
+
+        super().setUpClass()
+        # the Exif segment pushed past the first range by a 100 KB APP2 run
+        app2 = b"\xff\xe2" + (50_002).to_bytes(2, "big") + b"\x00" * 50_000
+        big = make_image("JPEG", 1024 * 1024)
+        RangeRequestHandler.files = {
+            "big.jpg": big,
+            "late.jpg": big[:2] + app2 * 2 + big[2:],
+            "small.jpg": make_jpeg(PITTSBURGH_GPS),
+            "photo.webp": make_image("WEBP", 200 * 1024),
+            # a GPS IFD without coordinates, in a file bigger than the first range
+            "nofix.jpg": make_jpeg({PIL_ExifTags.GPS.GPSVersionID: b"\x02\x02\x00\x00"})
+            + b"\x00" * 200_000,
+        }
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), RangeRequestHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base = f"http://127.0.0.1:{cls.server.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        from .lib.MediaFetcher import MediaFetcher
+
+        logging.disable(logging.FATAL)
+        RangeRequestHandler.ranges.clear()
+        self.fetcher = MediaFetcher(max_workers=2)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        self.fetcher.session.close()
+
+    def test_reads_gps_from_first_range(self):
+        media = self.fetcher.fetch_partial(f"{self.base}/big.jpg")
+        self.assertAlmostEqual(media.gps_image.lat, 40.446175)
+        self.assertFalse(media.complete)
+        self.assertEqual(len(media.content), 64 * 1024)
+        self.assertEqual(RangeRequestHandler.ranges, ["bytes=0-65535"])
+
+    def test_widens_when_exif_runs_past_range(self):
+        media = self.fetcher.fetch_partial(f"{self.base}/late.jpg")
+        self.assertAlmostEqual(media.gps_image.lon, -79.9675)
+        self.assertEqual(RangeRequestHandler.ranges[0], "bytes=0-65535")
+        self.assertTrue(RangeRequestHandler.ranges[1].startswith("bytes=65536-"))
+        self.assertEqual(len(media.content), 128 * 1024)
+
+    def test_small_file_fits_first_range(self):
+        media = self.fetcher.fetch_partial(f"{self.base}/small.jpg")
+        self.assertTrue(media.complete)
+        self.assertAlmostEqual(media.gps_image.lat, 40.446175)
+
+    def test_fetches_rest_for_pillow(self):
+        media = self.fetcher.fetch_partial(f"{self.base}/photo.webp")
+        self.assertIsNone(media.gps_image)
+        self.assertTrue(media.complete)
+        self.assertEqual(media.content, RangeRequestHandler.files["photo.webp"])
+        self.assertEqual(RangeRequestHandler.ranges, ["bytes=0-65535", "bytes=65536-"])
+
+    def test_whole_if_located(self):
+        from .lib.MediaFetcher import AsyncMediaFetcher
+
+        urls = [f"{self.base}/big.jpg", f"{self.base}/nofix.jpg"]
+        located, nofix = self.fetcher.fetch_all(
+            urls, partial=True, whole_if_located=True
+        )
+        self.assertTrue(located.complete)
+        self.assertEqual(located.content, RangeRequestHandler.files["big.jpg"])
+        self.assertAlmostEqual(located.gps_image.lat, 40.446175)
+        self.assertFalse(nofix.complete)
+        self.assertIn("bytes=65536-", RangeRequestHandler.ranges)
+
+        located, nofix = asyncio.run(
+            AsyncMediaFetcher().fetch_all(
+                urls, partial=True, keep_alive=False, whole_if_located=True
+            )
+        )
+        self.assertEqual(located.content, RangeRequestHandler.files["big.jpg"])
+        self.assertAlmostEqual(located.gps_image.lat, 40.446175)
+        self.assertFalse(nofix.complete)
+
+    def test_gps_ifd_without_coordinates(self):
+        url = f"{self.base}/nofix.jpg"
+        media = self.fetcher.fetch_partial(url)
+        self.assertEqual(media.status_code, 206)
+        self.assertFalse(media.complete)
+        self.assertIsNone(media.gps_image.lat)
+        (media,) = self.fetcher.fetch_all([url], partial=True)
+        self.assertIsNone(media.gps_image.lon)
+
+        # and the MMS webhook answers instead of failing
+        post_data = {
+            "NumMedia": "1",
+            "MediaUrl0": url,
+            "MediaContentType0": "image/jpeg",
+        }
+        with override_settings(CACHES=TEST_CACHES), patch.object(
+            views, "TWILIO_ACCOUNT_SID", "sid"
+        ), patch.object(views, "TWILIO_AUTH_TOKEN", "token"):
+            response = views.rcv_image_mms(
+                RequestFactory().post("/gps/rcv_image_mms", data=post_data)
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_server_ignoring_range(self):
+        media = self.fetcher.fetch_partial(f"{self.base}/norange/big.jpg")
+        self.assertEqual(media.status_code, 200)
+        self.assertTrue(media.complete)
+        self.assertEqual(media.content, RangeRequestHandler.files["big.jpg"])
+
+    def test_missing_media(self):
+        media, missing = self.fetcher.fetch_all(
+            [f"{self.base}/small.jpg", f"{self.base}/gone.jpg"], partial=True
+        )
+        self.assertTrue(media.ok)
+        self.assertFalse(missing.ok)
+        self.assertEqual(missing.status_code, 404)
+
+    def test_async_fetch_matches_sync(self):
+        from .lib.MediaFetcher import AsyncMediaFetcher
+
+        urls = [f"{self.base}/{name}" for name in RangeRequestHandler.files]
+        urls.append(f"{self.base}/gone.jpg")
+        for partial in (False, True):
+            fetched = asyncio.run(
+                AsyncMediaFetcher().fetch_all(urls, partial=partial, keep_alive=False)
+            )
+            expected = self.fetcher.fetch_all(urls, partial=partial)
+            for got, want in zip(fetched, expected):
+                self.assertEqual(
+                    (got.status_code, got.content, got.complete),
+                    (want.status_code, want.content, want.complete),
+                )
+                self.assertEqual(
+                    got.gps_image and got.gps_image.lat,
+                    want.gps_image and want.gps_image.lat,
+                )
+
+    @override_settings(CACHES=TEST_CACHES)
+    def test_async_mms_webhooks_wait_concurrently(self):
+        from django.test import RequestFactory
+
+        def webhook():
+            post_data = {"NumMedia": "1", "MediaUrl0": f"{self.base}/slow/small.jpg"}
+            request = RequestFactory().post("/gps/rcv_image_mms", data=post_data)
+            return views.rcv_image_mms_async(request)
+
+        async def webhooks(count):
+            return await asyncio.gather(*(webhook() for _ in range(count)))
+
+        with patch.object(views, "TWILIO_ACCOUNT_SID", "sid"), patch.object(
+            views, "TWILIO_AUTH_TOKEN", "token"
+        ):
+            start = time.monotonic()
+            responses = asyncio.run(webhooks(20))
+            elapsed = time.monotonic() - start
+        # 20 media downloads of 0.3s each, waited for side by side (6s in turn)
+        self.assertLess(elapsed, 3.0)
+        for response in responses:
+            self.assertIn(b"GPS coords detected: 40.446175, -79.9675", response.content)
+
+
+class ReplyMailerTests(SimpleTestCase):
+    def setUp(self):
+        from .benchmarks.mail import SmtpStandIn
+
+        self.server = SmtpStandIn().start()
+        self.addCleanup(self.server.stop)
+
+    def smtp(self):
+        from .benchmarks.mail import smtp_settings
+
+        return override_settings(**smtp_settings(self.server))
+
+    def reply(self, i):
+        from django.core.mail import EmailMessage
+
+        return EmailMessage("s", f"reply {i}", "bot@example.com", ["u@example.com"])
+
+    def test_replies_share_one_connection(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from .lib.ReplyMailer import ReplyMailer
+
+        mailer = ReplyMailer(connections=1)
+        with self.smtp(), ThreadPoolExecutor(8) as pool:
+            sent = list(pool.map(lambda i: mailer.send(self.reply(i)), range(20)))
+        self.assertEqual(sent, [1] * 20)
+        self.assertEqual(len(self.server.messages), 20)
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(mailer.stats(), {"connections": 1, "connects": 1})
+
+    def test_reconnects_when_connection_dropped(self):
+        from .lib.ReplyMailer import ReplyMailer
+
+        self.server.drop_after = 2
+        mailer = ReplyMailer(connections=1)
+        with self.smtp():
+            for i in range(5):
+                mailer.send(self.reply(i))
+        self.assertEqual(len(self.server.messages), 5)
+        self.assertEqual(self.server.connections, 3)
+
+    def test_idle_connection_is_checked(self):
+        from .lib.ReplyMailer import MailConnection
+
+        self.server.drop_after = 1
+        connection = MailConnection()
+        with self.smtp():
+            connection.send(self.reply(0))
+            connection.last_used -= MailConnection.HEALTH_CHECK_AFTER
+            with self.assertLogs("gps.lib.ReplyMailer", "INFO") as logs:
+                connection.send(self.reply(1))
+        self.assertIn("idle mail connection went away", logs.output[0])
+        self.assertEqual(connection.connects, 2)
+        self.assertEqual(len(self.server.messages), 2)
+
+    def test_timed_out_reply_is_not_sent_later(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from .lib.ReplyMailer import MailConnection, ReplyMailer
+
+        sending = threading.Event()
+        release = threading.Event()
+        sent = []
+
+        def send(connection, message):
+            sending.set()
+            release.wait(5)
+            sent.append(message.body)
+            return 1
+
+        mailer = ReplyMailer(connections=1)
+        with patch.object(MailConnection, "send", send), ThreadPoolExecutor(1) as pool:
+            first = pool.submit(mailer.send, self.reply(0))
+            self.assertTrue(sending.wait(5))
+            with self.assertRaises(TimeoutError), self.assertLogs(
+                "gps.lib.ReplyMailer", "WARNING"
+            ):
+                mailer.send(self.reply(1), timeout=0.1)
+            release.set()
+            self.assertEqual(first.result(5), 1)
+            # the sender thread skips the withdrawn reply
+            self.assertEqual(mailer.send(self.reply(2)), 1)
+        self.assertEqual(sent, ["reply 0", "reply 2"])
+
+    def test_send_failure_is_raised(self):
+        from .lib.ReplyMailer import ReplyMailer
+
+        mailer = ReplyMailer(connections=1)
+        self.server.stop()
+        with self.smtp(), self.assertRaises(OSError):
+            mailer.send(self.reply(0))
+
+    def test_email_reply_uses_mailer(self):
+        from django.core import mail
+        from .lib.EmailReply import EmailReply
+
+        EmailReply("u@example.com", "Re: s", "ok").send()
+        self.assertEqual(mail.outbox[-1].to, ["u@example.com"])
+        self.assertIn("ok", mail.outbox[-1].body)
+
+    def test_sendgrid_backend(self):
+        from django.core.mail import EmailMultiAlternatives
+        from .lib.SendGridBackend import SendGridBackend
+
+        message = EmailMultiAlternatives(
+            "s", "text", "Bot <bot@example.com>", ["u@example.com"]
+        )
+        message.attach_alternative("<p>text</p>", "text/html")
+        backend = SendGridBackend(api_key="key")
+        with patch("requests.Session.post") as post:
+            self.assertEqual(backend.send_messages([message]), 1)
+        self.assertIsNone(backend.session)
+        (url,) = post.call_args.args
+        self.assertEqual(url, SendGridBackend.API_URL)
+        self.assertEqual(
+            post.call_args.kwargs["json"],
+            {
+                "personalizations": [{"to": [{"email": "u@example.com"}]}],
+                "from": {"email": "bot@example.com", "name": "Bot"},
+                "subject": "s",
+                "content": [
+                    {"type": "text/plain", "value": "text"},
+                    {"type": "text/html", "value": "<p>text</p>"},
+                ],
+            },
+        )
+
+
+@override_settings(
+    CACHES=TEST_CACHES, GPS_STORE_OBSERVATIONS=False, GPS_THUMBNAILS=False
+)
+class WebhookRepliesTests(SimpleTestCase):
+    def setUp(self):
+        logging.disable(logging.FATAL)
+        self.factory = RequestFactory()
+        caches["webhooks"].clear()
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def post_mms(self, sid="SM1"):
+        data = {
+            "MessageSid": sid,
+            "NumMedia": "1",
+            "MediaUrl0": "https://example.com/m",
+        }
+        return views.rcv_image_mms(self.factory.post("/gps/rcv_image_mms", data=data))
+
+    def test_mms_retry_is_replayed(self):
+        media = MagicMock(status_code=200, content=make_jpeg(PITTSBURGH_GPS))
+        with patch.object(
+            views.media_fetcher.session, "get", return_value=media
+        ) as get:
+            first = self.post_mms()
+            retry = self.post_mms()
+            other = self.post_mms("SM2")
+        self.assertEqual(get.call_count, 2)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry["Content-Type"], "application/xml")
+        self.assertIn(b"GPS coords detected", other.content)
+
+    def email_request(self, message_id, subject="s"):
+        uploaded = SimpleUploadedFile(
+            "photo.jpg", make_jpeg(PITTSBURGH_GPS), content_type="image/jpeg"
+        )
+        post_data = {
+            "from": "user@example.com",
+            "subject": subject,
+            "attachments": "1",
+            "headers": f"Message-ID: {message_id}\nSubject: {subject}\n",
+        }
+        request = self.factory.post("/gps/rcv_image_email", data=post_data)
+        request.FILES["attachment1"] = uploaded
+        return request
+
+    def test_email_retry_sends_one_reply(self):
+        with patch.object(views.EmailReply, "send", return_value=None) as send:
+            first = views.rcv_image_email(self.email_request("<a@example.com>"))
+            retry = views.rcv_image_email(self.email_request("<a@example.com>"))
+            views.rcv_image_email(self.email_request("<b@example.com>"))
+        self.assertEqual(send.call_count, 2)
+        self.assertEqual(retry.content, first.content)
+
+    def test_email_key_without_message_id(self):
+        request = self.email_request("")
+        key = views.email_webhook_key(request)
+        self.assertTrue(key.startswith("email-post:"))
+        self.assertEqual(views.email_webhook_key(self.email_request("")), key)
+        self.assertNotEqual(
+            views.email_webhook_key(self.email_request("", subject="t")), key
+        )
+
+    def test_in_flight_duplicate_waits(self):
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        from django.http import HttpResponse
+        from .lib.WebhookReplies import WebhookReplies
+
+        replies = WebhookReplies()
+        replies.POLL_INTERVAL = 0.01
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def view(n):
+            calls.append(n)
+            started.set()
+            release.wait(5)
+            return HttpResponse(f"reply {n}")
+
+        with ThreadPoolExecutor(2) as pool:
+            first = pool.submit(replies.run, "k", view, 1)
+            started.wait(5)
+            retry = pool.submit(replies.run, "k", view, 2)
+            time.sleep(0.05)
+            self.assertFalse(retry.done())
+            release.set()
+            self.assertEqual(first.result(5).content, b"reply 1")
+            self.assertEqual(retry.result(5).content, b"reply 1")
+        self.assertEqual(calls, [1])
+        self.assertEqual(replies.stats(), {"delivered": 1, "replayed": 1})
+
+    def test_failed_delivery_is_retried(self):
+        from django.http import HttpResponse
+        from .lib.WebhookReplies import WebhookReplies
+
+        replies = WebhookReplies()
+        view = MagicMock(side_effect=[OSError("down"), HttpResponse("ok")])
+        with self.assertRaises(OSError):
+            replies.run("k", view)
+        self.assertEqual(replies.run("k", view).content, b"ok")
+        self.assertEqual(replies.run("k", view).content, b"ok")
+        self.assertEqual(view.call_count, 2)
+
+    def test_async_retry_is_replayed(self):
+        from django.http import HttpResponse
+        from .lib.WebhookReplies import WebhookReplies
+
+        replies = WebhookReplies()
+        calls = []
+
+        async def view():
+            calls.append(1)
+            return HttpResponse("ok")
+
+        async def deliver_twice():
+            return [await replies.run_async("k", view) for _ in range(2)]
+
+        responses = asyncio.run(deliver_twice())
+        self.assertEqual([r.content for r in responses], [b"ok", b"ok"])
+        self.assertEqual(len(calls), 1)
+
+
+class GeohashTests(SimpleTestCase):
+    def test_encode(self):
+        from .lib.Geohash import Geohash
+
+        self.assertEqual(Geohash.encode(57.64911, 10.40744, 11), "u4pruydqqvj")
+        self.assertEqual(Geohash.encode(40.4417, -79.9901)[:5], "dppn5")
+
+    def test_cover_contains_every_point_in_box(self):
+        from .lib.Geohash import Geohash
+
+        box = (40.40, -80.05, 40.48, -79.93)
+        cells = Geohash.cover(*box, max_cells=16)
+        self.assertLessEqual(len(cells), 16)
+        for i in range(11):
+            for j in range(11):
+                lat = box[0] + (box[2] - box[0]) * i / 10
+                lon = box[1] + (box[3] - box[1]) * j / 10
+                point = Geohash.encode(lat, lon)
+                self.assertTrue(any(point.startswith(c) for c in cells), point)
+
+    def test_cover_across_antimeridian(self):
+        from .lib.Geohash import Geohash
+
+        cells = Geohash.cover(-1, 179, 1, -179)
+        for lon in (179.5, -179.5):
+            point = Geohash.encode(0, lon)
+            self.assertTrue(any(point.startswith(c) for c in cells))
+
+
+@override_settings(
+    GPS_STORE_OBSERVATIONS=True,
+    GPS_OBSERVATION_FLUSH_SECONDS=0,
+    GPS_THUMBNAILS=False,
+)
+class GpsObservationTests(TestCase):
+    def setUp(self):
+        logging.disable(logging.FATAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def observe(self, lat, lon, timestamp=None, source="html"):
+        from .lib.ImageGps import ImageGps
+        from .models import GpsObservation
+
+        image = ImageGps()
+        image.lat, image.lon = lat, lon
+        observation = GpsObservation.from_image_gps(image, source, "hash")
+        observation.timestamp = timestamp
+        return observation
+
+    def test_in_bbox_and_between(self):
+        from datetime import datetime, timezone
+        from .models import GpsObservation
+
+        t = [datetime(2025, 6, d, tzinfo=timezone.utc) for d in (1, 2, 3)]
+        GpsObservation.objects.bulk_create(
+            [
+                self.observe(40.44, -79.99, t[0]),
+                self.observe(40.45, -80.01, t[1]),
+                self.observe(40.60, -79.99, t[2]),
+                self.observe(-33.9, 151.2, t[1]),
+            ]
+        )
+        box = GpsObservation.objects.in_bbox(40.40, -80.05, 40.48, -79.93)
+        self.assertEqual(sorted(o.lon for o in box), [-80.01, -79.99])
+        self.assertEqual(box.between(t[1], t[2]).get().lat, 40.45)
+        self.assertEqual(GpsObservation.objects.between(start=t[2]).count(), 1)
+        self.assertEqual(GpsObservation.objects.in_bbox(-90, -180, 90, 180).count(), 4)
+
+    def test_bbox_query_uses_geohash_index(self):
+        from .models import GpsObservation
+
+        plan = GpsObservation.objects.in_bbox(40.40, -80.05, 40.48, -79.93).explain()
+        self.assertIn("gps_obs_geohash_time", plan)
+
+    def test_views_store_observations(self):
+        from django.test import RequestFactory
+        from .models import GpsObservation
+
+        uploaded = SimpleUploadedFile(
+            "photo.jpg", make_jpeg(PITTSBURGH_GPS), content_type="image/jpeg"
+        )
+        request = RequestFactory().post("/gps/rcv_image_html", {"file": uploaded})
+        request._dont_enforce_csrf_checks = True
+        views.rcv_image_html(request)
+        observation = GpsObservation.objects.get()
+        self.assertEqual(observation.source, "html")
+        self.assertAlmostEqual(observation.lat, 40.446175, places=6)
+        self.assertEqual(len(observation.content_hash), 32)
+        self.assertTrue(observation.geohash.startswith("dppn"))
+
+    def test_writer_batches_rows(self):
+        from .lib.ObservationWriter import ObservationWriter
+        from .lib.ImageGps import ImageGps
+        from .models import GpsObservation
+
+        writer = ObservationWriter()
+        image = ImageGps()
+        image.lat, image.lon = 40.44, -79.99
+        with override_settings(GPS_OBSERVATION_FLUSH_SECONDS=60), patch.object(
+            ObservationWriter, "BATCH_SIZE", 3
+        ):
+            writer.add(image, "mms", b"photo")
+            writer.add(ImageGps(), "mms", b"no gps")
+            writer.add(image, "mms", b"photo")
+            self.assertEqual(GpsObservation.objects.count(), 0)
+            with self.assertNumQueries(1):
+                writer.add(image, "mms", b"photo")
+        self.assertEqual(GpsObservation.objects.count(), 3)
+        self.assertIsNone(writer.timer)
+        self.assertEqual(writer.written, 3)
+
+    def test_content_hash_covers_whole_photo(self):
+        from .lib.ObservationWriter import ObservationWriter
+
+        head = b"\xff\xd8" + b"\x00" * ObservationWriter.CONTENT_HASH_BYTES
+        first, second = head + b"first", head + b"second"
+        content_hash = ObservationWriter.content_hash
+        self.assertNotEqual(content_hash(first), content_hash(second))
+        self.assertEqual(content_hash(first), content_hash(BytesIO(first)))
+        # only the start of a photo: all there is to go on is its header
+        self.assertEqual(
+            content_hash(first, complete=False), content_hash(second, complete=False)
+        )
+        uploaded = SimpleUploadedFile("photo.jpg", first)
+        uploaded.truncated = True
+        self.assertEqual(content_hash(uploaded), content_hash(head, complete=False))
+        self.assertEqual(uploaded.tell(), 0)
+
+    def test_migrations_checked_on_first_request(self):
+        from django.core.signals import request_started
+
+        from .lib.ObservationWriter import ObservationWriter
+
+        writer = ObservationWriter()
+        request_started.disconnect(dispatch_uid=ObservationWriter.MIGRATION_CHECK)
+        writer.check_migrations_on_first_request()
+        with patch.object(writer, "start_migration_check") as start:
+            request_started.send(sender=None)
+            request_started.send(sender=None)
+        start.assert_called_once_with()
+
+    def test_check_migrations(self):
+        from django.db.migrations.executor import MigrationExecutor
+        from django.db.migrations.migration import Migration
+
+        from .lib.ObservationWriter import ObservationWriter
+
+        writer = ObservationWriter()
+        self.assertEqual(writer.check_migrations(), [])
+        plan = [(Migration("0002_more", "gps"), False)]
+        logging.disable(logging.NOTSET)
+        with patch.object(MigrationExecutor, "migration_plan", return_value=plan):
+            with self.assertLogs("gps.lib.ObservationWriter", "ERROR") as logs:
+                self.assertEqual(writer.check_migrations(), ["gps.0002_more"])
+        self.assertIn("manage.py migrate", logs.output[0])
+
+
+class KdTreeTests(SimpleTestCase):
+    def test_range_matches_brute_force(self):
+        import numpy as np
+        from .lib.KdTree import KdTree
+
+        rng = np.random.default_rng(3)
+        xs = rng.uniform(0, 100, 5000)
+        ys = rng.uniform(0, 100, 5000)
+        xs[:200] = 50.0  # ties on the split coordinate
+        tree = KdTree(xs, ys)
+        for box in [(10, 10, 20, 30), (0, 0, 100, 100), (50, 0, 50, 100), (1, 1, 1, 1)]:
+            expected = np.nonzero(
+                (xs >= box[0]) & (xs <= box[2]) & (ys >= box[1]) & (ys <= box[3])
+            )[0]
+            self.assertEqual(sorted(tree.range(*box)), expected.tolist())
+        self.assertEqual(len(KdTree([], []).range(0, 0, 1, 1)), 0)
+
+
+@override_settings(GPS_OBSERVATION_FLUSH_SECONDS=0)
+class SpatialIndexTests(TestCase):
+    def setUp(self):
+        logging.disable(logging.FATAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def store(self, points):
+        from .lib.Geohash import Geohash
+        from .models import GpsObservation
+
+        return GpsObservation.objects.bulk_create(
+            GpsObservation(
+                lat=lat,
+                lon=lon,
+                geohash=Geohash.encode(lat, lon),
+                source="mms",
+                content_hash="h",
+            )
+            for lat, lon in points
+        )
+
+    def random_points(self, count, seed=4):
+        import numpy as np
+
+        rng = np.random.default_rng(seed)
+        lats = 40.44 + rng.normal(0, 0.01, count)
+        lons = -79.99 + rng.normal(0, 0.01, count)
+        return list(zip(lats.tolist(), lons.tolist()))
+
+    def test_nearby_and_bbox_match_brute_force(self):
+        from .lib.SpatialIndex import SpatialIndex
+
+        points = self.random_points(3000)
+        rows = self.store(points)
+        index = SpatialIndex()
+        ids, distances = index.nearby(40.44, -79.99, 300)
+        expected = sorted(
+            (SpatialIndex.distances(40.44, -79.99, [o.lat], [o.lon])[0], o.id)
+            for o in rows
+        )
+        expected = [i for d, i in expected if d <= 300]
+        self.assertEqual(ids.tolist(), expected)
+        self.assertTrue(all(distances[:-1] <= distances[1:]))
+
+        box = (40.435, -79.995, 40.445, -79.985)
+        inside = [
+            o.id
+            for o in rows
+            if box[0] <= o.lat <= box[2] and box[1] <= o.lon <= box[3]
+        ]
+        self.assertEqual(sorted(index.bbox(*box).tolist()), sorted(inside))
+        self.assertEqual(index.bbox(*box, limit=5).tolist(), sorted(inside)[::-1][:5])
+
+    def test_new_rows_are_picked_up(self):
+        from .lib.SpatialIndex import SpatialIndex
+
+        index = SpatialIndex()
+        self.store([(40.44, -79.99)])
+        self.assertEqual(len(index.nearby(40.44, -79.99, 100)[0]), 1)
+        (row,) = self.store([(40.4401, -79.9901)])
+        self.assertEqual(len(index.nearby(40.44, -79.99, 100)[0]), 1)
+        index.mark_stale()
+        self.assertIn(row.id, index.nearby(40.44, -79.99, 100)[0])
+        with patch.object(SpatialIndex, "MERGE_AT", 2):
+            index.mark_stale()
+            self.store([(40.4402, -79.9902)])
+            self.assertEqual(len(index.nearby(40.44, -79.99, 100)[0]), 3)
+        self.assertEqual(len(index.ids), 3)
+        self.assertEqual(len(index.recent_ids), 0)
+
+    def test_across_antimeridian(self):
+        from .lib.SpatialIndex import SpatialIndex
+
+        self.store([(0.0, 179.9995), (0.0, -179.9995), (0.0, 179.0)])
+        index = SpatialIndex()
+        self.assertEqual(len(index.nearby(0.0, 180.0, 200)[0]), 2)
+        self.assertEqual(len(index.bbox(-1, 179.5, 1, -179.5)), 2)
+
+    def test_observations_endpoint(self):
+        from .lib.SpatialIndex import SpatialIndex
+
+        rows = self.store([(40.44, -79.99), (40.4405, -79.99), (40.45, -79.99)])
+        with patch.object(views, "spatial_index", SpatialIndex()):
+            response = views.observations(
+                staff_request("/gps/observations", {"lat": 40.44, "lon": -79.99})
+            )
+            body = json.loads(response.content)
+            self.assertEqual(
+                [o["id"] for o in body["observations"]], [rows[0].id, rows[1].id]
+            )
+            self.assertEqual(body["observations"][1]["distance_m"], 55.6)
+            self.assertFalse(body["truncated"])
+
+            response = views.observations(
+                staff_request(
+                    "/gps/observations", {"bbox": "40,-80,41,-79", "limit": "2"}
+                )
+            )
+            body = json.loads(response.content)
+            self.assertEqual(
+                [o["id"] for o in body["observations"]], [rows[2].id, rows[1].id]
+            )
+            self.assertTrue(body["truncated"])
+            self.assertEqual(body["observations"][0]["source"], "mms")
+
+            for params in (
+                {},
+                {"bbox": "1,2,3"},
+                {"lat": "95", "lon": "0"},
+                {"lat": "0", "lon": "0", "radius": "1e9"},
+            ):
+                response = views.observations(
+                    staff_request("/gps/observations", params)
+                )
+                self.assertEqual(response.status_code, 400, params)
+
+    def test_observations_staff_only(self):
+        response = self.client.get("/gps/observations", {"lat": 40.44, "lon": -79.99})
+        self.assertEqual(response.status_code, 302)
+        self.assertIn("/admin/login/", response["Location"])
+
+    def test_benchmark_ways_agree(self):
+        from .benchmarks import spatial
+
+        result = spatial.run(points=2000, queries=5, radius=500)
+        self.assertEqual(result["mismatches"], 0)
+        self.assertIn("nearby index", result["median_ms"])
+
+
+@override_settings(
+    CACHES=TEST_CACHES, GPS_STORE_OBSERVATIONS=True, GPS_OBSERVATION_FLUSH_SECONDS=0
+)
+class ObservationTilesTests(TestCase):
+    def setUp(self):
+        from .lib.ObservationTiles import ObservationTiles
+        from .lib.ObservationWriter import ObservationWriter
+        from .lib.SpatialIndex import SpatialIndex
+
+        logging.disable(logging.FATAL)
+        self.index = SpatialIndex()
+        self.tiles = ObservationTiles(self.index)
+        self.writer = ObservationWriter()
+        self.patches = [
+            patch.object(views, "observation_tiles", self.tiles),
+            patch("gps.lib.ObservationWriter.observation_tiles", self.tiles),
+            patch("gps.lib.ObservationWriter.spatial_index", self.index),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in reversed(self.patches):
+            p.stop()
+        caches["tiles"].clear()
+        logging.disable(logging.NOTSET)
+
+    def add(self, lat, lon):
+        from .lib.ImageGps import ImageGps
+
+        image = ImageGps()
+        image.lat, image.lon = lat, lon
+        self.writer.add(image, "mms", b"photo")
+
+    def features(self, z, x, y):
+        body, etag = self.tiles.get(z, x, y)
+        return json.loads(body)["features"]
+
+    def test_tile_of_and_bounds_agree(self):
+        from .lib.ObservationTiles import ObservationTiles
+
+        z = 14
+        (x,), (y,) = ObservationTiles.tile_of([40.44], [-79.99], z)
+        self.assertEqual((x, y), (4551, 6176))
+        south, west, north, east = ObservationTiles.bounds(z, x, y)
+        self.assertTrue(south <= 40.44 <= north and west <= -79.99 <= east)
+        self.assertEqual(ObservationTiles.bounds(0, 0, 0)[1::2], (-180.0, 180.0))
+
+    def test_clusters_count_every_point(self):
+        import numpy as np
+        from .lib.ObservationTiles import ObservationTiles
+
+        rng = np.random.default_rng(5)
+        for lat, lon in zip(
+            (40.44 + rng.normal(0, 0.01, 300)).tolist(),
+            (-79.99 + rng.normal(0, 0.01, 300)).tolist(),
+        ):
+            self.add(lat, lon)
+        world = self.features(0, 0, 0)
+        self.assertEqual(len(world), 1)
+        self.assertEqual(world[0]["properties"]["count"], 300)
+        lon, lat = world[0]["geometry"]["coordinates"]
+        self.assertAlmostEqual(lat, 40.44, places=2)
+        (x,), (y,) = ObservationTiles.tile_of([40.44], [-79.99], 12)
+        counts = [
+            f["properties"]["count"]
+            for dx in (-1, 0, 1)
+            for dy in (-1, 0, 1)
+            for f in self.features(12, x + dx, y + dy)
+        ]
+        self.assertEqual(sum(counts), 300)
+        self.assertGreater(len(counts), 10)
+        self.assertLessEqual(len(self.features(12, x, y)), ObservationTiles.GRID**2)
+
+    def test_endpoint_etag_and_invalidation(self):
+        from .lib.ObservationTiles import ObservationTiles
+
+        self.add(40.44, -79.99)
+        (x,), (y,) = ObservationTiles.tile_of([40.44], [-79.99], 16)
+        url = f"/gps/tiles/16/{x}/{y}"
+        response = views.tile(staff_request(url), 16, x, y)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/geo+json")
+        self.assertEqual(response["Cache-Control"], "private, no-cache")
+        (feature,) = json.loads(response.content)["features"]
+        self.assertEqual(feature["properties"]["count"], 1)
+        self.assertIn("id", feature["properties"])
+        etag = response["ETag"]
+
+        response = views.tile(staff_request(url, HTTP_IF_NONE_MATCH=etag), 16, x, y)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        # a point elsewhere leaves this tile's cache entry alone
+        far = ObservationTiles.tile_of([40.5], [-79.9], 16)
+        self.features(16, int(far[0][0]), int(far[1][0]))
+        with patch.object(self.tiles, "build", wraps=self.tiles.build) as build:
+            self.add(40.5, -79.9)
+            self.tiles.get(16, x, y)
+            build.assert_not_called()
+            self.add(40.440001, -79.990001)
+            response = views.tile(staff_request(url, HTTP_IF_NONE_MATCH=etag), 16, x, y)
+            build.assert_called_once_with(16, x, y)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        (feature,) = json.loads(response.content)["features"]
+        self.assertEqual(feature["properties"]["count"], 2)
+
+        for z, x, y in ((19, 0, 0), (2, 4, 0), (1, 0, -1)):
+            self.assertEqual(views.tile(staff_request(url), z, x, y).status_code, 404)
+
+    def test_endpoint_staff_only(self):
+        response = self.client.get("/gps/tiles/16/18205/24635")
+        self.assertEqual(response.status_code, 302)
+        self.assertIn("/admin/login/", response["Location"])
+
+
+class ObservationExportTests(TestCase):
+    def setUp(self):
+        from datetime import datetime, timezone
+        from .lib.Geohash import Geohash
+        from .models import GpsObservation
+
+        def row(lat, lon, source, day, altitude=None):
+            return GpsObservation(
+                lat=lat,
+                lon=lon,
+                geohash=Geohash.encode(lat, lon),
+                altitude=altitude,
+                timestamp=datetime(2025, 6, day, 12, tzinfo=timezone.utc),
+                source=source,
+                content_hash="h",
+            )
+
+        self.rows = GpsObservation.objects.bulk_create(
+            [
+                row(40.44, -79.99, "mms", 1, altitude=230.5),
+                row(40.45, -80.01, "email", 2),
+                row(40.60, -79.99, "html", 3),
+                row(-33.9, 151.2, "mms", 4),
+            ]
+        )
+        self.ids = [o.id for o in self.rows]
+
+    def export(self, **params):
+        response = views.export(staff_request("/gps/export", params))
+        return response, b"".join(response.streaming_content)
+
+    def test_geojson_and_filters(self):
+        response, body = self.export()
+        self.assertEqual(response["Content-Type"], "application/geo+json")
+        self.assertIn("observations.geojson", response["Content-Disposition"])
+        features = json.loads(body)["features"]
+        self.assertEqual([f["properties"]["id"] for f in features], self.ids)
+        self.assertEqual(features[0]["geometry"]["coordinates"], [-79.99, 40.44, 230.5])
+        self.assertEqual(features[1]["properties"]["source"], "email")
+
+        def ids(**params):
+            body = self.export(**params)[1]
+            return [f["properties"]["id"] for f in json.loads(body)["features"]]
+
+        self.assertEqual(ids(source="mms"), [self.ids[0], self.ids[3]])
+        self.assertEqual(ids(start="2025-06-02", end="2025-06-04"), self.ids[1:3])
+        self.assertEqual(ids(start="2025-06-02T13:00:00Z"), self.ids[2:])
+        self.assertEqual(ids(time="received", end="2025-06-04"), [])
+        self.assertEqual(ids(bbox="40.4,-80.05,40.5,-79.9"), self.ids[:2])
+        self.assertEqual(ids(bbox="-34,150,-33,152", source="mms,email"), self.ids[3:])
+
+        for params in (
+            {"format": "shp"},
+            {"source": "fax"},
+            {"start": "June"},
+            {"time": "later"},
+            {"bbox": "1,2,3"},
+        ):
+            response = views.export(staff_request("/gps/export", params))
+            self.assertEqual(response.status_code, 400, params)
+
+    def test_staff_only(self):
+        response = self.client.get("/gps/export")
+        self.assertEqual(response.status_code, 302)
+        self.assertIn("/admin/login/", response["Location"])
+
+    def test_gpx_and_kml(self):
+        import xml.etree.ElementTree as ElementTree
+
+        response, body = self.export(format="gpx", source="mms")
+        self.assertEqual(response["Content-Type"], "application/gpx+xml")
+        gpx = "{http://www.topografix.com/GPX/1/1}"
+        waypoints = ElementTree.fromstring(body).findall(f"{gpx}wpt")
+        self.assertEqual([w.get("lat") for w in waypoints], ["40.44", "-33.9"])
+        self.assertEqual(waypoints[0].find(f"{gpx}ele").text, "230.5")
+        self.assertEqual(waypoints[1].find(f"{gpx}name").text, str(self.ids[3]))
+        self.assertTrue(waypoints[0].find(f"{gpx}time").text.startswith("2025-06-01"))
+
+        response, body = self.export(format="kml")
+        kml = "{http://www.opengis.net/kml/2.2}"
+        placemarks = ElementTree.fromstring(body).iter(f"{kml}Placemark")
+        self.assertEqual(
+            [p.find(f"{kml}Point/{kml}coordinates").text for p in placemarks][:2],
+            ["-79.99,40.44,230.5", "-80.01,40.45"],
+        )
+
+    def test_streams_in_chunks(self):
+        from asgiref.sync import async_to_sync
+        from .lib.ObservationExport import ObservationExport
+
+        with patch.object(ObservationExport, "CHUNK_BYTES", 100), patch.object(
+            ObservationExport, "ITERATOR_CHUNK", 2
+        ):
+            chunks = list(ObservationExport("geojson", {}).chunks())
+            self.assertGreater(len(chunks), 3)
+            self.assertEqual(len(json.loads("".join(chunks))["features"]), 4)
+
+            async def collect():
+                return [c async for c in ObservationExport("gpx", {}).async_chunks()]
+
+            chunks = async_to_sync(collect)()
+            self.assertGreater(len(chunks), 3)
+            self.assertTrue(chunks[-1].endswith("</gpx>\n"))
+
+    def test_command(self):
+        from django.core.management import CommandError, call_command
+
+        with tempfile.TemporaryDirectory() as dir:
+            path = dir + "/out.kml"
+            call_command(
+                "export_observations",
+                "--format",
+                "kml",
+                "--output",
+                path,
+                "--source",
+                "html",
+            )
+            with open(path) as f:
+                body = f.read()
+        self.assertEqual(body.count("<Placemark>"), 1)
+        self.assertIn("-79.99,40.6", body)
+        with self.assertRaises(CommandError):
+            call_command("export_observations", "--bbox", "north")
+
+
+class ThumbnailerTests(SimpleTestCase):
+    def setUp(self):
+        from .lib.ImageGps import ImageGps
+        from .lib.Thumbnailer import Thumbnailer
+
+        logging.disable(logging.FATAL)
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        settings = override_settings(MEDIA_ROOT=self.dir.name, GPS_THUMBNAILS=True)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.thumbnailer = Thumbnailer()
+        self.image = ImageGps()
+        self.image.lat, self.image.lon = 40.44, -79.99
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_render_drafts_and_rotates(self):
+        from PIL.JpegImagePlugin import JpegImageFile
+
+        from .benchmarks.thumbnails import make_photo
+        from .lib.Thumbnailer import Thumbnailer
+
+        data = make_photo(2048, 1536)
+        drafts = []
+        draft = JpegImageFile.draft
+
+        def record(image, mode, size):
+            drafts.append(size)
+            return draft(image, mode, size)
+
+        with patch.object(JpegImageFile, "draft", record):
+            images = Thumbnailer.render(data)
+        # decoded at 1/2 scale, 1024x768, the smallest at least 960x720
+        self.assertEqual(drafts, [(960, 720)])
+        # Orientation 6: the thumbnails are portrait
+        self.assertEqual(images[640].size, (480, 640))
+        self.assertEqual(images[160].size, (120, 160))
+
+    def test_submit_writes_once_and_view_serves(self):
+        data = make_jpeg(PITTSBURGH_GPS, size=(800, 600))
+        with patch.object(views, "thumbnailer", self.thumbnailer):
+            content_hash = self.thumbnailer.submit(self.image, data)
+            self.assertEqual(len(content_hash), 32)
+            response = views.thumbnail(RequestFactory().get("/"), content_hash, 160)
+            self.assertEqual(response["Content-Type"], "image/jpeg")
+            thumb = PIL_Image.open(BytesIO(b"".join(response.streaming_content)))
+            self.assertEqual(thumb.size, (160, 120))
+            for args in ((content_hash, 100), ("../../etc", 160), ("0" * 32, 160)):
+                with self.assertRaises(Http404):
+                    views.thumbnail(RequestFactory().get("/"), *args)
+
+        with patch.object(self.thumbnailer, "make") as make:
+            self.assertEqual(self.thumbnailer.submit(self.image, data), content_hash)
+            make.assert_not_called()
+        self.assertEqual(self.thumbnailer.made, 1)
+
+    def test_skips_what_it_cannot_thumbnail(self):
+        from .lib.ImageGps import ImageGps
+
+        data = make_jpeg(PITTSBURGH_GPS)
+        uploaded = SimpleUploadedFile("photo.jpg", data, content_type="image/jpeg")
+        uploaded.truncated = True
+        self.assertIsNone(self.thumbnailer.submit(self.image, uploaded))
+        self.assertIsNone(self.thumbnailer.submit(self.image, data, complete=False))
+        self.assertIsNone(self.thumbnailer.submit(ImageGps(), data))
+        with override_settings(GPS_THUMBNAILS=False):
+            self.assertIsNone(self.thumbnailer.submit(self.image, data))
+        content_hash = self.thumbnailer.submit(self.image, b"not a photo")
+        self.assertFalse(self.thumbnailer.wait(content_hash, 5))
+
+    def test_upload_page_shows_preview(self):
+        uploaded = SimpleUploadedFile(
+            "photo.jpg", make_jpeg(PITTSBURGH_GPS), content_type="image/jpeg"
+        )
+        request = RequestFactory().post("/gps/rcv_image_html", {"file": uploaded})
+        request._dont_enforce_csrf_checks = True
+        # the upload handler keeps located photos whole only with thumbnails on
+        with override_settings(GPS_STORE_OBSERVATIONS=False), patch.object(
+            views, "thumbnailer", self.thumbnailer
+        ), patch.object(views, "GPS_THUMBNAILS", True):
+            response = views.rcv_image_html(request)
+        preview = r'<img src="/gps/thumbnails/([0-9a-f]{32})/640.jpg"'
+        self.assertRegex(response.content.decode(), preview)
+        content_hash = re.search(preview, response.content.decode()).group(1)
+        self.assertTrue(self.thumbnailer.wait(content_hash, 5))
+
+
+class MetadataStripperTests(SimpleTestCase):
+    XMP = b"http://ns.adobe.com/xap/1.0/\x00<x:xmpmeta>Ellie's phone</x:xmpmeta>"
+
+    def setUp(self):
+        logging.disable(logging.FATAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def segment(self, code, payload):
+        return bytes([0xFF, code]) + (2 + len(payload)).to_bytes(2, "big") + payload
+
+    def mpf(self, primary_size, second_size):
+        import struct
+
+        entries = struct.pack(">LLLHH", 0x030000, primary_size, 0, 0, 0)
+        entries += struct.pack(">LLLHH", 0, second_size, primary_size, 0, 0)
+        ifd = struct.pack(">H", 1) + struct.pack(">HHLL", 0xB002, 7, 32, 26)
+        return b"MPF\x00MM\x00*" + struct.pack(">L", 8) + ifd + b"\0" * 4 + entries
+
+    def phone_jpeg(self):
+        exif = PIL_Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010F] = "Apple"
+        exif.get_ifd(PIL_ExifTags.IFD.GPSInfo).update(PITTSBURGH_GPS)
+        out = BytesIO()
+        PIL_Image.linear_gradient("L").convert("RGB").save(out, "JPEG", exif=exif)
+        jpeg = out.getvalue()
+        second = make_jpeg(PITTSBURGH_GPS)
+        extra = self.segment(0xE1, self.XMP) + self.segment(0xFE, b"shot at home")
+        extra += self.segment(0xE2, self.mpf(0, 0))
+        primary = len(jpeg) + len(extra)
+        extra = extra.replace(self.mpf(0, 0), self.mpf(primary, len(second)))
+        return jpeg[:2] + extra + jpeg[2:], jpeg, second
+
+    def test_jpeg(self):
+        import numpy as np
+        from .lib.ImageGps import ImageGps
+        from .lib.MetadataStripper import MetadataStripper
+
+        original, plain, second = self.phone_jpeg()
+        stripped = MetadataStripper.strip(original + second)
+        self.assertIsNone(ImageGps.from_image_bytes(BytesIO(stripped)).lat)
+        for secret in (b"Ellie", b"shot at home", b"Apple", b"MPF"):
+            self.assertNotIn(secret, stripped)
+        sos = original.index(b"\xff\xda")
+        self.assertTrue(stripped.endswith(original[sos:]))
+        image = PIL_Image.open(BytesIO(stripped))
+        self.assertEqual(dict(image.getexif()), {0x0112: 6})
+        self.assertTrue(
+            np.array_equal(
+                np.asarray(image), np.asarray(PIL_Image.open(BytesIO(plain)))
+            )
+        )
+        # no orientation, no Exif at all
+        plain = MetadataStripper.strip(make_jpeg(PITTSBURGH_GPS))
+        self.assertNotIn(b"Exif", plain)
+
+    def test_heif(self):
+        from .benchmarks.corpus import make_heif
+        from .lib.ByteSource import ByteSource
+        from .lib.HeifExif import HeifExif
+        from .lib.MetadataStripper import MetadataStripper
+
+        image_bytes = bytes(range(256)) * 16
+        original = make_heif(PITTSBURGH_GPS, image_bytes)
+        stripped = MetadataStripper.strip(original)
+        self.assertEqual(len(stripped), len(original))
+        self.assertEqual(HeifExif.read_gps_ifd(ByteSource(stripped)), {})
+        self.assertTrue(stripped.endswith(image_bytes))
+        self.assertNotEqual(bytes(stripped), original)
+
+    def test_heif_short_exif_item_is_a_value_error(self):
+        from .benchmarks.corpus import make_heif
+        from .lib.HeifExif import HeifExif
+        from .lib.MetadataStripper import MetadataStripper
+
+        original = make_heif(PITTSBURGH_GPS)
+        with patch.object(HeifExif, "item_extents", return_value=[(0, 2)]):
+            with self.assertRaises(ValueError):
+                MetadataStripper.strip(original)
+
+    def test_files_and_archive(self):
+        from .lib.ImageGps import ImageGps
+        from .lib.MetadataStripper import MetadataStripper
+        from .lib.Thumbnailer import Thumbnailer
+
+        original, _, _ = self.phone_jpeg()
+        with tempfile.TemporaryDirectory() as dir:
+            with open(dir + "/in.jpg", "wb") as f:
+                f.write(original)
+            size = MetadataStripper.strip_file(dir + "/in.jpg", dir + "/out.jpg")
+            self.assertEqual(os.path.getsize(dir + "/out.jpg"), size)
+            with open(dir + "/out.jpg", "rb") as f:
+                self.assertEqual(f.read(), MetadataStripper.strip(original))
+            with self.assertRaises(ValueError):
+                MetadataStripper.strip(b"GIF89a")
+
+            image = ImageGps()
+            image.lat, image.lon = 40.44, -79.99
+            thumbnailer = Thumbnailer()
+            with override_settings(
+                MEDIA_ROOT=dir, GPS_THUMBNAILS=True, GPS_ARCHIVE_PHOTOS=True
+            ):
+                content_hash = thumbnailer.submit(image, original)
+                self.assertTrue(thumbnailer.wait(content_hash, 5))
+                path = thumbnailer.archive_path(content_hash, "jpg")
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), MetadataStripper.strip(original))
+
+
+TRAIL_GEOJSON = {
+    "type": "FeatureCollection",
+    "features": [
+        {
+            "type": "Feature",
+            "properties": {"name": "Eliza Furnace Trail"},
+            "geometry": {
+                "type": "LineString",
+                "coordinates": [[-80.0, 40.446], [-79.99, 40.446], [-79.98, 40.446]],
+            },
+        },
+        {
+            "type": "Feature",
+            "properties": {"name": "Point State Park Loop"},
+            "geometry": {
+                "type": "MultiLineString",
+                "coordinates": [[[-80.02, 40.44], [-80.02, 40.45]]],
+            },
+        },
+    ],
+}
+
+
+class PageCacheTests(SimpleTestCase):
+    def setUp(self):
+        from .lib.PageCache import page_cache
+
+        logging.disable(logging.FATAL)
+        page_cache.clear()
+        self.addCleanup(page_cache.clear)
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_rendered_once_with_validators(self):
+        from .lib.PageCache import page_cache
+        from shed import views as shed_views
+
+        rendered = page_cache.rendered
+        with patch("gps.lib.PageCache.render_to_string", return_value="<p>hi</p>") as r:
+            first = views.index(self.factory.get("/gps/"))
+            second = views.index(self.factory.get("/gps/"))
+        r.assert_called_once_with("gps/index.html", None)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.content, b"<p>hi</p>")
+        self.assertEqual(first["ETag"], second["ETag"])
+        self.assertEqual(first["Cache-Control"], "no-cache")
+        self.assertIn("GMT", first["Last-Modified"])
+
+        response = shed_views.index(self.factory.get("/"))
+        self.assertContains(response, "TrailPgh")
+        self.assertEqual(page_cache.rendered - rendered, 2)
+
+    def test_conditional_requests(self):
+        url = "/gps/rcv_image_email"
+        with patch("gps.views.TWILIO_ACCOUNT_SID", "sid"), patch(
+            "gps.views.TWILIO_AUTH_TOKEN", "token"
+        ):
+            response = views.rcv_image_email(self.factory.get(url))
+            etag, modified = response["ETag"], response["Last-Modified"]
+            self.assertEqual(response.status_code, 200)
+
+            for headers in (
+                {"HTTP_IF_NONE_MATCH": etag},
+                {"HTTP_IF_MODIFIED_SINCE": modified},
+                {"HTTP_IF_NONE_MATCH": etag, "HTTP_IF_MODIFIED_SINCE": modified},
+            ):
+                response = views.rcv_image_email(self.factory.get(url, **headers))
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.content, b"")
+                self.assertEqual(response["ETag"], etag)
+
+            # a stale copy, or a different page, gets the whole page again
+            stale = views.rcv_image_email(
+                self.factory.get(url, HTTP_IF_NONE_MATCH='"old"')
+            )
+            self.assertEqual(stale.status_code, 200)
+            mms = views.rcv_image_mms(
+                self.factory.get("/gps/rcv_image_mms", HTTP_IF_NONE_MATCH=etag)
+            )
+            self.assertEqual(mms.status_code, 200)
+            self.assertNotEqual(mms["ETag"], etag)
+
+    def test_what_is_kept(self):
+        from .lib.PageCache import page_cache
+
+        request = self.factory.get("/gps/rcv_image_html")
+        cases = (
+            ({"GPS_THUMBNAILS": False}, "they are not saved"),
+            ({"GPS_THUMBNAILS": True}, "a small preview of it is kept"),
+            (
+                {"GPS_THUMBNAILS": True, "GPS_ARCHIVE_PHOTOS": True},
+                "with its location and other personal metadata removed",
+            ),
+        )
+        for options, text in cases:
+            with self.subTest(options), override_settings(
+                GPS_STORE_OBSERVATIONS=True, **options
+            ):
+                self.assertContains(views.rcv_image_html(request), text)
+                page_cache.clear()
+                with patch("gps.views.TWILIO_ACCOUNT_SID", "sid"), patch(
+                    "gps.views.TWILIO_AUTH_TOKEN", "token"
+                ):
+                    page = views.rcv_image_email(
+                        self.factory.get("/gps/rcv_image_email")
+                    )
+                self.assertContains(page, text)
+                self.assertContains(page, "The GPS coordinates found are kept")
+        with override_settings(GPS_STORE_OBSERVATIONS=False):
+            self.assertNotContains(
+                views.rcv_image_html(request), "GPS coordinates found are kept"
+            )
+
+    def test_static_files_hashed_and_precompressed(self):
+        from django.templatetags.static import static
+
+        from shed import settings as shed_settings
+
+        with tempfile.TemporaryDirectory() as root, override_settings(
+            STATIC_ROOT=root, STORAGES=shed_settings.STORAGES
+        ):
+            collect_static(root)
+            url = static("css/base.css")
+            self.assertRegex(url, r"^/static/css/base\.[0-9a-f]{12}\.css$")
+            for encoding in ("br", "gzip"):
+                response = self.client.get(url, HTTP_ACCEPT_ENCODING=encoding)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response["Content-Encoding"], encoding)
+                self.assertIn("immutable", response["Cache-Control"])
+                response.close()
+
+
+class StartupTests(SimpleTestCase):
+    def setUp(self):
+        logging.disable(logging.FATAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_heavy_modules_load_lazily(self):
+        import subprocess
+        import sys
+
+        # a fresh interpreter: this one has long since imported everything
+        code = (
+            "import os, sys\n"
+            "os.environ['DJANGO_SETTINGS_MODULE'] = 'shed.settings'\n"
+            "from shed.wsgi import application\n"
+            "from django.urls import resolve\n"
+            "resolve('/gps/')\n"
+            "heavy = ['google.cloud.logging_v2', 'requests', 'aiohttp', 'PIL.Image']\n"
+            "print([m for m in heavy if m in sys.modules])\n"
+        )
+        child = subprocess.run(
+            [sys.executable, "-c", code],
+            # and without a database to open
+            env=dict(os.environ, WARMUP="False", GPS_STORE_OBSERVATIONS="False"),
+            capture_output=True,
+            text=True,
+        )
+        self.assertEqual(child.returncode, 0, child.stderr)
+        self.assertEqual(child.stdout.strip().splitlines()[-1], "[]")
+
+    def test_cloud_logging_middleware(self):
+        from google.cloud.logging_v2.handlers.middleware.request import (
+            _get_django_request,
+        )
+
+        from .lib.CloudLoggingMiddleware import CloudLoggingMiddleware
+
+        # what Cloud Logging's handlers read is set as RequestMiddleware did
+        request = RequestFactory().get("/gps/")
+        middleware = CloudLoggingMiddleware(lambda r: "response")
+        self.assertEqual(middleware(request), "response")
+        self.assertIs(_get_django_request(), request)
+
+    def test_warmup(self):
+        from .lib.PageCache import page_cache
+        from .lib.Warmup import Warmup
+
+        page_cache.clear()
+        self.addCleanup(page_cache.clear)
+        warmup = Warmup()
+        thread = warmup.start(["/gps/", "/nowhere"])
+        self.assertIs(warmup.start(["/"]), thread)
+        self.assertTrue(warmup.done.wait(30))
+        self.assertEqual(warmup.statuses, {"/gps/": 200, "/nowhere": 404})
+        self.assertIn("gps/index.html", page_cache.pages)
+
+    def test_profile_startup(self):
+        from io import StringIO
+
+        from django.core.management import call_command
+
+        from .management.commands.profile_startup import Command
+
+        marker = Command.MARKER
+        phases = Command.parse_importtime(
+            "import time: self [us] | cumulative | imported package\n"
+            "import time:       300 |       1300 |   numpy._core\n"
+            "import time:      1000 |       1300 | numpy\n"
+            f"{marker}\n"
+            "import time:      2000 |       2000 | gps.views\n"
+        )
+        self.assertEqual(
+            phases,
+            {
+                "startup": [("numpy._core", 0.0003), ("numpy", 0.001)],
+                "first_response": [("gps.views", 0.002)],
+            },
+        )
+
+        # the child serves /gps/ from a STATIC_ROOT of its own
+        stdout = StringIO()
+        with tempfile.TemporaryDirectory() as root:
+            collect_static(root)
+            with patch.dict(
+                os.environ, STATIC_ROOT=root, GPS_STORE_OBSERVATIONS="False"
+            ):
+                call_command("profile_startup", "--runs", "1", "--json", stdout=stdout)
+        result = json.loads(stdout.getvalue())
+        self.assertEqual(result["status"], "200 OK")
+        self.assertGreater(result["startup_ms"], 0)
+        self.assertGreater(result["first_response_ms"], 0)
+        top = dict(result["imports_ms"]["startup"]["top"])
+        self.assertIn("django", top)
+        self.assertNotIn("google", top)
+
+
+TRAIL_GPX = """<?xml version="1.0"?>
+<gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1">
+  <trk><name>Eliza Furnace Trail</name><trkseg>
+    <trkpt lat="40.446" lon="-80.0"/><trkpt lat="40.446" lon="-79.99"/>
+    <trkpt lat="40.446" lon="-79.98"/>
+  </trkseg></trk>
+  <rte><name>Point State Park Loop</name>
+    <rtept lat="40.44" lon="-80.02"/><rtept lat="40.45" lon="-80.02"/>
+  </rte>
+</gpx>
+"""
+
+
+class TrailNetworkTests(SimpleTestCase):
+    def setUp(self):
+        logging.disable(logging.FATAL)
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def network(self, name, content):
+        from .lib.TrailNetwork import TrailNetwork
+
+        path = os.path.join(self.dir.name, name)
+        with open(path, "w") as f:
+            f.write(content)
+        network = TrailNetwork()
+        network.configure(path, 100)
+        return network
+
+    def test_snap_distance_and_chainage(self):
+        for name, content in (
+            ("trails.geojson", json.dumps(TRAIL_GEOJSON)),
+            ("trails.gpx", TRAIL_GPX),
+        ):
+            network = self.network(name, content)
+            # ~20 m north of the trail, a quarter of the way along it
+            match = network.snap(40.446 + 20 / 111195, -79.995)
+            self.assertEqual(match.trail, "Eliza Furnace Trail", name)
+            self.assertAlmostEqual(match.distance_m, 20, delta=0.5)
+            self.assertAlmostEqual(match.chainage_m, 0.005 * 84_800, delta=15)
+            self.assertAlmostEqual(match.length_m, 0.02 * 84_800, delta=20)
+            self.assertEqual(
+                network.snap(40.445, -80.0199).trail, "Point State Park Loop"
+            )
+            self.assertIsNone(network.snap(40.46, -79.99))
+            self.assertIsNone(network.snap(None, None))
+
+    def test_bad_file_leaves_network_empty(self):
+        network = self.network("trails.geojson", "{not json")
+        self.assertEqual(len(network), 0)
+        self.assertIsNone(network.snap(40.446, -79.99))
+
+    def test_malformed_points_leave_network_empty(self):
+        gpx = TRAIL_GPX.replace(
+            '<trkpt lat="40.446" lon="-80.0"/>', '<trkpt lon="-80.0"/>'
+        )
+        geojson = json.loads(json.dumps(TRAIL_GEOJSON))
+        geojson["features"][0]["geometry"]["coordinates"][1] = [None, None]
+        for name, content in (
+            ("trails.gpx", gpx),
+            ("trails.geojson", json.dumps(geojson)),
+        ):
+            network = self.network(name, content)
+            self.assertEqual(len(network), 0, name)
+            self.assertIsNone(network.snap(40.446, -79.99))
+
+    def test_multilinestring_parts_are_one_trail(self):
+        trail = {
+            "type": "Feature",
+            "properties": {"name": "Split Trail"},
+            "geometry": {
+                "type": "MultiLineString",
+                "coordinates": [
+                    [[-80.0, 40.446], [-79.99, 40.446]],
+                    [[-79.98, 40.446], [-79.97, 40.446]],
+                ],
+            },
+        }
+        network = self.network("trails.geojson", json.dumps(trail))
+        first = network.snap(40.446, -79.99)
+        match = network.snap(40.446, -79.975)
+        self.assertEqual(match.trail, "Split Trail")
+        # on from the end of the first part, which is about 848 m long
+        self.assertAlmostEqual(match.chainage_m, 848 + 424, delta=5)
+        self.assertAlmostEqual(match.length_m, 2 * first.chainage_m, delta=1)
+
+    def test_replies_name_the_trail(self):
+        from .lib.ImageGps import ImageGps
+
+        network = self.network("trails.geojson", json.dumps(TRAIL_GEOJSON))
+        image = ImageGps()
+        image.lat, image.lon = 40.4461, -79.99
+        with patch.object(views, "trail_network", network):
+            message = views.mms_message([image])
+            result = views.result_message(
+                views.EmailProcessState.Success, 40.4461, -79.99
+            )
+        self.assertIn(
+            "GPS coords detected: 40.4461, -79.99; Eliza Furnace Trail, 0.85 km along, 11 m off the trail",
+            message,
+        )
+        self.assertTrue(
+            result.endswith("; Eliza Furnace Trail, 0.85 km along, 11 m off the trail")
+        )
+        self.assertEqual(views.trail_text(40.4461, -79.99), "")
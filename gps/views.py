@@ -1,23 +1,257 @@
+import asyncio
+import contextvars
+import csv
+import hashlib
+import json
 import logging
+import re
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email.parser import HeaderParser
 from enum import Enum
+from functools import wraps
 from io import BytesIO
 
-import requests
-from django.http import HttpResponse
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.utils.cache import get_conditional_response
 from django.shortcuts import render
-from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from opentelemetry import trace
 from twilio.twiml.messaging_response import MessagingResponse
 
-from shed.settings import INSTALLED_APPS, TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN
-from .forms import ImageUploadForm
+from shed.settings import (
+    FILE_UPLOAD_MAX_MEMORY_SIZE,
+    GPS_BATCH_UPLOAD_MAX_BYTES,
+    GPS_THUMBNAILS,
+    GPS_UPLOAD_DISCARD,
+    INSTALLED_APPS,
+    MMS_RANGE_FETCH,
+    TWILIO_ACCOUNT_SID,
+    TWILIO_AUTH_TOKEN,
+)
+from .forms import ImageBatchUploadForm, ImageUploadForm
 from .lib.EmailReply import EmailReply
+from .lib.GpsCache import gps_cache
+from .lib.GpsUploadHandler import GpsUploadHandler
 from .lib.ImageGps import ImageGps
+from .lib.MediaFetcher import async_media_fetcher, media_fetcher
+from .lib.ObservationExport import ObservationExport
+from .lib.ObservationTiles import ObservationTiles, observation_tiles
+from .lib.ObservationWriter import observation_writer
+from .lib.PageCache import page_cache
+from .lib.SpatialIndex import spatial_index
+from .lib.Thumbnailer import Thumbnailer, thumbnailer
+from .lib.Tracing import Tracing, tracer
+from .lib.TrailNetwork import trail_network
+from .lib.WebhookReplies import webhook_replies
+from .models import GpsObservation
 
 logger = logging.getLogger(__name__)
 
 
+##
+# the same for everyone: rendered once, then served with an ETag and
+# Last-Modified (see PageCache), as are the GET pages of the two webhooks.
 def index(request):
-    return render(request, "gps/index.html")
+    return page_cache.response(request, "gps/index.html")
+
+
+##
+# parse the view's uploads with GpsUploadHandler, which reads the GPS data as
+# the body arrives instead of buffering whole photos. upload handlers can't
+# be changed once the body has been read, and CsrfViewMiddleware reads it, so
+# a CSRF-protected view has to be wrapped csrf_exempt -> this -> csrf_protect.
+# from: https://docs.djangoproject.com/en/5.2/topics/http/file-uploads/#modifying-upload-handlers-on-the-fly
+def streaming_gps_upload(view):
+    def use_gps_upload_handler(request):
+        # the body may already have been parsed, e.g. by a middleware
+        if not hasattr(request, "_files"):
+            request.upload_handlers = [
+                GpsUploadHandler(
+                    request, discard=GPS_UPLOAD_DISCARD, keep_located=GPS_THUMBNAILS
+                )
+            ]
+
+    if iscoroutinefunction(view):
+
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            use_gps_upload_handler(request)
+            return await view(request, *args, **kwargs)
+
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        use_gps_upload_handler(request)
+        return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+##
+# the GPS result for an uploaded file: the one GpsUploadHandler worked out
+# while it was arriving, if it could, otherwise from the (cached) file.
+def upload_gps(uploaded):
+    if hasattr(uploaded, "gps_image"):
+        return uploaded.gps_image
+    return gps_cache.get_or_extract(uploaded)
+
+
+##
+# JSON query over the stored observations, answered from the spatial index:
+#   /gps/observations?lat=40.44&lon=-79.99&radius=200  within radius meters of
+#       lat, lon (default 200), nearest first, each with its distance_m
+#   /gps/observations?bbox=south,west,north,east  everything in a viewport,
+#       newest first
+# at most `limit` observations are returned (default DEFAULT_QUERY_LIMIT, up
+# to MAX_QUERY_LIMIT); "truncated" says whether there were more. Staff
+# only, like export.
+DEFAULT_QUERY_LIMIT = 500
+MAX_QUERY_LIMIT = 5000
+MAX_QUERY_RADIUS_M = 50_000
+
+
+@tracer.start_as_current_span("gps.observations")
+@staff_member_required
+def observations(request):
+    try:
+        ids, distances, limit = observation_query(request.GET)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    truncated = len(ids) > limit
+    ids = [int(i) for i in ids[:limit]]
+    rows = GpsObservation.objects.in_bulk(ids)
+    found = []
+    for n, i in enumerate(ids):
+        row = rows.get(i)
+        if row is None:
+            continue
+        item = observation_json(row)
+        if distances is not None:
+            item["distance_m"] = round(float(distances[n]), 1)
+        found.append(item)
+    trace.get_current_span().set_attribute("observations.count", len(found))
+    return JsonResponse(
+        {"count": len(found), "truncated": truncated, "observations": found}
+    )
+
+
+##
+# (ids, distances or None, limit) for the query parameters of observations;
+# ValueError for ones that don't make sense. one id more than `limit` is
+# returned when there are more.
+def observation_query(params):
+    limit = int(params.get("limit", DEFAULT_QUERY_LIMIT))
+    if not 1 <= limit <= MAX_QUERY_LIMIT:
+        raise ValueError(f"limit must be 1 to {MAX_QUERY_LIMIT}")
+    if "bbox" in params:
+        south, west, north, east = (float(v) for v in params["bbox"].split(","))
+        if not (-90 <= south <= north <= 90 and -180 <= west <= 180):
+            raise ValueError("bbox must be south,west,north,east in degrees")
+        if not -180 <= east <= 180:
+            raise ValueError("bbox must be south,west,north,east in degrees")
+        ids = spatial_index.bbox(south, west, north, east, limit + 1)
+        return ids, None, limit
+    if "lat" in params and "lon" in params:
+        lat, lon = float(params["lat"]), float(params["lon"])
+        radius = float(params.get("radius", 200))
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError("lat, lon must be in degrees")
+        if not 0 < radius <= MAX_QUERY_RADIUS_M:
+            raise ValueError(f"radius must be 0 to {MAX_QUERY_RADIUS_M} meters")
+        ids, distances = spatial_index.nearby(lat, lon, radius, limit + 1)
+        return ids, distances, limit
+    raise ValueError("give bbox=south,west,north,east, or lat, lon and radius")
+
+
+##
+# Bulk export: GET /gps/export?format=geojson|gpx|kml streams the stored
+# observations as a download, filtered by start/end/time, source and bbox
+# (see ObservationExport). Under ASGI the response is fed by an async
+# iterator so it is sent as it is made, not read into memory first.
+# Staff only: it is where everyone who sent a photo has been, and when.
+@tracer.start_as_current_span("gps.export")
+@staff_member_required
+def export(request):
+    try:
+        exporter = ObservationExport(request.GET.get("format", "geojson"), request.GET)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    if isinstance(request, ASGIRequest):
+        chunks = exporter.async_chunks()
+    else:
+        chunks = exporter.chunks()
+    response = StreamingHttpResponse(chunks, content_type=exporter.content_type)
+    response["Content-Disposition"] = f'attachment; filename="{exporter.filename}"'
+    return response
+
+
+##
+# Map tiles: GET /gps/tiles/{z}/{x}/{y} is the observations in XYZ tile
+# z/x/y as clustered GeoJSON points (see ObservationTiles), with an ETag.
+# Clients revalidate each time (no-cache) and get a 304 unless an
+# observation has landed in the tile since. Staff only, like observations:
+# at high zoom a point on its own is where it was taken, with its id.
+@tracer.start_as_current_span("gps.tile")
+@staff_member_required
+def tile(request, z: int, x: int, y: int):
+    if not ObservationTiles.valid(z, x, y):
+        return JsonResponse({"error": f"no tile {z}/{x}/{y}"}, status=404)
+    body, etag = observation_tiles.get(z, x, y)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(body, content_type="application/geo+json")
+    response["ETag"] = etag
+    response["Cache-Control"] = "private, no-cache"
+    return response
+
+
+##
+# Thumbnails: GET /gps/thumbnails/{content hash}/{size}.jpg. they are made
+# in the background, so a request for one still being made waits for it
+# (up to THUMBNAIL_WAIT_SECONDS). named by content, so they never change.
+THUMBNAIL_WAIT_SECONDS = 10
+CONTENT_HASH = re.compile(r"[0-9a-f]{32}")
+
+
+@tracer.start_as_current_span("gps.thumbnail")
+def thumbnail(request, content_hash: str, size: int):
+    if not CONTENT_HASH.fullmatch(content_hash) or size not in Thumbnailer.SIZES:
+        raise Http404("no such thumbnail")
+    if not thumbnailer.wait(content_hash, THUMBNAIL_WAIT_SECONDS):
+        raise Http404("no such thumbnail")
+    response = FileResponse(
+        open(thumbnailer.path(content_hash, size), "rb"), content_type="image/jpeg"
+    )
+    response["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
+
+def observation_json(observation) -> dict:
+    def iso(value):
+        return value.isoformat() if value is not None else None
+
+    return {
+        "id": observation.id,
+        "lat": observation.lat,
+        "lon": observation.lon,
+        "source": observation.source,
+        "timestamp": iso(observation.timestamp),
+        "received_at": iso(observation.received_at),
+    }
 
 
 ##
@@ -33,24 +267,200 @@ def index(request):
 # While most newer iPhones have a 12MP sensor, the file size can still vary
 # depending on the scene and settings.
 # Features like HDR and Live Photos can increase the file size.
+@csrf_exempt
+@tracer.start_as_current_span("gps.rcv_image_html")
+@streaming_gps_upload
+@csrf_protect
 def rcv_image_html(request):
     form = ImageUploadForm()
     image = ImageGps(None)
     lat = None
     lon = None
-    ctx = {"form": form, "lat": lat, "lon": lon}
+    ctx = {"form": form, "lat": lat, "lon": lon, **what_is_kept()}
     if request.method == "POST":
+        parse_request(request)
         form = ImageUploadForm(request.POST, request.FILES)
         if form.is_valid():
-            image = ImageGps.from_image_bytes(request.FILES["file"])
+            image = upload_gps(request.FILES["file"])
+            observation_writer.add(
+                image, GpsObservation.Source.HTML, request.FILES["file"]
+            )
+            thumbnail = thumbnailer.submit(image, request.FILES["file"])
             lat = image.lat
             lon = image.lon
             logger.debug(f"{__name__}.rcv_image_html: {lat} {lon}")
-            ctx = {"form": form, "lat": lat, "lon": lon}
+            ctx.update(form=form, lat=lat, lon=lon, thumbnail=thumbnail)
     return render(request, "gps/upload_image.html", ctx)
 
 
+##
+# what of a photo is kept, for the pages that tell people
+# (gps/what_is_kept.html). photos are archived from the thumbnail worker, so
+# only with thumbnails on.
+def what_is_kept() -> dict:
+    return {
+        "store_observations": settings.GPS_STORE_OBSERVATIONS,
+        "thumbnails": settings.GPS_THUMBNAILS,
+        "archive_photos": settings.GPS_THUMBNAILS and settings.GPS_ARCHIVE_PHOTOS,
+    }
+
+
+##
+# Batch upload: many photos and/or ZIP archives of photos in one POST.
+# Extraction runs on ImageGps.extract_many's process pool and one CSV or
+# JSON Lines row per image is streamed back, in upload order, as soon as it
+# is ready. Under ASGI the rows go through an async iterator (see
+# async_lines), as with /gps/export.
+MAX_BATCH_IMAGES = 1000
+
+
+##
+# spool the view's uploads to temporary files, whatever their size, so a
+# batch of hundreds of photos isn't held in memory and each one reaches
+# extract_many by path; bodies over GPS_BATCH_UPLOAD_MAX_BYTES are refused
+# before any of it is read. wrapped csrf_exempt -> this -> csrf_protect for
+# the same reason as streaming_gps_upload.
+def temporary_file_uploads(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            length = int(request.META.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            length = 0
+        if length > GPS_BATCH_UPLOAD_MAX_BYTES:
+            return HttpResponse(
+                f"Uploads are limited to {GPS_BATCH_UPLOAD_MAX_BYTES // 2**20} MB"
+                " per batch.",
+                status=413,
+            )
+        if not hasattr(request, "_files"):
+            request.upload_handlers = [TemporaryFileUploadHandler(request)]
+        return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+@csrf_exempt
+@tracer.start_as_current_span("gps.rcv_images_batch")
+@temporary_file_uploads
+@csrf_protect
+def rcv_images_batch(request):
+    if request.method != "POST":
+        form = ImageBatchUploadForm()
+        return render(request, "gps/upload_images.html", {"form": form})
+
+    parse_request(request)
+    form = ImageBatchUploadForm(request.POST, request.FILES)
+    if not form.is_valid():
+        return render(request, "gps/upload_images.html", {"form": form}, status=400)
+
+    rows = batch_result_rows(form.cleaned_data["files"])
+    if form.cleaned_data["output"] == "json":
+        lines = (json.dumps(row) + "\n" for row in rows)
+        content_type = "application/x-ndjson"
+    else:
+        lines = csv_lines(rows)
+        content_type = "text/csv"
+    if isinstance(request, ASGIRequest):
+        lines = async_lines(lines)
+    response = StreamingHttpResponse(lines, content_type=content_type)
+    if content_type == "text/csv":
+        response["Content-Disposition"] = 'attachment; filename="gps.csv"'
+    return response
+
+
+##
+# `lines` as an async iterator. an ASGI StreamingHttpResponse reads a sync
+# iterator into a list before sending any of it; this sends each line as it
+# is made. each step waits on the extraction pool, so it runs on a thread of
+# its own rather than the one thread all sync code shares.
+async def async_lines(lines):
+    step = sync_to_async(next, thread_sensitive=False)
+    try:
+        while True:
+            line = await step(lines, None)
+            if line is None:
+                return
+            yield line
+    finally:
+        await sync_to_async(lines.close, thread_sensitive=False)()
+
+
+def batch_result_rows(files):
+    names = deque()
+
+    def items():
+        for name, item in iter_batch_images(files):
+            names.append(name)
+            yield item
+
+    for image in ImageGps.extract_many(items()):
+        state = image_process_state(image)
+        lat = image.lat if image is not None else None
+        lon = image.lon if image is not None else None
+        yield {
+            "file": names.popleft(),
+            "lat": lat,
+            "lon": lon,
+            "result": result_message(state, lat, lon),
+        }
+
+
+##
+# yield (name, bytes or temp file path) for each uploaded image, expanding
+# ZIP archives. files spooled to disk (see temporary_file_uploads) are passed
+# by path so they are not read into this process at all.
+def iter_batch_images(files):
+    count = 0
+    for uploaded in files:
+        if zipfile.is_zipfile(uploaded):
+            uploaded.seek(0)
+            with zipfile.ZipFile(uploaded) as archive:
+                for info in archive.infolist():
+                    if info.is_dir() or info.filename.startswith("__MACOSX/"):
+                        continue
+                    if info.file_size > FILE_UPLOAD_MAX_MEMORY_SIZE:
+                        logger.warning(
+                            f"{__name__}.iter_batch_images: skipping {info.filename}, {info.file_size} bytes"
+                        )
+                        continue
+                    count += 1
+                    if count > MAX_BATCH_IMAGES:
+                        break
+                    yield info.filename, archive.read(info)
+        else:
+            count += 1
+            if count > MAX_BATCH_IMAGES:
+                break
+            uploaded.seek(0)
+            if hasattr(uploaded, "temporary_file_path"):
+                yield uploaded.name, uploaded.temporary_file_path()
+            else:
+                yield uploaded.name, uploaded.read()
+        if count > MAX_BATCH_IMAGES:
+            logger.warning(
+                f"{__name__}.iter_batch_images: stopped after {MAX_BATCH_IMAGES} images"
+            )
+            return
+
+
+##
+# from: https://docs.djangoproject.com/en/5.2/howto/outputting-csv/#streaming-large-csv-files
+class Echo:
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    fields = ["file", "lat", "lon", "result"]
+    writer = csv.DictWriter(Echo(), fieldnames=fields)
+    yield writer.writerow(dict(zip(fields, fields)))
+    for row in rows:
+        yield writer.writerow(row)
+
+
 @csrf_exempt
+@tracer.start_as_current_span("gps.rcv_image_mms")
 def rcv_image_mms(request):
     # logger.debug(f"{__name__}.rcv_image_mms: request: {request.body}")
 
@@ -58,46 +468,189 @@ def rcv_image_mms(request):
         raise Exception("Twilio Account SID or AuthToken not set.")
 
     if request.method != "POST":
-        return render(request, "gps/image_via_mms.html")
+        return page_cache.response(request, "gps/image_via_mms.html", what_is_kept())
+
+    parse_request(request)
+    return webhook_replies.run(mms_webhook_key(request), mms_webhook, request)
+
+
+def mms_webhook(request):
+    image_urls = mms_image_urls(request)
+    fetched = []
+    if image_urls:
+        fetched = media_fetcher.fetch_all(
+            image_urls,
+            auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN),
+            partial=MMS_RANGE_FETCH,
+            # thumbnails need the whole photo
+            whole_if_located=GPS_THUMBNAILS,
+        )
+    return mms_reply(fetched)
+
 
+##
+# Async versions of the two webhooks, routed instead of the sync ones when
+# GPS_ASYNC_WEBHOOKS is set (see shed/urls.py). Served by an ASGI worker
+# (Procfile), a worker waiting on Twilio, SMTP or SendGrid just awaits and
+# keeps serving other webhooks, instead of being blocked for the duration:
+#   - media are downloaded with aiohttp (AsyncMediaFetcher);
+#   - multipart parsing, EXIF parsing and the GPS cache run on thread pools
+#     (EXIF on attachment_pool, shared with the sync email view);
+#   - the reply email is sent from a thread.
+# The request/response handling is shared with the sync views.
+async def in_thread(pool, function, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        pool, contextvars.copy_context().run, function, *args
+    )
+
+
+@csrf_exempt
+@tracer.start_as_current_span("gps.rcv_image_mms")
+async def rcv_image_mms_async(request):
+    if TWILIO_ACCOUNT_SID is None or TWILIO_AUTH_TOKEN is None:
+        raise Exception("Twilio Account SID or AuthToken not set.")
+
+    if request.method != "POST":
+        return page_cache.response(request, "gps/image_via_mms.html", what_is_kept())
+
+    await in_thread(None, parse_request, request)
+    return await webhook_replies.run_async(
+        mms_webhook_key(request), mms_webhook_async, request
+    )
+
+
+async def mms_webhook_async(request):
+    image_urls = mms_image_urls(request)
+    fetched = []
+    if image_urls:
+        fetched = await async_media_fetcher.fetch_all(
+            image_urls,
+            auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN),
+            partial=MMS_RANGE_FETCH,
+            # thumbnails need the whole photo
+            whole_if_located=GPS_THUMBNAILS,
+            # an ASGI server's event loop outlives the request
+            keep_alive=hasattr(request, "scope"),
+        )
+    return await in_thread(attachment_pool, mms_reply, fetched)
+
+
+##
+# Retries of a webhook are recognised by these keys (see WebhookReplies): the
+# MessageSid Twilio sends with every MMS, and for an email the Message-ID
+# from the headers SendGrid passes on, or if there is none a hash of the
+# whole inbound-parse post. None: don't deduplicate.
+def mms_webhook_key(request):
+    sid = request.POST.get("MessageSid") or request.POST.get("SmsMessageSid")
+    return f"mms:{sid}" if sid else None
+
+
+def email_webhook_key(request):
+    headers = HeaderParser().parsestr(request.POST.get("headers", ""))
+    message_id = (headers["Message-ID"] or "").strip()
+    if message_id:
+        return f"email:{message_id}"
+    digest = hashlib.blake2b(digest_size=16)
+    for name, values in sorted(request.POST.lists()):
+        for value in values:
+            digest.update(f"{name}={value}\n".encode())
+    for name, uploaded in sorted(request.FILES.items()):
+        digest.update(f"{name}:{uploaded.name}:{uploaded.size}\n".encode())
+    return f"email-post:{digest.hexdigest()}"
+
+
+##
+# the URLs of an MMS webhook's media worth downloading (images, or of
+# unknown type). the request must have been parsed (parse_request).
+def mms_image_urls(request):
     to = request.POST.get("To", "")
     num_media = int(request.POST.get("NumMedia", ""))
     from_ = request.POST.get("From", "")
     body = request.POST.get("Body", "")
-    media_url = request.POST.get("MediaUrl0", "")
+    media = mms_media(request.POST, num_media)
     logger.info(
-        f"{__name__}.rcv_image_mms: \n to: {to}, \n from_: {from_}, \n numMedia: {num_media}, \n body: {body}, \n mediaUrl: {media_url}"
+        f"{__name__}.rcv_image_mms: \n to: {to}, \n from_: {from_}, \n numMedia: {num_media}, \n body: {body}, \n media: {media}"
     )
     INSTALLED_APPS.append("twilio")
-    resp = MessagingResponse()
-    if num_media > 0:
-        logger.info(f"{__name__}.rcv_image_mms: media detected...")
-        r = requests.get(
-            media_url,
-            auth=(
-                TWILIO_ACCOUNT_SID,
-                TWILIO_AUTH_TOKEN,
-            ),
+    trace.get_current_span().set_attribute("mms.num_media", num_media)
+    image_urls = [url for url, content_type in media if is_image_type(content_type)]
+    if len(image_urls) < len(media):
+        logger.info(
+            f"{__name__}.rcv_image_mms: skipping {len(media) - len(image_urls)} non-image media"
         )
-        if r.status_code == 200:
-            logger.info(f"{__name__}.rcv_image_mms: MMS media retrieved...")
-            image = ImageGps.from_image_bytes(BytesIO(r.content))
-            if image is not None:
-                logger.info(
-                    f"{__name__}.rcv_image_mms: MMS media appears to be an image..."
-                )
-                lat = image.lat
-                lon = image.lon
-                logger.debug(f"{__name__}.rcv_image_mms: lat, lon: {lat}, {lon}")
-                if lat and lon:
-                    resp.message(f"Image received, GPS coords detected: {lat}, {lon}")
-                else:
-                    resp.message(f"Image received, no GPS info found.")
+    if image_urls:
+        logger.info(f"{__name__}.rcv_image_mms: media detected...")
+    return image_urls
+
 
+##
+# the TwiML reply for the fetched media (Media or None each)
+def mms_reply(fetched):
+    resp = MessagingResponse()
+    found = []
+    for item in fetched:
+        if item is None or not item.ok:
+            continue
+        logger.info(f"{__name__}.rcv_image_mms: MMS media retrieved...")
+        image = item.gps_image
+        if image is None and item.complete:
+            image = gps_cache.get_or_extract(BytesIO(item.content))
+        if image is not None:
+            logger.info(
+                f"{__name__}.rcv_image_mms: MMS media appears to be an image..."
+            )
+            logger.debug(
+                f"{__name__}.rcv_image_mms: lat, lon: {image.lat}, {image.lon}"
+            )
+            found.append(image)
+            observation_writer.add(
+                image, GpsObservation.Source.MMS, item.content, item.complete
+            )
+            thumbnailer.submit(image, item.content, item.complete)
+    if found:
+        resp.message(mms_message(found))
     return HttpResponse(str(resp), content_type="application/xml")
 
 
+##
+# [(MediaUrlN, MediaContentTypeN)] of an MMS webhook. the content type is ""
+# when Twilio didn't send one.
+def mms_media(post, num_media: int):
+    media = []
+    for i in range(num_media):
+        url = post.get(f"MediaUrl{i}", "")
+        if url:
+            media.append((url, post.get(f"MediaContentType{i}", "")))
+    return media
+
+
+##
+# media of unknown type are fetched too: only known non-images are skipped.
+def is_image_type(content_type: str) -> bool:
+    return not content_type or content_type.lower().startswith("image/")
+
+
+##
+# one reply for every image in the MMS: the single-image wording for one,
+# one line per image otherwise.
+def mms_message(images):
+    def coords(image):
+        if image.lat and image.lon:
+            found = f"GPS coords detected: {image.lat}, {image.lon}"
+            return found + trail_text(image.lat, image.lon)
+        return "no GPS info found."
+
+    if len(images) == 1:
+        return f"Image received, {coords(images[0])}"
+    lines = [f"{len(images)} images received:"]
+    lines += [f"{n}: {coords(image)}" for n, image in enumerate(images, 1)]
+    return "\n".join(lines)
+
+
 @csrf_exempt
+@tracer.start_as_current_span("gps.rcv_image_email")
+@streaming_gps_upload
 def rcv_image_email(request):
     logger.info(f"{__name__}.rcv_image_email...")
 
@@ -105,56 +658,183 @@ def rcv_image_email(request):
         raise Exception("Twilio Account SID or AuthToken not set.")
 
     if request.method != "POST":
-        return render(request, "gps/image_via_email.html")
+        return page_cache.response(request, "gps/image_via_email.html", what_is_kept())
+
+    parse_request(request)
+    return webhook_replies.run(email_webhook_key(request), email_webhook, request)
 
+
+def email_webhook(request):
+    sender, subject, attachments = email_inputs(request)
+    outcomes = attachment_outcomes(attachments)
+    reply = email_reply(sender, subject, outcomes)
+    reply.send()
+    return HttpResponse(str(reply.short_desc), content_type="application/xml")
+
+
+@csrf_exempt
+@tracer.start_as_current_span("gps.rcv_image_email")
+@streaming_gps_upload
+async def rcv_image_email_async(request):
+    logger.info(f"{__name__}.rcv_image_email...")
+
+    if TWILIO_ACCOUNT_SID is None or TWILIO_AUTH_TOKEN is None:
+        raise Exception("Twilio Account SID or AuthToken not set.")
+
+    if request.method != "POST":
+        return page_cache.response(request, "gps/image_via_email.html", what_is_kept())
+
+    await in_thread(None, parse_request, request)
+    return await webhook_replies.run_async(
+        email_webhook_key(request), email_webhook_async, request
+    )
+
+
+async def email_webhook_async(request):
+    sender, subject, attachments = email_inputs(request)
+    outcomes = await asyncio.gather(
+        *(in_thread(attachment_pool, attachment_outcome, a) for a in attachments)
+    )
+    reply = email_reply(sender, subject, outcomes)
+    await in_thread(None, reply.send)
+    return HttpResponse(str(reply.short_desc), content_type="application/xml")
+
+
+##
+# (sender, subject, attachments) of a parsed SendGrid inbound-parse request
+def email_inputs(request):
     INSTALLED_APPS.append("twilio")
-    lat = None
-    lon = None
-    outcome_state = EmailProcessState.Unset
     to, sender, subject, text, html, attachments_count, attachment_info = (
         get_inputs_from_email(request)
     )
-    if attachments_count == 0:
-        outcome_state = EmailProcessState.NoAttachment
-    elif attachments_count > 0:
-        outcome_state = EmailProcessState.HasAttachment
+    attachments = [
+        request.FILES[f"attachment{i}"]
+        for i in range(1, attachments_count + 1)
+        if f"attachment{i}" in request.FILES
+    ]
+    if attachments:
         logger.info(
-            f"{__name__}.rcv_image_email: {attachments_count} attachment(s) detected..."
+            f"{__name__}.rcv_image_email: {len(attachments)} attachment(s) detected..."
         )
-        in_memory_file = request.FILES["attachment1"]
-        image = ImageGps.from_image_bytes(in_memory_file)
+    return sender, subject, attachments
+
+
+def email_reply(sender, subject, outcomes) -> EmailReply:
+    outcome_state = email_process_state(outcomes)
+    span = trace.get_current_span()
+    span.set_attribute("email.process_state", outcome_state.name)
+    span.set_attribute("email.attachments", len(outcomes))
+    return EmailReply(
+        email_to=sender,
+        subject=f"Re: {subject}",
+        short_desc=outcomes_message(outcomes),
+    )
+
+
+##
+# Every attachment of an email is processed, concurrently, on a thread pool
+# shared by all requests (so a flood of attachments can't start unbounded
+# threads). Most JPEG/HEIC attachments were already read by GpsUploadHandler
+# as they arrived; the threads mostly matter for the ones left to Pillow and
+# for the shared cache lookups. Each task runs in a copy of the request's
+# context so its span nests under the view's.
+EMAIL_ATTACHMENT_WORKERS = 4
+attachment_pool = ThreadPoolExecutor(
+    max_workers=EMAIL_ATTACHMENT_WORKERS, thread_name_prefix="email-attachment"
+)
+
+
+##
+# [(file name, EmailProcessState, lat, lon)] in attachment order
+def attachment_outcomes(attachments):
+    if len(attachments) <= 1:
+        return [attachment_outcome(uploaded) for uploaded in attachments]
+    futures = [
+        attachment_pool.submit(contextvars.copy_context().run, attachment_outcome, a)
+        for a in attachments
+    ]
+    return [future.result() for future in futures]
+
+
+def attachment_outcome(uploaded):
+    lat = None
+    lon = None
+    with tracer.start_as_current_span("email.attachment") as span:
+        span.set_attribute("email.attachment.bytes", uploaded.size or 0)
+        image = upload_gps(uploaded)
+        observation_writer.add(image, GpsObservation.Source.EMAIL, uploaded)
+        thumbnailer.submit(image, uploaded)
+        outcome_state = EmailProcessState.HasAttachment
         if image is None:
             outcome_state = EmailProcessState.NoImage
             logger.warning(
-                f"{__name__}.rcv_image_mms: attached media does not appear to be an image. ({in_memory_file.content_type})"
+                f"{__name__}.rcv_image_email: attached media does not appear to be an image. ({uploaded.content_type})"
             )
         elif image.__class__ is ImageGps:
             outcome_state = EmailProcessState.HasImage
             logger.info(
-                f"{__name__}.rcv_image_mms: attached media appears to be an image..."
+                f"{__name__}.rcv_image_email: attached media appears to be an image..."
             )
             lat = image.lat
             lon = image.lon
             if lat and lon:
                 outcome_state = EmailProcessState.Success
                 logger.info(
-                    f"{__name__}.rcv_image_mms: GPS coords: lat, lon: {lat}, {lon}"
+                    f"{__name__}.rcv_image_email: GPS coords: lat, lon: {lat}, {lon}"
                 )
             else:
                 outcome_state = EmailProcessState.NoLatLon
                 logger.warning(
-                    f"{__name__}.rcv_image_mms: GPS info missing or incomplete. detected: lat, lon: {lat}, {lon}"
+                    f"{__name__}.rcv_image_email: GPS info missing or incomplete. detected: lat, lon: {lat}, {lon}"
                 )
-    outcome_short_desc = result_message(outcome_state, lat, lon)
-    reply = EmailReply(
-        email_to=sender,
-        subject=f"Re: {subject}",
-        short_desc=outcome_short_desc,
+        span.set_attribute("email.process_state", outcome_state.name)
+    return uploaded.name, outcome_state, lat, lon
+
+
+##
+# the state of the email as a whole: Success if any attachment had GPS
+# coordinates, otherwise the first attachment's state.
+def email_process_state(outcomes):
+    if not outcomes:
+        return EmailProcessState.NoAttachment
+    for name, state, lat, lon in outcomes:
+        if state is EmailProcessState.Success:
+            return state
+    return outcomes[0][1]
+
+
+##
+# one reply for all attachments: the plain result for a single attachment,
+# one "name: result" line per attachment otherwise.
+def outcomes_message(outcomes):
+    if len(outcomes) <= 1:
+        state = email_process_state(outcomes)
+        lat, lon = (outcomes[0][2], outcomes[0][3]) if outcomes else (None, None)
+        return result_message(state, lat, lon)
+    return "\n".join(
+        f"{name}: {result_message(state, lat, lon)}"
+        for name, state, lat, lon in outcomes
     )
-    reply.send()
-    return HttpResponse(str(outcome_short_desc), content_type="application/xml")
 
 
+##
+# read (and so parse) the POST body and uploaded files up front, in a span of
+# their own, so multipart parsing shows up separately from the work after it.
+@tracer.start_as_current_span("request.parse")
+def parse_request(request):
+    span = trace.get_current_span()
+    files = request.FILES
+    Tracing.set_attributes(
+        span,
+        {
+            "http.request.body.size": int(request.META.get("CONTENT_LENGTH") or 0),
+            "request.files": len(files),
+        },
+    )
+    return request.POST, files
+
+
+@tracer.start_as_current_span("get_inputs_from_email")
 def get_inputs_from_email(request):
     to = request.POST.get("to", "")
     sender = request.POST.get("from", "")
@@ -179,10 +859,30 @@ class EmailProcessState(Enum):
     Success = 30
 
 
+def image_process_state(image) -> EmailProcessState:
+    if image is None:
+        return EmailProcessState.NoImage
+    if image.lat and image.lon:
+        return EmailProcessState.Success
+    return EmailProcessState.NoLatLon
+
+
 def result_message(email_process_result: EmailProcessState, lat=None, lon=None):
+    if email_process_result is EmailProcessState.Success:
+        return f"GPS latitude, longitude: {lat}, {lon}" + trail_text(lat, lon)
     return {
         EmailProcessState.NoAttachment: "No attachment detected.",
         EmailProcessState.NoImage: "Attached media does not appear to be an image.",
         EmailProcessState.NoLatLon: "GPS info missing or incomplete.",
-        EmailProcessState.Success: f"GPS latitude, longitude: {lat}, {lon}",
     }[email_process_result]
+
+
+##
+# "; <trail>, <km> along, <m> off the trail" for the trail nearest lat/lon
+# (see TrailNetwork), or "" when no trail is near enough or none are loaded.
+def trail_text(lat, lon) -> str:
+    match = trail_network.snap(lat, lon)
+    if match is None:
+        return ""
+    trace.get_current_span().set_attribute("trail.name", match.trail)
+    return f"; {match.describe()}"
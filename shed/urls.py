@@ -20,13 +20,33 @@ from django.urls import path
 
 from gps.views import index as gps_index
 from gps.views import rcv_image_html, rcv_image_mms, rcv_image_email
+from gps.views import rcv_image_mms_async, rcv_image_email_async
+from gps.views import rcv_images_batch
+from gps.views import export, observations, thumbnail, tile
+from shed.settings import GPS_ASYNC_WEBHOOKS
 from shed.views import index as shed_index
 
+##
+# the Twilio/SendGrid webhooks: async views for an ASGI server, sync ones
+# for a WSGI server (see GPS_ASYNC_WEBHOOKS in settings).
+if GPS_ASYNC_WEBHOOKS:
+    rcv_image_mms = rcv_image_mms_async
+    rcv_image_email = rcv_image_email_async
+
 urlpatterns = [
     path("", shed_index, name="index"),
     path("admin/", admin.site.urls),
     path("gps/", gps_index, name="gps"),
     path("gps/rcv_image_html", rcv_image_html, name="rcv_image_html"),
+    path("gps/rcv_images_batch", rcv_images_batch, name="rcv_images_batch"),
     path("gps/rcv_image_mms", rcv_image_mms, name="rcv_image_mms"),
     path("gps/rcv_image_email", rcv_image_email, name="rcv_image_email"),
+    path("gps/observations", observations, name="observations"),
+    path("gps/export", export, name="export"),
+    path(
+        "gps/thumbnails/<str:content_hash>/<int:size>.jpg",
+        thumbnail,
+        name="thumbnail",
+    ),
+    path("gps/tiles/<int:z>/<int:x>/<int:y>", tile, name="tile"),
 ]
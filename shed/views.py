@@ -1,5 +1,5 @@
-from django.shortcuts import render
+from gps.lib.PageCache import page_cache
 
 
 def index(request):
-    return render(request, "shed/index.html")
+    return page_cache.response(request, "shed/index.html")
@@ -9,8 +9,16 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "shed.settings")
 
 application = get_wsgi_application()
+
+##
+# optional: warm the worker up in the background (see gps/lib/Warmup.py)
+if settings.WARMUP:
+    from gps.lib.Warmup import warmup
+
+    warmup.start(settings.WARMUP_PATHS)
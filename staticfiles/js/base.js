@@ -1,10 +0,0 @@
-
-document.addEventListener("DOMContentLoaded", function() {
-    // this is just a test and evidences that JS is working. remove later.
-    var didJsCompleteMsg = document.createElement("p");
-    didJsCompleteMsg.innerHTML = "JS executed.";
-    didJsCompleteMsg.style.color = "green";
-    didJsCompleteMsg.style.fontSize = "0.8em";
-    document.body.appendChild(didJsCompleteMsg);
-    // add any other JS here.
-});